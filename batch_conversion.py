@@ -0,0 +1,91 @@
+"""Batch driver shared by the platform-specific conversion scripts.
+
+``convert_batch`` runs a script's ``process_docx(input_path, output_path, server)``
+over a list of jobs, either in this process or across a process pool. Every
+pool worker owns its own LibreOfficeServer, and with it its own LibreOffice
+user profile, so concurrent instances never contend for the profile lock.
+Servers only start when a document actually needs LibreOffice.
+Results come back in job order regardless of which worker finished first.
+
+``iter_convert`` is the streaming variant: it yields each result as soon as it
+is ready and keeps only a bounded number of jobs in flight.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from tqdm import tqdm
+from libreoffice_server import LibreOfficeServer
+
+# Per-worker state, set up once by _init_worker
+_worker_server = None
+_worker_process_fn = None
+
+
+def _init_worker(process_fn, soffice_path):
+    global _worker_server, _worker_process_fn
+    _worker_process_fn = process_fn
+    if soffice_path is None:
+        return
+    # The server starts lazily on the first conversion, so a LibreOffice that
+    # fails to come up shows up as a per-file error instead of a broken pool.
+    _worker_server = LibreOfficeServer(soffice_path)
+    # atexit does not run in pool workers; Finalize does
+    Finalize(None, _worker_server.stop, exitpriority=10)
+
+
+def _run_job(job):
+    input_path, output_path = job
+    return _worker_process_fn(input_path, output_path, _worker_server)
+
+
+def convert_batch(jobs, process_fn, soffice_path=None, workers=1):
+    """Apply ``process_fn`` to every ``(input_path, output_path)`` job.
+
+    ``soffice_path`` may be None when the documents are read without LibreOffice;
+    ``process_fn`` then receives ``server=None``. Returns the list of
+    ``process_fn`` results in the same order as ``jobs``.
+    """
+    if workers <= 1:
+        server = LibreOfficeServer(soffice_path) if soffice_path else None
+        try:
+            return [
+                process_fn(input_path, output_path, server)
+                for input_path, output_path in tqdm(jobs, desc="Converting documents", unit="file")
+            ]
+        finally:
+            if server is not None:
+                server.stop()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(process_fn, soffice_path)) as pool:
+        return list(tqdm(pool.map(_run_job, jobs), total=len(jobs),
+                         desc=f"Converting documents ({workers} workers)", unit="file"))
+
+
+def iter_convert(jobs, process_fn, soffice_path=None, workers=1, in_flight=None):
+    """Yield ``process_fn`` results one by one, in job order.
+
+    ``jobs`` may be any iterable, including a generator that is still being
+    filled. With a pool, at most ``in_flight`` jobs (default: twice the number
+    of workers) are submitted but not yet yielded.
+    """
+    if workers <= 1:
+        server = LibreOfficeServer(soffice_path) if soffice_path else None
+        try:
+            for input_path, output_path in jobs:
+                yield process_fn(input_path, output_path, server)
+        finally:
+            if server is not None:
+                server.stop()
+        return
+
+    in_flight = in_flight or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(process_fn, soffice_path)) as pool:
+        futures = deque()
+        for job in jobs:
+            futures.append(pool.submit(_run_job, job))
+            if len(futures) >= in_flight:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
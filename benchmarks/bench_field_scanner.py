@@ -0,0 +1,112 @@
+"""Micro-benchmark: single-pass FIELD_SCANNER vs. one re.search per field.
+
+The per-field baseline is the extraction code as it was before the scanner:
+eight separate (uncompiled) regex scans over the full letter. Both sides are
+checked for identical results before timing.
+
+    python benchmarks/bench_field_scanner.py --letters 200 --filler 400
+"""
+import argparse
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from extract_patient_data import FIELD_SCANNER, FIELD_EXTRACTORS  # noqa: E402
+from generate_letters import FILLER  # noqa: E402
+
+
+def per_field_baseline(text):
+    """Old approach: every field re-scans the whole text."""
+    found = {}
+    tumor_match = re.search(r"(?:Tumorstadium:|Stadium:)\s*(?:TNM:\s*)?(.+?)(?=,?\s*UICC:|\n|$)",
+                            text, re.IGNORECASE)
+    if tumor_match:
+        found["tumor_status"] = tumor_match.group(1).strip()
+    else:
+        tnm_fallback = re.search(
+            r"([cpr]T(?:is|\d+[a-z]?))[\s,;]+([cpr]N(?:[0-3][a-z]?|x))[\s,;]+([cpr]M(?:0|1|x))",
+            text, re.IGNORECASE)
+        if tnm_fallback:
+            found["tumor_status"] = tnm_fallback.group(0).strip()
+    ecog_match = re.search(r"\(?ECOG[\s:-]*(?:(\d)(?:\s*-\s*(\d))?)\)?", text, re.IGNORECASE)
+    if ecog_match:
+        found["ecog"] = ecog_match.group(1) + (f"-{ecog_match.group(2)}" if ecog_match.group(2) else "")
+    birth_date_match = re.search(r"geb\.\s*am\s*(\d{2}\.\d{2}\.\d{4})", text, re.IGNORECASE)
+    if birth_date_match:
+        found["birth_date"] = birth_date_match.group(1).strip()
+    fallback_match = re.search(
+        r"(Herrn|Frau)\s+[A-ZÄÖÜ][a-zäöüß]+,\s*[A-ZÄÖÜ][a-zäöüß]+,\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}",
+        text, re.IGNORECASE)
+    if fallback_match:
+        found["intro_fallback"] = fallback_match.group(0)
+    fallback_names = re.findall(
+        r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+),\s*([A-ZÄÖÜ][a-zäöüß]+)\s*,?\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}",
+        text, re.IGNORECASE)
+    if fallback_names:
+        found["name_with_birth_date"] = fallback_names[-1]
+    return found
+
+
+def single_pass(text):
+    info = {}
+    found = FIELD_SCANNER.scan(text)
+    for extractor in FIELD_EXTRACTORS:
+        extractor(info, found)
+    if "intro_fallback" in found:
+        info["intro_fallback"] = found["intro_fallback"].group(0)
+    if "name_with_birth_date" in found:
+        info["name_with_birth_date"] = found["name_with_birth_date"].groups()
+    return info
+
+
+def make_letter(rng, filler_sentences):
+    title, last, first = rng.choice([("Herrn", "Mustermann", "Max"), ("Frau", "Beispiel", "Erika")])
+    body = [
+        "=== Page 1 ===",
+        "--- Content ---",
+        f"wir berichten über {title} {first} {last}, geb. am {rng.randint(1, 28):02d}.0{rng.randint(1, 9)}.19{rng.randint(30, 80)}, "
+        "der sich vom 01.03.2024 bis 10.03.2024 in unserer stationären Behandlung befand.",
+    ]
+    body += [rng.choice(FILLER) for _ in range(filler_sentences // 2)]
+    body.append(rng.choice([
+        "Tumorstadium: cT2b, cN1, cM0, UICC: IIIA",
+        "Diagnose: Adenokarzinom pT3 pN0 cM0 R0",
+        "Stadium: TNM: cT4 cN3 cM1",
+    ]))
+    body.append(rng.choice(["(ECOG 1)", "ECOG: 2-3", "Allgemeinzustand gut"]))
+    body += [rng.choice(FILLER) for _ in range(filler_sentences - filler_sentences // 2)]
+    body.append(f"{title} {last}, {first}, geb. am 01.01.1950")
+    return "\n".join(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--letters", type=int, default=200)
+    parser.add_argument("--filler", type=int, default=400, help="Filler sentences per letter")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    letters = [make_letter(rng, args.filler) for _ in range(args.letters)]
+
+    for text in letters:
+        baseline = per_field_baseline(text)
+        scanned = single_pass(text)
+        assert {k: baseline[k] for k in ("tumor_status", "ecog", "birth_date", "intro_fallback")
+                if k in baseline} == {k: scanned[k] for k in ("tumor_status", "ecog", "birth_date", "intro_fallback")
+                                      if k in scanned}
+        assert baseline.get("name_with_birth_date") == scanned.get("name_with_birth_date")
+
+    chars = sum(len(text) for text in letters)
+    print(f"{len(letters)} letters, {chars / len(letters):.0f} characters on average")
+    for label, func in (("per-field re.search", per_field_baseline), ("single-pass scanner", single_pass)):
+        best = min(timeit.repeat(lambda: [func(text) for text in letters], number=1, repeat=args.repeat))
+        print(f"{label:22s} {best * 1000:8.1f} ms  ({best / len(letters) * 1e6:7.1f} µs/letter)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the PDF text backends of pdf_text.py: speed and output differences.
+
+Every installed backend reads the same PDFs. The report gives pages/second for
+each backend and how closely its text matches pdfplumber's (the default).
+Without --pdfs, a synthetic corpus of letter-like PDFs is generated first
+(matplotlib, TrueType fonts).
+
+    python benchmarks/bench_pdf_backends.py --pdfs path/to/pdfs --show-diff 1
+    python benchmarks/bench_pdf_backends.py --generate 20 --pages 5
+"""
+import argparse
+import difflib
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf_text import DEFAULT_BACKEND, PDF_BACKENDS, available_backends, extract_text_from_pdf  # noqa: E402
+from generate_letters import FILLER  # noqa: E402
+
+
+def generate_corpus(directory, letters, pages, seed=42):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    # Real text instead of Type 3 glyph procedures, like LibreOffice's export
+    matplotlib.rcParams['pdf.fonttype'] = 42
+
+    rng = random.Random(seed)
+    paths = []
+    for n in range(letters):
+        path = Path(directory) / f"letter_{n:03d}.pdf"
+        with PdfPages(path) as pdf:
+            for page in range(1, pages + 1):
+                lines = ["Universitätsklinikum Musterstadt", "Klinik für Onkologie", "Musterstraße 1, 12345 Musterstadt"]
+                if page == 1:
+                    lines.append("Sehr geehrte Kollegin, sehr geehrter Kollege,")
+                    lines.append("wir berichten über Frau Erika Beispiel, geb. am 01.02.1950, die sich in unserer Behandlung befand.")
+                    lines.append("Tumorstadium: cT2b, cN1, cM0, UICC: IIIA")
+                lines += [rng.choice(FILLER) for _ in range(30)]
+                lines += ["Telefon 0123 456789", "www.klinikum-musterstadt.de", f"Seite {page} von {pages}"]
+                fig = plt.figure(figsize=(8.27, 11.69))
+                for i, line in enumerate(lines):
+                    fig.text(0.08, 0.96 - i * 0.024, line, fontsize=9)
+                pdf.savefig(fig)
+                plt.close(fig)
+        paths.append(path)
+    return paths
+
+
+def count_pages(path):
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(str(path))
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdfs", help="Directory with sample PDFs (default: generate a synthetic corpus)")
+    parser.add_argument("--generate", type=int, default=10, help="Number of synthetic letters")
+    parser.add_argument("--pages", type=int, default=4, help="Pages per synthetic letter")
+    parser.add_argument("--backends", nargs="+", choices=list(PDF_BACKENDS),
+                        help="Backends to compare (default: all installed)")
+    parser.add_argument("--show-diff", type=int, default=0, metavar="N",
+                        help="Print a unified diff against pdfplumber for the first N differing documents")
+    args = parser.parse_args()
+
+    backends = args.backends or available_backends()
+    if DEFAULT_BACKEND not in backends:
+        backends.insert(0, DEFAULT_BACKEND)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.pdfs:
+            paths = sorted(Path(args.pdfs).glob("*.pdf"))
+        else:
+            paths = generate_corpus(tmp, args.generate, args.pages)
+        if not paths:
+            print("No PDFs found")
+            return
+        pages = sum(count_pages(path) for path in paths)
+        print(f"{len(paths)} documents, {pages} pages\n")
+
+        texts = {}
+        timings = {}
+        for backend in backends:
+            start = time.perf_counter()
+            texts[backend] = [extract_text_from_pdf(str(path), backend) for path in paths]
+            timings[backend] = time.perf_counter() - start
+
+    reference = texts[DEFAULT_BACKEND]
+    print(f"{'backend':12s} {'seconds':>8s} {'pages/s':>9s} {'speedup':>8s} {'identical':>10s} {'similarity':>11s}")
+    for backend in backends:
+        similarities = [difflib.SequenceMatcher(None, ref, text, autojunk=False).ratio()
+                        for ref, text in zip(reference, texts[backend])]
+        identical = sum(ref == text for ref, text in zip(reference, texts[backend]))
+        print(f"{backend:12s} {timings[backend]:8.2f} {pages / timings[backend]:9.1f} "
+              f"{timings[DEFAULT_BACKEND] / timings[backend]:7.1f}x {identical:>4d}/{len(paths):<5d} "
+              f"{sum(similarities) / len(similarities):10.1%}")
+
+    for backend in backends:
+        if backend == DEFAULT_BACKEND:
+            continue
+        shown = 0
+        for path, ref, text in zip(paths, reference, texts[backend]):
+            if shown >= args.show_diff:
+                break
+            if ref == text:
+                continue
+            shown += 1
+            print(f"\n--- {path.name}: {DEFAULT_BACKEND} vs {backend}")
+            sys.stdout.writelines(difflib.unified_diff(ref.splitlines(True), text.splitlines(True),
+                                                       DEFAULT_BACKEND, backend, n=1))
+
+
+if __name__ == "__main__":
+    main()
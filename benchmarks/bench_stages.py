@@ -0,0 +1,258 @@
+"""Throughput and latency of every pipeline stage, compared against stored baselines.
+
+A synthetic corpus (generate_letters.py) is generated once for the largest
+size and reused; smaller sizes use its first letters. Each stage runs over
+the first N letters for every N in --sizes:
+
+- ``convert_to_pdf``: DOCX -> PDF with one reused LibreOffice (skipped without LibreOffice)
+- ``extract_text_from_docx``: native DOCX text extraction
+- ``extract_text_from_pdf``: text of the converted PDFs. Without LibreOffice,
+  synthetic PDFs from bench_pdf_backends.py are cycled instead
+- ``extract_patient_info``: field extraction with the spaCy model
+- ``check_missing_data`` / ``tumor_status_analysis``: the analysis scripts
+  over the extracted records (whole-run time only)
+
+Per-document stages report documents/s and the median and 95th percentile
+latency. The results are compared with ``benchmarks/baselines.json``: a stage
+regresses when its throughput drops, or its p95 latency grows, by more than
+--tolerance; runs under half a second are too noisy and not compared.
+``--save-baseline`` stores the current results instead. Baselines are only
+meaningful on the machine they were recorded on.
+
+    python benchmarks/bench_stages.py --sizes 100 1000 --corpus-dir /tmp/letters
+    python benchmarks/bench_stages.py --sizes 100 --save-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from generate_letters import generate_letters  # noqa: E402
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines.json"
+STAGES = ["convert_to_pdf", "extract_text_from_docx", "extract_text_from_pdf", "extract_patient_info",
+          "check_missing_data", "tumor_status_analysis"]
+# Runs shorter than this are too noisy to flag as regressions
+MIN_SECONDS = 0.5
+# Distinct synthetic PDFs cycled through when LibreOffice is not available
+SYNTHETIC_PDFS = 50
+
+if sys.platform == "win32":
+    import convert_patient_data_to_txt_windows as converter
+else:
+    import convert_patient_data_to_txt_mac as converter
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def time_each(items, func):
+    """Run ``func`` on every item; returns (results, per-item latencies, total seconds)."""
+    results = []
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        results.append(func(item))
+        latencies.append(time.perf_counter() - item_start)
+    return results, latencies, time.perf_counter() - start
+
+
+def stage_result(count, seconds, latencies=None):
+    result = {"documents": count, "seconds": round(seconds, 4), "throughput": round(count / seconds, 2)}
+    if latencies:
+        result["p50_ms"] = round(percentile(latencies, 0.5) * 1000, 3)
+        result["p95_ms"] = round(percentile(latencies, 0.95) * 1000, 3)
+    return result
+
+
+def load_corpus(corpus_dir, count, pages, noise):
+    existing = sorted(Path(corpus_dir).glob("letter_*.docx"))
+    if len(existing) >= count:
+        return existing[:count]
+    print(f"Generating {count} letters in {corpus_dir} ...")
+    return generate_letters(corpus_dir, count, pages, noise)
+
+
+def synthetic_pdfs(directory, pages):
+    from bench_pdf_backends import generate_corpus
+    return generate_corpus(directory, SYNTHETIC_PDFS, pages)
+
+
+def run_size(letters, work_dir, stages, model, pdf_backend, pages):
+    """Results per stage for one corpus size."""
+    results = {}
+    count = len(letters)
+    pdf_dir = Path(work_dir) / "pdf"
+    pdf_dir.mkdir(exist_ok=True)
+    pdfs = []
+
+    if "convert_to_pdf" in stages or "extract_text_from_pdf" in stages:
+        try:
+            soffice_path = converter.find_soffice()
+        except FileNotFoundError:
+            soffice_path = None
+        if soffice_path is not None:
+            from libreoffice_server import LibreOfficeServer
+            with LibreOfficeServer(soffice_path) as server:
+                def convert(path):
+                    pdf_path = pdf_dir / f"{path.stem}.pdf"
+                    if not converter.convert_to_pdf(str(path), str(pdf_path), server):
+                        # Timing a failed conversion would report it as a fast one
+                        print(f"Error: LibreOffice could not convert {path.name}")
+                        raise SystemExit(1)
+                    return pdf_path
+                pdfs, latencies, seconds = time_each(letters, convert)
+            if "convert_to_pdf" in stages:
+                results["convert_to_pdf"] = stage_result(count, seconds, latencies)
+        elif "convert_to_pdf" in stages:
+            print("  convert_to_pdf: skipped, LibreOffice not found")
+
+    if "extract_text_from_docx" in stages or "extract_patient_info" in stages:
+        from docx_text import extract_text_from_docx
+        texts, latencies, seconds = time_each(letters, lambda path: extract_text_from_docx(str(path)))
+        if "extract_text_from_docx" in stages:
+            results["extract_text_from_docx"] = stage_result(count, seconds, latencies)
+
+    if "extract_text_from_pdf" in stages:
+        if not pdfs:
+            # Cycle a small set of synthetic PDFs to reach the corpus size
+            synthetic_dir = Path(work_dir) / "synthetic_pdf"
+            synthetic_dir.mkdir(exist_ok=True)
+            synthetic = synthetic_pdfs(synthetic_dir, pages)
+            pdfs = [synthetic[i % len(synthetic)] for i in range(count)]
+            print("  extract_text_from_pdf: LibreOffice not found, using synthetic PDFs")
+        _, latencies, seconds = time_each(pdfs, lambda path: converter.extract_text_from_pdf(str(path), pdf_backend))
+        results["extract_text_from_pdf"] = stage_result(count, seconds, latencies)
+
+    records_file = Path(work_dir) / "records.jsonl"
+    if "extract_patient_info" in stages:
+        from extract_patient_data import PatientExtractor
+        extractor = PatientExtractor(model_name=model)
+        # Load the model before timing
+        extractor.nlp
+        infos, latencies, seconds = time_each(texts, extractor.extract)
+        results["extract_patient_info"] = stage_result(count, seconds, latencies)
+        with open(records_file, "w", encoding="utf-8") as f:
+            for path, info in zip(letters, infos):
+                info["source_file"] = f"{path.stem}.txt"
+                f.write(json.dumps(info, ensure_ascii=False) + "\n")
+    elif stages & {"check_missing_data", "tumor_status_analysis"}:
+        # Without the extraction stage, analyse the generator's expected records
+        expected = Path(letters[0]).parent / "expected.jsonl"
+        with open(expected, encoding="utf-8") as source, open(records_file, "w", encoding="utf-8") as f:
+            for _, line in zip(range(count), source):
+                f.write(line)
+
+    # The analysis scripts print their reports; only the timing is of interest here
+    if "check_missing_data" in stages:
+        from check_missing_data import analyze_missing_data
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_missing_data(str(records_file))
+        results["check_missing_data"] = stage_result(count, time.perf_counter() - start)
+    if "tumor_status_analysis" in stages:
+        from tumor_status_analysis import analyze_tumor_status
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_tumor_status(str(records_file), plots_dir=str(Path(work_dir) / "plots"), force=True)
+        results["tumor_status_analysis"] = stage_result(count, time.perf_counter() - start)
+    return results
+
+
+def compare(results, baselines, tolerance):
+    """Lines describing the regressions against the baselines."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            baseline = baselines.get(size, {}).get(stage)
+            if baseline is None or max(baseline["seconds"], current["seconds"]) < MIN_SECONDS:
+                continue
+            if current["throughput"] < baseline["throughput"] * (1 - tolerance):
+                regressions.append(f"{stage} @ {size}: {current['throughput']:.1f} docs/s "
+                                   f"(baseline {baseline['throughput']:.1f})")
+            if "p95_ms" in baseline and current["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{stage} @ {size}: p95 {current['p95_ms']:.1f} ms "
+                                   f"(baseline {baseline['p95_ms']:.1f} ms)")
+    return regressions
+
+
+def print_results(results, baselines):
+    print(f"\n{'stage':24s} {'docs':>6s} {'seconds':>9s} {'docs/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} "
+          f"{'vs baseline':>12s}")
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            baseline = baselines.get(size, {}).get(stage)
+            change = f"{result['throughput'] / baseline['throughput'] - 1:+.0%}" if baseline else "-"
+            print(f"{stage:24s} {result['documents']:6d} {result['seconds']:9.2f} {result['throughput']:9.1f} "
+                  f"{result.get('p50_ms', float('nan')):8.2f} {result.get('p95_ms', float('nan')):8.2f} "
+                  f"{change:>12s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Corpus sizes to measure")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to measure")
+    parser.add_argument("--corpus-dir",
+                        help="Where the generated letters are kept between runs (default: a temporary directory)")
+    parser.add_argument("--pages", type=int, default=2, help="Pages of free text per letter")
+    parser.add_argument("--noise", type=float, default=0.1, help="Noise level of the generated letters")
+    parser.add_argument("--model", default="de_core_news_sm", help="spaCy model for extract_patient_info")
+    parser.add_argument("--pdf-backend", default="pdfplumber", help="Backend for extract_text_from_pdf")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE), help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baselines instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown before a stage counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    baseline_path = Path(args.baseline)
+    stored = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    baselines = stored.get("sizes", {})
+    if stored.get("machine") and stored["machine"] != platform.node():
+        print(f"Note: baselines were recorded on {stored['machine']}, not on this machine")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus_dir = args.corpus_dir or os.path.join(tmp, "letters")
+        corpus = load_corpus(corpus_dir, max(args.sizes), args.pages, args.noise)
+        for size in sorted(args.sizes):
+            print(f"Measuring {size} letters ...")
+            work_dir = Path(tmp) / f"run_{size}"
+            work_dir.mkdir()
+            results[str(size)] = run_size(corpus[:size], work_dir, set(args.stages), args.model,
+                                          args.pdf_backend, args.pages)
+
+    print_results(results, baselines)
+
+    if args.save_baseline:
+        for size, stages in results.items():
+            baselines.setdefault(size, {}).update(stages)
+        stored.update({"machine": platform.node(), "python": platform.python_version(), "sizes": baselines})
+        baseline_path.write_text(json.dumps(stored, indent=2) + "\n", encoding="utf-8")
+        print(f"\nBaselines saved to {baseline_path}")
+        return
+
+    regressions = compare(results, baselines, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    if baselines:
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Generate synthetic German discharge letters (.docx) for tests and benchmarks.
+
+Real letters can't leave the hospital, so this writes letters with the
+structure of the real ones: letterhead and footer on every page, the
+"wir berichten über" introduction with name and birth date, a diagnosis block
+with the tumor stage, ECOG, and free-text sections that fill the configured
+number of pages. Name, birth date, TNM and ECOG are written in the variants
+the extraction patterns handle. With ``--noise`` some letters also get
+irregular spacing, typos in the free text and fields that are left out.
+
+Next to the letters, ``expected.jsonl`` lists the values written into each
+letter (``None`` for a field that was left out), in the format of
+``processed_patients.jsonl``.
+
+    python benchmarks/generate_letters.py --count 1000 --out patient_data --pages 3 --noise 0.2
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+FIRST_NAMES = {
+    "female": ["Erika", "Anna", "Maria", "Ursula", "Jutta", "Sabine", "Monika", "Gisela", "Käthe", "Brigitte"],
+    "male": ["Hans", "Klaus", "Peter", "Jürgen", "Wolfgang", "Günter", "Dieter", "Horst", "Uwe", "Björn"],
+}
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schulz",
+              "Hoffmann", "Schäfer", "Koch", "Bauer", "Richter", "Klein", "Wolf", "Schröder", "Neumann",
+              "Schwarz", "Zimmermann", "Braun", "Krüger", "Hofmann", "Hartmann", "Lange", "Schmitt"]
+DIAGNOSES = ["Adenokarzinom der Lunge", "Plattenepithelkarzinom der Lunge", "Mammakarzinom links",
+             "Kolonkarzinom", "Rektumkarzinom", "Pankreaskarzinom", "Magenkarzinom", "Prostatakarzinom",
+             "Urothelkarzinom der Harnblase", "Hepatozelluläres Karzinom"]
+T_STAGES = ["1", "1a", "1b", "1c", "2", "2a", "2b", "3", "4", "4a", "4b"]
+N_STAGES = ["0", "1", "2", "3", "x"]
+M_STAGES = ["0", "1", "1a", "1b", "x"]
+SECTIONS = ["Anamnese", "Befunde", "Therapie und Verlauf", "Procedere", "Medikation bei Entlassung"]
+# Free-text sentences, shared with the benchmarks
+FILLER = [
+    "Die Laborwerte zeigten sich im Verlauf rückläufig.",
+    "Unter Therapie mit Metamizol kam es zu einer deutlichen Besserung der Schmerzen.",
+    "Die CT-Untersuchung des Thorax ergab keinen Hinweis auf neue Raumforderungen.",
+    "Medikation: Pantoprazol 40 mg 1-0-0, Ramipril 5 mg 1-0-0, Metformin 500 mg 1-0-1",
+    "Der weitere Verlauf gestaltete sich komplikationslos.",
+]
+EXTRA_FILLER = [
+    "Die Patientin wurde über die Diagnose und das weitere Vorgehen ausführlich aufgeklärt.",
+    "Im Tumorboard wurde die Fortführung der systemischen Therapie empfohlen.",
+    "Eine Kontrolle des Blutbildes beim Hausarzt in einer Woche wird empfohlen.",
+    "Die Wundverhältnisse waren zu jedem Zeitpunkt reizlos.",
+    "Sonographisch zeigte sich kein Anhalt für einen Pleuraerguss.",
+    "Für Rückfragen stehen wir Ihnen jederzeit gerne zur Verfügung.",
+]
+LETTERHEAD = ["Universitätsklinikum Musterstadt", "Klinik für Hämatologie und Onkologie",
+              "Direktor: Prof. Dr. med. A. Beispiel", "Musterstraße 1 · 12345 Musterstadt"]
+FOOTER = ["Telefon 0123 456789 · Fax 0123 456780 · www.klinikum-musterstadt.de",
+          "Sparkasse Musterstadt · IBAN DE00 1234 5678 9012 3456 78"]
+
+
+def random_patient(rng):
+    gender = rng.choice(["female", "male"])
+    return {
+        "gender": gender,
+        "first_name": rng.choice(FIRST_NAMES[gender]),
+        "last_name": rng.choice(LAST_NAMES),
+        "birth_date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(1925, 1990)}",
+        "prefix": rng.choice("cccpp"),
+        "T": rng.choice(T_STAGES),
+        "N": rng.choice(N_STAGES),
+        "M": rng.choice(M_STAGES),
+        "residual": rng.choice([None, None, "R0", "R1"]),
+        "ecog": rng.choice(["0", "1", "1", "2", "3", "0-1", "1-2"]),
+        "diagnosis": rng.choice(DIAGNOSES),
+    }
+
+
+def intro_sentence(patient, rng):
+    title = "Frau" if patient["gender"] == "female" else "Herrn"
+    first, last, born = patient["first_name"], patient["last_name"], patient["birth_date"]
+    pronoun = "die" if patient["gender"] == "female" else "der"
+    variant = rng.randrange(3)
+    if variant == 0:
+        return (f"wir berichten über {title} {first} {last}, geb. am {born}, "
+                f"{pronoun} sich vom 03.04.2023 bis 17.04.2023 in unserer stationären Behandlung befand.")
+    if variant == 1:
+        return (f"wir berichten über {title} {last}, {first}, geb. am {born}, "
+                f"{pronoun} sich in unserer ambulanten Betreuung befindet.")
+    # Intro without the birth date; it follows in the patient line above
+    return f"wir berichten über {title} {first} {last}, {pronoun} sich bei uns vorstellte."
+
+
+def tumor_line(patient, rng):
+    prefix = patient["prefix"]
+    components = [f"{prefix}T{patient['T']}", f"{prefix}N{patient['N']}", f"{prefix}M{patient['M']}"]
+    if patient["residual"]:
+        components.append(patient["residual"])
+    variant = rng.randrange(3)
+    if variant == 0:
+        status = ", ".join(components)
+        return f"Tumorstadium: {status}, UICC: {rng.choice(['I', 'IIA', 'IIB', 'IIIA', 'IIIB', 'IV'])}", status
+    if variant == 1:
+        status = " ".join(components)
+        return f"Stadium: TNM: {status}", status
+    # No marker, only the TNM pattern inside the diagnosis sentence
+    status = ", ".join(components[:3])
+    return f"Histologisch gesichert, {status}, Erstdiagnose 02/2023.", status
+
+
+def ecog_text(patient, rng):
+    ecog = patient["ecog"]
+    return rng.choice([f"(ECOG {ecog})", f"ECOG: {ecog}", f"Allgemeinzustand reduziert (ECOG{ecog})"])
+
+
+def add_noise(line, rng):
+    # Doubled spaces and swapped letters, as in hastily typed free text
+    words = line.split(' ')
+    i = rng.randrange(len(words))
+    word = words[i]
+    if len(word) > 3:
+        j = rng.randrange(len(word) - 1)
+        words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return '  '.join(words) if rng.random() < 0.5 else ' '.join(words)
+
+
+def build_letter(patient, pages, noise, rng):
+    """The paragraphs of one letter, with None for a page break, and its expected record."""
+    expected = {"tumor_status": None, "ecog": None, "birth_date": None, "name": None, "gender": None}
+    title = "Frau" if patient["gender"] == "female" else "Herrn"
+    paragraphs = [
+        f"{title} {patient['first_name']} {patient['last_name']}, Musterweg {rng.randint(1, 99)}, "
+        f"12345 Musterstadt",
+        "Musterstadt, 18.04.2023",
+        "Sehr geehrte Kolleginnen und Kollegen,",
+    ]
+    # With noise, one of the fields may be missing from the letter
+    drop = rng.choice(["tumor_status", "ecog", "birth_date"]) if rng.random() < noise else None
+
+    intro = intro_sentence(patient, rng)
+    if drop == "birth_date":
+        intro = intro.replace(f", geb. am {patient['birth_date']}", "")
+    elif "geb. am" not in intro:
+        paragraphs.insert(1, f"Patient: {title} {patient['last_name']}, {patient['first_name']}, "
+                             f"geb. am {patient['birth_date']}")
+    paragraphs.append(intro)
+    expected["name"] = f"{patient['first_name']} {patient['last_name']}"
+    expected["gender"] = patient["gender"]
+    if drop != "birth_date":
+        expected["birth_date"] = patient["birth_date"]
+
+    paragraphs.append("Diagnosen:")
+    diagnosis = patient['diagnosis']
+    if drop != "tumor_status":
+        line, status = tumor_line(patient, rng)
+        paragraphs.append(diagnosis)
+        paragraphs.append(line)
+        expected["tumor_status"] = status
+    else:
+        paragraphs.append(diagnosis + ", Staging ausstehend")
+    if drop != "ecog":
+        paragraphs.append(f"Aktueller Allgemeinzustand: {ecog_text(patient, rng)}")
+        expected["ecog"] = patient["ecog"]
+
+    # Free text: about 30 lines per page
+    filler = FILLER + EXTRA_FILLER
+    for page in range(pages):
+        if page:
+            paragraphs.append(None)
+        for section in rng.sample(SECTIONS, 2):
+            paragraphs.append(f"{section}:")
+            for _ in range(12):
+                line = rng.choice(filler)
+                paragraphs.append(add_noise(line, rng) if rng.random() < noise else line)
+    paragraphs += ["Mit freundlichen kollegialen Grüßen", "Prof. Dr. med. A. Beispiel", "Dr. med. B. Muster"]
+    return paragraphs, expected
+
+
+def write_docx(path, paragraphs):
+    from docx import Document
+    from docx.enum.text import WD_BREAK
+    document = Document()
+    section = document.sections[0]
+    section.header.paragraphs[0].text = LETTERHEAD[0]
+    for line in LETTERHEAD[1:]:
+        section.header.add_paragraph(line)
+    section.footer.paragraphs[0].text = FOOTER[0]
+    for line in FOOTER[1:]:
+        section.footer.add_paragraph(line)
+    for paragraph in paragraphs:
+        if paragraph is None:
+            document.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        else:
+            document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def generate_letters(directory, count, pages=2, noise=0.1, seed=42):
+    """Write ``count`` letters and expected.jsonl to ``directory``; returns the letter paths."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    with open(directory / "expected.jsonl", "w", encoding="utf-8") as expected_file:
+        for n in range(count):
+            path = directory / f"letter_{n:05d}.docx"
+            paragraphs, expected = build_letter(random_patient(rng), pages, noise, rng)
+            write_docx(path, paragraphs)
+            expected["source_file"] = f"{path.stem}.txt"
+            expected_file.write(json.dumps(expected, ensure_ascii=False) + "\n")
+            paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=100, help="Number of letters")
+    parser.add_argument("--out", default="patient_data", help="Directory the letters are written to")
+    parser.add_argument("--pages", type=int, default=2, help="Pages of free text per letter")
+    parser.add_argument("--noise", type=float, default=0.1,
+                        help="Share of letters with a missing field, and of free-text lines with typos")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate_letters(args.out, args.count, args.pages, args.noise, args.seed)
+    print(f"Wrote {args.count} letters to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,218 @@
+import argparse
+import csv
 import json
-import pandas as pd
+import os
 from collections import defaultdict
+import instrumentation
+from patient_records import iter_patient_chunks, find_patients_file
+from patient_registry import REGISTRY_FILE, PatientRegistry
+from tnm import parse_tnm
+
+# Expected fields
+EXPECTED_FIELDS = ['name', 'birth_date', 'gender', 'tumor_status', 'ecog', 'source_file']
+
+VALID_ECOG = r'^(?:[0-4]|[0-4]-[0-4])?$'
+VALID_GENDER = ['male', 'female', '']
+
+def _missing_mask(df, field):
+    values = df[field]
+    return values.isna() | values.eq("")
+
+def _analyze_chunk(df, totals):
+    # Each check is one mask over the whole column
+    sources = df['source_file']
+    for field in EXPECTED_FIELDS:
+        missing = _missing_mask(df, field)
+        totals['missing_counts'][field] += int(missing.sum())
+        totals['missing_sources'][field].extend(sources[missing].tolist())
+        if not missing.all():
+            totals['seen_columns'].add(field)
+
+    # A component is missing when the TNM parser finds no stage for it
+    # (not just no letter "T"/"N"/"M" anywhere, which "Stadium" would satisfy)
+    has_status = df['tumor_status'].notna()
+    if has_status.any():
+        tnm = parse_tnm(df['tumor_status'][has_status])
+        for component in 'TNM':
+            missing = tnm[f'{component}_stage'].isna()
+            totals['tumor_status_missing_components'][component].extend(sources[has_status][missing].tolist())
+
+    # Check ECOG values
+    ecog = df['ecog'].dropna()
+    invalid = ~ecog.astype(str).str.match(VALID_ECOG)
+    totals['invalid_ecog'].extend(zip(sources[invalid.index[invalid]].tolist(), ecog[invalid].tolist()))
+
+    # Check gender values
+    gender = df['gender'].dropna()
+    invalid = ~gender.astype(str).str.lower().isin(VALID_GENDER)
+    totals['invalid_gender'].extend(zip(sources[invalid.index[invalid]].tolist(), gender[invalid].tolist()))
+
+def analyze_missing_data(json_file, chunksize=10000, report_file=None):
+    totals = {
+        'missing_counts': defaultdict(int),
+        'missing_sources': defaultdict(list),
+        'tumor_status_missing_components': defaultdict(list),
+        'invalid_ecog': [],
+        'invalid_gender': [],
+        'seen_columns': set(),
+    }
+    total_records = 0
+
+    with instrumentation.measure("check_missing_data", os.path.basename(str(json_file))) as stats:
+        # Read the records (JSON or JSON Lines) in chunks so memory stays flat
+        for df in iter_patient_chunks(json_file, chunksize, columns=EXPECTED_FIELDS):
+            total_records += len(df)
+            _analyze_chunk(df, totals)
+        stats["records"] = total_records
+
+    report = build_report(total_records, totals)
+    print_report(report)
+    if report_file:
+        write_report(report, report_file)
+        print(f"\nReport saved to {report_file}")
+    return report
+
+def _registry_totals(registry):
+    # The same checks as _analyze_chunk, as queries on the registry
+    totals = {
+        'missing_counts': defaultdict(int),
+        'missing_sources': defaultdict(list),
+        'tumor_status_missing_components': {},
+        'invalid_ecog': [],
+        'invalid_gender': [],
+        'seen_columns': set(),
+    }
+    total_records = len(registry)
+    for field in EXPECTED_FIELDS:
+        sources = [row[0] for row in registry.execute(
+            f"SELECT source_file FROM patients WHERE {field} IS NULL OR {field} = '' ORDER BY source_file")]
+        totals['missing_counts'][field] = len(sources)
+        totals['missing_sources'][field] = sources
+        if len(sources) < total_records:
+            totals['seen_columns'].add(field)
+    for component in 'TNM':
+        totals['tumor_status_missing_components'][component] = [row[0] for row in registry.execute(
+            f"SELECT source_file FROM patients WHERE tumor_status IS NOT NULL AND {component}_stage IS NULL")]
+    totals['invalid_ecog'] = registry.execute(
+        "SELECT source_file, ecog FROM patients WHERE ecog IS NOT NULL AND NOT ecog REGEXP ? "
+        "ORDER BY source_file", (VALID_ECOG,)).fetchall()
+    # The gender column is lower case; report the value as extracted
+    totals['invalid_gender'] = registry.execute(
+        "SELECT source_file, json_extract(record, '$.gender') FROM patients "
+        "WHERE gender IS NOT NULL AND gender NOT IN ('male', 'female') ORDER BY source_file").fetchall()
+    return total_records, totals
+
+def analyze_registry(registry_file=REGISTRY_FILE, report_file=None):
+    """analyze_missing_data on the patient registry, with the checks run as SQL."""
+    if not os.path.exists(registry_file):
+        print(f"Error: {registry_file} not found. Run extract_patient_data.py first.")
+        return None
+    with instrumentation.measure("check_missing_data", os.path.basename(str(registry_file))) as stats:
+        with PatientRegistry(registry_file) as registry:
+            total_records, totals = _registry_totals(registry)
+        stats["records"] = total_records
+
+    report = build_report(total_records, totals)
+    print_report(report)
+    if report_file:
+        write_report(report, report_file)
+        print(f"\nReport saved to {report_file}")
+    return report
+
+def build_report(total_records, totals):
+    missing = {}
+    for field in EXPECTED_FIELDS:
+        count = totals['missing_counts'][field]
+        missing[field] = {
+            'count': count,
+            'percent': round(count / total_records * 100, 1) if total_records else 0.0,
+            'files': sorted(set(map(str, totals['missing_sources'][field]))),
+        }
+    return {
+        'total_records': total_records,
+        'missing': missing,
+        'tumor_status_checked': 'tumor_status' in totals['seen_columns'],
+        'tumor_status_missing_components': {
+            component: sorted(set(totals['tumor_status_missing_components'][component]))
+            for component in 'TNM'
+        },
+        'invalid_ecog': [{'source_file': source, 'ecog': value} for source, value in totals['invalid_ecog']],
+        'invalid_gender': [{'source_file': source, 'gender': value} for source, value in totals['invalid_gender']],
+    }
+
+def print_report(report):
+    total_records = report['total_records']
 
-def analyze_missing_data(json_file):
-    # Read the JSON file
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    
-    # Initialize dictionaries to store missing data information
-    missing_counts = defaultdict(int)
-    missing_sources = defaultdict(list)
-    
-    # Expected fields
-    expected_fields = ['name', 'birth_date', 'gender', 'tumor_status', 'ecog', 'source_file']
-    
-    # Check each record for missing data
-    for idx, record in df.iterrows():
-        for field in expected_fields:
-            if field not in record or pd.isna(record[field]) or record[field] == "":
-                missing_counts[field] += 1
-                missing_sources[field].append(record['source_file'])
-    
     # Print summary statistics
     print("\n=== Missing Data Analysis ===\n")
-    print("Total number of records:", len(df))
+    print("Total number of records:", total_records)
     print("\nMissing data counts:")
     print("-" * 40)
-    
-    for field in expected_fields:
-        if missing_counts[field] > 0:
+
+    for field, missing in report['missing'].items():
+        if missing['count'] > 0:
             print(f"\n{field}:")
-            print(f"  Missing in {missing_counts[field]} records ({(missing_counts[field]/len(df)*100):.1f}%)")
+            print(f"  Missing in {missing['count']} records ({missing['percent']:.1f}%)")
             print("  Missing in files:")
-            for source in sorted(set(missing_sources[field])):
+            for source in missing['files']:
                 print(f"    - {source}")
-    
+
     # Additional Analysis
     print("\n=== Data Quality Analysis ===\n")
-    
-    # Analyze tumor_status components
-    if 'tumor_status' in df.columns:
-        tumor_status_missing_components = defaultdict(list)
-        for idx, record in df.iterrows():
-            if pd.notna(record['tumor_status']):
-                status = record['tumor_status']
-                if 'T' not in status:
-                    tumor_status_missing_components['T'].append(record['source_file'])
-                if 'N' not in status:
-                    tumor_status_missing_components['N'].append(record['source_file'])
-                if 'M' not in status:
-                    tumor_status_missing_components['M'].append(record['source_file'])
-        
+
+    # Tumor status components
+    if report['tumor_status_checked']:
         print("Tumor Status Component Analysis:")
         print("-" * 40)
-        for component in ['T', 'N', 'M']:
-            if tumor_status_missing_components[component]:
+        for component, sources in report['tumor_status_missing_components'].items():
+            if sources:
                 print(f"\nMissing {component} component in tumor_status:")
-                for source in sorted(set(tumor_status_missing_components[component])):
+                for source in sources:
                     print(f"  - {source}")
-    
+
     # Check for potentially invalid values
     print("\nPotential Data Issues:")
     print("-" * 40)
-    
-    # Check ECOG values
-    if 'ecog' in df.columns:
-        invalid_ecog = df[~df['ecog'].astype(str).str.match(r'^[0-4]$|^[0-4]-[0-4]$|^$|^nan$', na=True)]
-        if not invalid_ecog.empty:
-            print("\nUnusual ECOG values:")
-            for _, record in invalid_ecog.iterrows():
-                print(f"  - {record['source_file']}: ECOG = {record['ecog']}")
-    
-    # Check gender values
-    if 'gender' in df.columns:
-        invalid_gender = df[~df['gender'].str.lower().isin(['male', 'female', ''])]
-        if not invalid_gender.empty:
-            print("\nUnusual gender values:")
-            for _, record in invalid_gender.iterrows():
-                print(f"  - {record['source_file']}: gender = {record['gender']}")
+
+    if report['invalid_ecog']:
+        print("\nUnusual ECOG values:")
+        for issue in report['invalid_ecog']:
+            print(f"  - {issue['source_file']}: ECOG = {issue['ecog']}")
+
+    if report['invalid_gender']:
+        print("\nUnusual gender values:")
+        for issue in report['invalid_gender']:
+            print(f"  - {issue['source_file']}: gender = {issue['gender']}")
+
+def write_report(report, report_file):
+    # .csv: one row per finding; anything else: the full report as JSON
+    if str(report_file).endswith('.csv'):
+        with open(report_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['check', 'field', 'source_file', 'value'])
+            for field, missing in report['missing'].items():
+                for source in missing['files']:
+                    writer.writerow(['missing', field, source, ''])
+            for component, sources in report['tumor_status_missing_components'].items():
+                for source in sources:
+                    writer.writerow(['tnm_component', component, source, ''])
+            for field in ('ecog', 'gender'):
+                for issue in report[f'invalid_{field}']:
+                    writer.writerow(['invalid_value', field, issue['source_file'], issue[field]])
+    else:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
 
 if __name__ == "__main__":
-    analyze_missing_data('processed_patients.json') 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Report missing and unusual values in the extracted patient data")
+    parser.add_argument("--report", help="Also write the findings to this file (.json or .csv)")
+    parser.add_argument("--registry", nargs="?", const=REGISTRY_FILE, metavar="FILE",
+                        help=f"Run the checks as SQL on the patient registry (default file: {REGISTRY_FILE}) "
+                             "instead of reading the JSON records")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    with instrumentation.instrumented(args):
+        if args.registry:
+            analyze_registry(args.registry, report_file=args.report)
+        else:
+            analyze_missing_data(find_patients_file(raw=True), report_file=args.report)
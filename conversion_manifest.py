@@ -0,0 +1,102 @@
+"""Manifest of converted letters, kept next to the text output.
+
+For every input document the manifest stores the SHA-256 of its content, the
+converter version that produced the output and the output file name. A run
+only needs to convert documents that are new, changed, converted by another
+converter version or whose output went missing. Outputs whose source document
+has disappeared are removed.
+
+File size and mtime are stored as well so unchanged files are not re-hashed on
+every run; the hash is only recomputed when either of them changes.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = ".conversion_manifest.json"
+MANIFEST_FORMAT = 1
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        # Hashes computed during this run, so a changed file is read only once;
+        # keyed by size and mtime too, as the watch daemon's manifest lives on
+        self._hashes = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("format") == MANIFEST_FORMAT:
+                    self.entries = data.get("files", {})
+            except (OSError, ValueError) as e:
+                # A damaged manifest only costs one full reconversion
+                print(f"Warning: Ignoring unreadable manifest {self.path}: {str(e)}")
+
+    def content_hash(self, input_name, input_path):
+        stat = os.stat(input_path)
+        key = (input_name, stat.st_size, stat.st_mtime_ns)
+        if key in self._hashes:
+            return self._hashes[key]
+        entry = self.entries.get(input_name)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            digest = entry["sha256"]
+        else:
+            digest = sha256_file(input_path)
+        self._hashes[key] = digest
+        return digest
+
+    def is_current(self, input_name, input_path, converter):
+        """True if ``input_name`` was already converted from identical content."""
+        entry = self.entries.get(input_name)
+        if not entry or entry.get("converter") != converter:
+            return False
+        if not os.path.exists(os.path.join(self.output_dir, entry["output"])):
+            return False
+        if entry["sha256"] != self.content_hash(input_name, input_path):
+            return False
+        # Same content under a new mtime (e.g. re-copied): remember the new stat
+        stat = os.stat(input_path)
+        entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+        return True
+
+    def record(self, input_name, input_path, converter, output_path):
+        stat = os.stat(input_path)
+        self.entries[input_name] = {
+            "sha256": self.content_hash(input_name, input_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "converter": converter,
+            "output": os.path.basename(output_path),
+        }
+
+    def remove_missing(self, input_names):
+        """Drop entries whose input is gone and delete their outputs.
+
+        Returns the names of the removed output files.
+        """
+        removed = []
+        for input_name in sorted(set(self.entries) - set(input_names)):
+            output_name = self.entries.pop(input_name)["output"]
+            output_path = os.path.join(self.output_dir, output_name)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            removed.append(output_name)
+        return removed
+
+    def save(self):
+        data = {"format": MANIFEST_FORMAT, "files": dict(sorted(self.entries.items()))}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -1,12 +1,18 @@
-from docx import Document
-import pdfplumber
+import io
 import nltk
 from nltk.tokenize import word_tokenize
 import os
-import time
-import subprocess
 import shutil
-from tqdm import tqdm
+import argparse
+from libreoffice_server import LibreOfficeServer
+from batch_conversion import convert_batch
+from docx_text import extract_text_from_docx
+from functools import partial
+from conversion_manifest import ConversionManifest
+from scratch import SCRATCH_ENV, process_scratch_dir
+import instrumentation
+import pdf_text
+from pdf_text import DEFAULT_BACKEND, PDF_BACKENDS
 
 # Download required NLTK data
 try:
@@ -14,116 +20,114 @@ try:
 except Exception as e:
     print(f"Warning: Could not download NLTK data: {str(e)}")
 
-def convert_to_pdf(input_path, pdf_path):
-    original_dir = os.getcwd()
+# Bump whenever a change here alters the text output, so the manifest
+# reconverts documents produced by an older version
+CONVERTER_VERSION = "windows-1"
+
+def find_soffice():
+    # Try to locate the LibreOffice executable
+    soffice_path = shutil.which("soffice")
+    if soffice_path is None:
+        soffice_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
+        if not os.path.exists(soffice_path):
+            raise FileNotFoundError("LibreOffice not found. Please install LibreOffice.")
+    return soffice_path
+
+def convert_to_pdf(input_path, pdf_path, server=None):
     try:
-        # Try to locate the LibreOffice executable
-        soffice_path = shutil.which("soffice")
-        if soffice_path is None:
-            soffice_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
-            if not os.path.exists(soffice_path):
-                raise FileNotFoundError("LibreOffice not found. Please install LibreOffice.")
-        
         # Get absolute paths and ensure they use backslashes
         abs_input_path = os.path.abspath(input_path).replace('/', '\\')
         abs_pdf_path = os.path.abspath(pdf_path).replace('/', '\\')
-        abs_output_dir = os.path.dirname(abs_pdf_path)
-        
-        # Create output directory if it doesn't exist
-        if not os.path.exists(abs_output_dir):
-            os.makedirs(abs_output_dir)
-        
-        # Run LibreOffice conversion directly in the output directory
-        os.chdir(abs_output_dir)
-        
-        # Run LibreOffice conversion
-        cmd = [
-            soffice_path,
-            '--headless',
-            '--convert-to', 'pdf',
-            '--outdir', abs_output_dir,
-            abs_input_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return False
-        
-        # Give LibreOffice some time to finish writing the file
-        time.sleep(2)
-        
-        # Get the expected output filename
-        expected_name = os.path.splitext(os.path.basename(input_path))[0] + '.pdf'
-        expected_path = os.path.join(abs_output_dir, expected_name)
-        
-        # Verify and move the PDF if needed
-        if os.path.exists(expected_path):
-            if expected_path.lower() != abs_pdf_path.lower():
-                if os.path.exists(abs_pdf_path):
-                    os.remove(abs_pdf_path)
-                shutil.move(expected_path, abs_pdf_path)
-            return True
-        return False
-        
+
+        # Without a running server, start a throwaway one for this document
+        if server is None:
+            with LibreOfficeServer(find_soffice()) as one_off:
+                return one_off.convert(abs_input_path, abs_pdf_path)
+
+        return server.convert(abs_input_path, abs_pdf_path)
+
     except Exception:
         return False
-        
+
+def extract_text_from_pdf(pdf_path, pdf_backend=DEFAULT_BACKEND, out=None, page_workers=1, stats=None):
+    # Same page layout for every backend, see pdf_text.py; with out, pages are
+    # written as they are extracted instead of being returned
+    return pdf_text.extract_text_from_pdf(pdf_path, pdf_backend, out, page_workers, stats)
+
+def extract_text_via_pdf(input_path, pdf_dir=None, server=None, pdf_backend=DEFAULT_BACKEND,
+                         out=None, page_workers=1):
+    # The intermediate PDF only lives in this process's scratch directory
+    # (RAM-backed where possible) until it has been read into memory
+    pdf_dir = pdf_dir or process_scratch_dir()
+    name = os.path.basename(input_path)
+    pdf_path = os.path.join(pdf_dir, os.path.splitext(name)[0] + '.pdf')
+    try:
+        # Convert DOCX to PDF using LibreOffice
+        with instrumentation.measure("convert_to_pdf", name):
+            if not convert_to_pdf(input_path, pdf_path, server):
+                raise Exception("PDF conversion failed")
+        with open(pdf_path, 'rb') as f:
+            pdf_bytes = f.read()
     finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+    with instrumentation.measure("extract_text_from_pdf", name) as stats:
+        return extract_text_from_pdf(io.BytesIO(pdf_bytes), pdf_backend, out, page_workers, stats)
+
+def docx_to_text(input_path, server=None, backend="auto", pdf_dir=None, pdf_backend=DEFAULT_BACKEND,
+                 out=None, page_workers=1):
+    # Text of one letter; a PDF needed on the way goes to pdf_dir (default: scratch).
+    # With out, the text is written there (PDF pages one by one) and None is returned
+    abs_input_path = os.path.abspath(input_path)
+    
+    if backend in ("auto", "docx"):
         try:
-            os.chdir(original_dir)
-        except:
-            pass
-
-def extract_text_from_pdf(pdf_path):
-    full_text = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            page_text = page.extract_text()
-            if page_text:
-                lines = page_text.split('\n')
-                if len(lines) > 6:
-                    header = '\n'.join(lines[:3])
-                    main_content = '\n'.join(lines[3:-3])
-                    footer = '\n'.join(lines[-3:])
-                    full_text.append(f"\n=== Page {i} ===")
-                    full_text.append(f"--- Header ---\n{header}")
-                    full_text.append(f"--- Content ---\n{main_content}")
-                    full_text.append(f"--- Footer ---\n{footer}")
-                else:
-                    full_text.append(f"\n=== Page {i} ===")
-                    full_text.append(page_text)
-    return '\n'.join(full_text)
-
-def process_docx(input_path, output_path):
+            # Read the DOCX directly, no LibreOffice needed
+            with instrumentation.measure("extract_text_from_docx", os.path.basename(input_path)) as stats:
+                text = extract_text_from_docx(abs_input_path)
+                stats.update(pages=text.count("=== Page "), text_length=len(text))
+            if out is None:
+                return text
+            out.write(text)
+            return None
+        except Exception as e:
+            if backend == "docx":
+                raise
+            print(f"Native extraction failed for {os.path.basename(input_path)}, "
+                  f"falling back to LibreOffice: {str(e)}")
+    
+    return extract_text_via_pdf(abs_input_path, pdf_dir and os.path.abspath(pdf_dir), server, pdf_backend,
+                                out, page_workers)
+
+def process_docx(input_path, output_path, server=None, backend="auto", pdf_backend=DEFAULT_BACKEND,
+                 page_workers=1):
     try:
         # Ensure we use absolute paths
         abs_output_path = os.path.abspath(output_path)
-        abs_input_path = os.path.abspath(input_path)
-        pdf_path = os.path.join(os.path.dirname(abs_output_path), 
-                               os.path.splitext(os.path.basename(abs_input_path))[0] + '.pdf')
         
-        # Convert DOCX to PDF using LibreOffice
-        if not convert_to_pdf(abs_input_path, pdf_path):
-            raise Exception("PDF conversion failed")
-        
-        text = extract_text_from_pdf(pdf_path)
+        # Pages are streamed into a temporary file, so a failure leaves no partial output
+        tmp_path = abs_output_path + '.tmp'
+        try:
+            with instrumentation.measure("process_docx", os.path.basename(input_path)):
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    docx_to_text(input_path, server, backend, pdf_backend=pdf_backend,
+                                 out=f, page_workers=page_workers)
+                os.replace(tmp_path, abs_output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         
-        with open(abs_output_path, 'w', encoding='utf-8') as f:
-            f.write(text)
+        # Counted line by line, so long letters are never held in memory as a whole
+        with open(abs_output_path, 'r', encoding='utf-8') as f:
+            tokens = sum(len(word_tokenize(line)) for line in f)
         
-        tokens = word_tokenize(text)
-        
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
-        
-        return len(tokens)
+        return tokens
         
     except Exception as e:
         print(f"Error processing {os.path.basename(input_path)}: {str(e)}")
         return None
 
-if __name__ == "__main__":
+def main(args):
     # Create output directory if it doesn't exist
     output_dir = "processed_output"
     if not os.path.exists(output_dir):
@@ -136,31 +140,61 @@ if __name__ == "__main__":
             exit(1)
 
         # Exclude temporary files starting with ~$
-        docx_files = [f for f in os.listdir(input_dir)
-                      if f.endswith('.docx') and not f.startswith('~$')]
+        docx_files = sorted(f for f in os.listdir(input_dir)
+                            if f.endswith('.docx') and not f.startswith('~$'))
         
         if not docx_files:
             print(f"No .docx files found in {input_dir}")
             exit(1)
 
-        print(f"Processing {len(docx_files)} files...")
+        # Skip documents whose content and converter are unchanged since the last run
+        manifest = ConversionManifest(output_dir)
+        converter = f"{CONVERTER_VERSION}/{args.backend}"
+        if args.pdf_backend != DEFAULT_BACKEND:
+            converter += f"/{args.pdf_backend}"
+        
+        removed = manifest.remove_missing(docx_files)
+        if removed:
+            print(f"Removed {len(removed)} outputs whose source document no longer exists")
+        
+        pending = [docx_file for docx_file in docx_files
+                   if args.force or not manifest.is_current(
+                       docx_file, os.path.join(input_dir, docx_file), converter)]
+        
+        print(f"Processing {len(pending)} files ({len(docx_files) - len(pending)} unchanged)...")
         
         total_tokens = 0
         processed_files = 0
         
-        # Process files with progress bar
-        for docx_file in tqdm(docx_files, desc="Converting documents", unit="file"):
-            input_path = os.path.join(input_dir, docx_file)
-            base_name = os.path.splitext(docx_file)[0]
-            output_path = os.path.join(output_dir, f"{base_name}.txt")
-            
-            tokens = process_docx(input_path, output_path)
+        jobs = [(os.path.join(input_dir, docx_file),
+                 os.path.join(output_dir, f"{os.path.splitext(docx_file)[0]}.txt"))
+                for docx_file in pending]
+        
+        # LibreOffice is only located when the chosen backend may need it
+        soffice_path = None
+        if args.backend != "docx":
+            try:
+                soffice_path = find_soffice()
+            except FileNotFoundError as e:
+                if args.backend == "libreoffice":
+                    raise
+                print(f"Warning: {str(e)} Using native DOCX extraction only.")
+        
+        # LibreOffice is started at most once per worker and reused for every document
+        results = convert_batch(jobs, partial(process_docx, backend=args.backend, pdf_backend=args.pdf_backend,
+                                        page_workers=args.page_workers),
+                                soffice_path, workers=args.workers)
+        
+        for docx_file, (input_path, output_path), tokens in zip(pending, jobs, results):
+            if tokens is not None:
+                manifest.record(docx_file, input_path, converter, output_path)
             if tokens:
                 total_tokens += tokens
                 processed_files += 1
+        manifest.save()
         
         # Print summary
-        print(f"\nProcessed {processed_files}/{len(docx_files)} files successfully")
+        print(f"\nProcessed {processed_files}/{len(pending)} files successfully")
         if processed_files > 0:
             print(f"Total tokens extracted: {total_tokens}")
             print(f"Average tokens per file: {total_tokens // processed_files}")
@@ -171,3 +205,28 @@ if __name__ == "__main__":
         print(f"\nAn error occurred: {str(e)}")
     finally:
         pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert patient letters (.docx) to text")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of parallel conversion processes, each with its own LibreOffice")
+    parser.add_argument("--backend", choices=["auto", "docx", "libreoffice"], default="auto",
+                        help="docx: read the DOCX directly; libreoffice: convert via PDF; "
+                             "auto: read directly and only fall back to LibreOffice on failure")
+    parser.add_argument("--force", action="store_true",
+                        help="Reconvert every document, even if it is unchanged since the last run")
+    parser.add_argument("--pdf-backend", choices=list(PDF_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Engine that reads the text of the LibreOffice PDFs (see pdf_text.py)")
+    parser.add_argument("--page-workers", type=int, default=1,
+                        help="Processes extracting the pages of one long PDF in parallel chunks")
+    parser.add_argument("--scratch-dir",
+                        help="Where intermediate PDFs are kept while they are read "
+                             "(default: a RAM-backed directory if available, else the system temp directory)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.scratch_dir:
+        # Set before the pool starts, so the workers inherit it
+        os.environ[SCRATCH_ENV] = os.path.abspath(args.scratch_dir)
+
+    with instrumentation.instrumented(args):
+        main(args)
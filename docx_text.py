@@ -0,0 +1,163 @@
+"""Read letter text straight from the DOCX XML, without LibreOffice or a PDF.
+
+The output follows the layout ``extract_text_from_pdf`` produces, so everything
+downstream reads it the same way:
+
+    === Page 1 ===
+    --- Header ---
+    ...
+    --- Content ---
+    ...
+    --- Footer ---
+    ...
+
+A DOCX file has no fixed pages. Page boundaries come from explicit page breaks,
+"page break before" paragraphs, section breaks and the ``lastRenderedPageBreak``
+markers Word stores from its last layout pass. Headers and footers come from the
+section each page belongs to.
+"""
+from docx import Document
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+
+# Marker yielded by _walk when a new page starts
+PAGE_BREAK = object()
+
+
+def _walk(element):
+    """Yield text pieces and PAGE_BREAK markers for an element, in document order."""
+    tag = element.tag
+    if tag in (MC_FALLBACK, W + 'moveFrom'):
+        # Text boxes are stored twice (DrawingML and VML fallback), and tracked
+        # moves keep the old copy next to the new one; read each text once
+        return
+    if tag == W + 'p':
+        ppr = element.find(W + 'pPr')
+        if ppr is not None and ppr.find(W + 'pageBreakBefore') is not None:
+            yield PAGE_BREAK
+        for child in element:
+            yield from _walk(child)
+        yield '\n'
+        if _ends_section_with_page_break(ppr):
+            yield PAGE_BREAK
+        return
+    if tag == W + 'tbl':
+        for row in element.findall(W + 'tr'):
+            cells = []
+            for cell in row.findall(W + 'tc'):
+                cell_text = ''.join(
+                    piece for piece in _walk_children(cell) if piece is not PAGE_BREAK
+                )
+                cell_text = ' '.join(cell_text.split())
+                # Merged cells repeat their content; keep it once per row
+                if cell_text and (not cells or cells[-1] != cell_text):
+                    cells.append(cell_text)
+            yield ' '.join(cells) + '\n'
+        return
+    if tag == W + 't':
+        yield element.text or ''
+        return
+    if tag == W + 'tab':
+        yield '\t'
+        return
+    if tag in (W + 'br', W + 'cr'):
+        yield PAGE_BREAK if element.get(W + 'type') == 'page' else '\n'
+        return
+    if tag == W + 'lastRenderedPageBreak':
+        yield PAGE_BREAK
+        return
+    yield from _walk_children(element)
+
+
+def _ends_section_with_page_break(ppr):
+    # The last paragraph of a section carries its sectPr. Every section type
+    # except "continuous" starts the next section on a new page.
+    if ppr is None:
+        return False
+    sect_pr = ppr.find(W + 'sectPr')
+    if sect_pr is None:
+        return False
+    section_type = sect_pr.find(W + 'type')
+    return section_type is None or section_type.get(W + 'val') != 'continuous'
+
+
+def _walk_children(element):
+    for child in element:
+        yield from _walk(child)
+
+
+def _block_text(element):
+    """Plain text of a header/footer (page breaks do not apply there)."""
+    text = ''.join(piece for piece in _walk_children(element) if piece is not PAGE_BREAK)
+    return _clean(text)
+
+
+def _clean(text):
+    lines = [line.rstrip() for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line.strip())
+
+
+def _split_pages(body):
+    """Split the body into pages: a list of (section_index, text)."""
+    pages = []
+    current = []
+    section_index = 0
+    for child in body:
+        if child.tag == W + 'sectPr':
+            continue
+        for piece in _walk(child):
+            if piece is PAGE_BREAK:
+                # Hard breaks are usually followed by a lastRenderedPageBreak;
+                # collapse those so we don't emit empty pages.
+                if ''.join(current).strip():
+                    pages.append((section_index, ''.join(current)))
+                    current = []
+            else:
+                current.append(piece)
+        if child.tag == W + 'p':
+            ppr = child.find(W + 'pPr')
+            if ppr is not None and ppr.find(W + 'sectPr') is not None:
+                section_index += 1
+    if ''.join(current).strip():
+        pages.append((section_index, ''.join(current)))
+    return pages
+
+
+def extract_text_from_docx(docx_path):
+    document = Document(docx_path)
+
+    # Resolve "linked to previous" headers/footers once per section
+    resolved = []
+    header_text, footer_text = '', ''
+    for section in document.sections:
+        if not section.header.is_linked_to_previous:
+            header_text = _block_text(section.header._element)
+        if not section.footer.is_linked_to_previous:
+            footer_text = _block_text(section.footer._element)
+        first_header_text, first_footer_text = header_text, footer_text
+        # Word only uses the separate first-page header when the section asks for it
+        if section.different_first_page_header_footer:
+            if not section.first_page_header.is_linked_to_previous:
+                first_header_text = _block_text(section.first_page_header._element)
+            if not section.first_page_footer.is_linked_to_previous:
+                first_footer_text = _block_text(section.first_page_footer._element)
+        resolved.append(((header_text, footer_text), (first_header_text, first_footer_text)))
+
+    full_text = []
+    previous_section = None
+    for i, (section_index, page_text) in enumerate(_split_pages(document.element.body), start=1):
+        section_index = min(section_index, len(resolved) - 1)
+        regular, first = resolved[section_index]
+        header, footer = first if section_index != previous_section else regular
+        previous_section = section_index
+
+        content = _clean(page_text)
+        full_text.append(f"\n=== Page {i} ===")
+        if header or footer:
+            full_text.append(f"--- Header ---\n{header}")
+            full_text.append(f"--- Content ---\n{content}")
+            full_text.append(f"--- Footer ---\n{footer}")
+        else:
+            full_text.append(content)
+    return '\n'.join(full_text)
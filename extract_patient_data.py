@@ -1,61 +1,378 @@
 import spacy
 import re
 import json
+import argparse
+import hashlib
+import importlib.metadata
+import inspect
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, lru_cache
+from itertools import islice
 from pathlib import Path
+from field_scanner import FieldScanner, keep_last
+import page_blocks
+from page_blocks import remove_repeated_blocks
+from extraction_cache import CACHE_FILE, DEFAULT_MAX_ENTRIES, ExtractionCache, text_hash
+import instrumentation
+from patient_records import JSON_FILE, JSONL_FILE, PARQUET_FILE, JsonlWriter, export_parquet
+from patient_registry import REGISTRY_FILE, PatientRegistry
 
-def extract_patient_info(text):
-    info = {}
+MODEL_NAME = "de_core_news_sm"
+# Only sentence boundaries (parser) and PER entities (ner) are used below;
+# the remaining components are never loaded.
+EXCLUDED_COMPONENTS = ("tagger", "morphologizer", "lemmatizer", "attribute_ruler")
+
+# The sentence introducing the patient starts with this phrase
+INTRO_PHRASE = "wir berichten über"
+# Characters around each INTRO_PHRASE occurrence that windowed mode parses
+WINDOW_BEFORE = 300
+WINDOW_AFTER = 700
+# Letters looked up in the extraction cache at once; the misses among them
+# go through nlp.pipe together
+CACHE_LOOKAHEAD = 512
+
+@lru_cache(maxsize=None)
+def load_model(model_name=MODEL_NAME, exclude=EXCLUDED_COMPONENTS):
     # Load the German spaCy model - ensure the model is installed.
     try:
-        nlp = spacy.load("de_core_news_sm")
+        return spacy.load(model_name, exclude=list(exclude))
     except OSError as e:
-        print("Error: Model 'de_core_news_sm' not found. Please run: python -m spacy download de_core_news_sm")
+        print(f"Error: Model '{model_name}' not found. Please run: python -m spacy download {model_name}")
         raise e
-    doc = nlp(text)
-
-    # --- Extract Tumorstatus ---
-    # First try to capture the tumor status from explicit markers ("Tumorstadium:" or "Stadium:")
-    # The regex stops capturing when it encounters an optional ", UICC:" (or end-of-line)
-    tumor_match = re.search(
-        r"(?:Tumorstadium:|Stadium:)\s*(?:TNM:\s*)?(.+?)(?=,?\s*UICC:|\n|$)",
-        text,
-        re.IGNORECASE
-    )
-    if tumor_match:
-        info["tumor_status"] = tumor_match.group(1).strip()
-    else:
-        # Fallback: Suche nach einem typischen TNM-Muster,
-        # z.B. "cT2b, cNx, cM1" (inklusiv möglicher Zusätze am Ende).
-        tnm_fallback = re.search(
-            r"([cpr]T(?:is|\d+[a-z]?))[\s,;]+([cpr]N(?:[0-3][a-z]?|x))[\s,;]+([cpr]M(?:0|1|x))",
-            text,
-            re.IGNORECASE
-        )
-        if tnm_fallback:
-            info["tumor_status"] = tnm_fallback.group(0).strip()
-
-    # --- Extract ECOG Status ---
-    # Look for ECOG values in various formats:
-    # (ECOG 2-3), ECOG: 1, (ECOG2), (ECOG4), etc.
-    ecog_match = re.search(
-        r"""
-        # Match various ECOG patterns (with or without parentheses)
-        (?:
-            \(?                  # Optional opening parenthesis
-            ECOG[\s:-]*         # ECOG followed by optional space, colon, or hyphen
-            (?:                 # Value group
-                (\d)            # First digit
-                (?:             # Optional range group
-                    \s*-\s*     # Hyphen with optional spaces
-                    (\d)        # Second digit
-                )?              # Range is optional
-            )
-            \)?                 # Optional closing parenthesis
+
+def find_intro_windows(text):
+    """Cheap pre-scan: the regions of ``text`` around each INTRO_PHRASE.
+
+    Overlapping windows are merged. Windows start at a line boundary where
+    possible so the first sentence isn't cut mid-word.
+    """
+    windows = []
+    index = text.find(INTRO_PHRASE)
+    while index != -1:
+        start = max(0, index - WINDOW_BEFORE)
+        line_start = text.find('\n', start, index)
+        if start > 0 and line_start != -1:
+            start = line_start + 1
+        end = min(len(text), index + len(INTRO_PHRASE) + WINDOW_AFTER)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+        index = text.find(INTRO_PHRASE, index + 1)
+    return [text[start:end] for start, end in windows]
+
+def _find_intro_span(doc):
+    for sent in doc.sents:
+        if INTRO_PHRASE in sent.text:
+            return sent
+    return None
+
+def _find_intro_sentence(doc):
+    sent = _find_intro_span(doc)
+    return sent.text if sent is not None else None
+
+def _cut_at_window_edge(sent, text):
+    """Whether ``sent``, found in a window of ``text``, may continue past the window."""
+    window = sent.doc.text
+    at_start = not window[:sent.start_char].strip() and not text.startswith(window)
+    at_end = not window[sent.end_char:].strip() and not text.endswith(window)
+    return at_start or at_end
+
+class PatientExtractor:
+    """Extracts patient fields from letter texts with one shared spaCy model.
+
+    The model is loaded on first use and reused for every document. Use
+    ``extract_many`` to push a whole corpus through ``nlp.pipe``.
+
+    spaCy is only needed to find the sentence containing INTRO_PHRASE (and
+    for the PER fallback on that sentence). With ``windowed=True`` only the
+    regions around the phrase are parsed instead of the whole letter, and
+    letters without the phrase skip the full parse entirely. If the windows
+    don't yield the sentence, the full text is parsed as before.
+
+    Header/footer lines repeated across pages are kept on their first page
+    only (see page_blocks.py) before anything else sees the text, unless
+    ``keep_repeated_blocks`` is set.
+    ``tokens_processed`` counts the tokens spaCy has seen so far, and
+    ``chars_in``/``chars_out`` the letter characters before and after that step.
+
+    With an ExtractionCache (extraction_cache.py), letters whose text was
+    extracted before are answered from the cache; ``cache_hits`` counts those,
+    and ``cache_updates`` the ones where only regex fields had to be redone.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, batch_size=32, n_process=1, windowed=False,
+                 keep_repeated_blocks=False, cache=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.windowed = windowed
+        self.keep_repeated_blocks = keep_repeated_blocks
+        self.cache = cache
+        self.tokens_processed = 0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.cache_hits = 0
+        self.cache_updates = 0
+        # Cache writes held back until the current extract_many call succeeds
+        self._deferred = None
+
+    @property
+    def nlp(self):
+        return load_model(self.model_name)
+
+    def _unique_text(self, text, count=True):
+        if not self.keep_repeated_blocks:
+            unique = remove_repeated_blocks(text)
+        else:
+            unique = text
+        if count:
+            self.chars_in += len(text)
+            self.chars_out += len(unique)
+        return unique
+
+    @cached_property
+    def field_versions(self):
+        return field_versions(self.model_name, self.windowed, self.keep_repeated_blocks)
+
+    def _cached(self, text, sha):
+        """The cached record of ``text`` with stale regex fields redone, or None."""
+        entry = self.cache.get(sha)
+        if entry is None:
+            return None
+        record, versions = entry
+        current = self.field_versions
+        if set(versions) != set(current) or any(versions[field] != current[field] for field in NLP_FIELDS):
+            return None
+        stale = [field for field in REGEX_FIELDS if versions[field] != current[field]]
+        if not stale:
+            self.cache_hits += 1
+            return record
+        # Only regex fields changed: rescan the text, spaCy isn't needed
+        found = FIELD_SCANNER.scan(self._unique_text(text, count=False))
+        info = {}
+        for field, (extractor, _) in REGEX_FIELDS.items():
+            if field in stale:
+                extractor(info, found)
+            elif field in record:
+                info[field] = record[field]
+        info.update((key, value) for key, value in record.items() if key not in REGEX_FIELDS)
+        self._put(sha, info, current)
+        self.cache_updates += 1
+        return info
+
+    def _put(self, sha, info, versions):
+        if self._deferred is not None:
+            self._deferred.append((sha, info, versions))
+        else:
+            self.cache.put(sha, info, versions)
+
+    def _regions(self, text):
+        if not self.windowed:
+            return [text]
+        return find_intro_windows(text)
+
+    def _intro_sentence(self, text, docs):
+        for doc in docs:
+            self.tokens_processed += len(doc)
+            sent = _find_intro_span(doc)
+            if sent is None:
+                continue
+            if not self.windowed or not _cut_at_window_edge(sent, text):
+                return sent.text
+            break
+        if self.windowed and INTRO_PHRASE in text:
+            # The sentence runs past its window; parse the full letter
+            doc = self.nlp(text)
+            self.tokens_processed += len(doc)
+            return _find_intro_sentence(doc)
+        return None
+
+    def extract(self, text, name=None):
+        """Info dict of one letter; with ``name``, its metrics are recorded."""
+        if self.cache is not None:
+            sha = text_hash(text)
+            info = self._cached(text, sha)
+            if info is None:
+                info = self._extract(text, name)
+                self.cache.put(sha, info, self.field_versions)
+            return info
+        return self._extract(text, name)
+
+    def _extract(self, text, name=None):
+        watch = instrumentation.Stopwatch()
+        tokens_before = self.tokens_processed
+        text = self._unique_text(text)
+        docs = (self.nlp(region) for region in self._regions(text))
+        info = _extract_fields(text, self._intro_sentence(text, docs), self.nlp)
+        if name is not None and instrumentation.metrics_file():
+            wall, cpu = watch.lap()
+            instrumentation.record("extract_patient_info", name, wall, cpu, text_length=len(text),
+                                   tokens=self.tokens_processed - tokens_before)
+        return info
+
+    def extract_many(self, texts, names=None):
+        """Yield one info dict per text, in input order.
+
+        With ``names`` (one per text), each letter's metrics are recorded
+        (see instrumentation.py). nlp.pipe works in batches, so a letter's
+        time is the time since the previous letter came out of the pipe.
+
+        The records are only cached once every text has been extracted, so
+        a batch that fails and is redone letter by letter isn't answered
+        from the cache the second time.
+        """
+        if self.cache is None:
+            yield from self._extract_many(texts, names)
+            return
+        # Look up CACHE_LOOKAHEAD letters at a time; only the misses go through nlp.pipe
+        texts = iter(texts)
+        names = iter(names) if names is not None else None
+        self._deferred = []
+        try:
+            while True:
+                chunk = list(islice(texts, CACHE_LOOKAHEAD))
+                if not chunk:
+                    break
+                chunk_names = list(islice(names, len(chunk))) if names is not None else None
+                shas = [text_hash(text) for text in chunk]
+                infos = [self._cached(text, sha) for text, sha in zip(chunk, shas)]
+                misses = [i for i, info in enumerate(infos) if info is None]
+                extracted = self._extract_many([chunk[i] for i in misses],
+                                               chunk_names and [chunk_names[i] for i in misses])
+                for i, info in zip(misses, extracted):
+                    self._put(shas[i], info, self.field_versions)
+                    infos[i] = info
+                yield from infos
+            puts = self._deferred
+        finally:
+            self._deferred = None
+        for sha, info, versions in puts:
+            self.cache.put(sha, info, versions)
+
+    def _extract_many(self, texts, names=None):
+        names = iter(names) if names is not None and instrumentation.metrics_file() else None
+        watch = instrumentation.Stopwatch()
+
+        def regions():
+            for text in texts:
+                text = self._unique_text(text)
+                # A letter without regions still sends one empty placeholder,
+                # so every text comes back out of the pipe
+                text_regions = self._regions(text) or [""]
+                for i, region in enumerate(text_regions):
+                    yield region, (text, i == len(text_regions) - 1)
+
+        docs = self.nlp.pipe(regions(), as_tuples=True,
+                             batch_size=self.batch_size, n_process=self.n_process)
+        text_docs = []
+        for doc, (text, is_last) in docs:
+            text_docs.append(doc)
+            if is_last:
+                tokens_before = self.tokens_processed
+                target_sentence = self._intro_sentence(text, text_docs)
+                info = _extract_fields(text, target_sentence, self.nlp)
+                if names is not None:
+                    wall, cpu = watch.lap()
+                    instrumentation.record("extract_patient_info", next(names), wall, cpu,
+                                           text_length=len(text), tokens=self.tokens_processed - tokens_before)
+                yield info
+                # Time the consumer spends on the info is not the extraction's
+                watch.lap()
+                text_docs = []
+
+_default_extractor = PatientExtractor()
+
+def extract_patient_info(text):
+    return _default_extractor.extract(text)
+
+# --- Precompiled pattern registry ---
+# Every full-text pattern is registered with FIELD_SCANNER, which finds all of
+# them in a single pass. The field extractors below turn the matches into
+# values; register more patterns/extractors to extract additional fields.
+
+FIELD_SCANNER = FieldScanner()
+
+# Tumor status from explicit markers ("Tumorstadium:" or "Stadium:").
+# The regex stops capturing when it encounters an optional ", UICC:" (or end-of-line)
+FIELD_SCANNER.register(
+    "tumor_status",
+    r"(?:Tumorstadium:|Stadium:)\s*(?:TNM:\s*)?(.+?)(?=,?\s*UICC:|\n|$)",
+    re.IGNORECASE,
+    first_chars="ts"
+)
+# Fallback: Suche nach einem typischen TNM-Muster,
+# z.B. "cT2b, cNx, cM1" (inklusiv möglicher Zusätze am Ende).
+FIELD_SCANNER.register(
+    "tnm",
+    r"([cpr]T(?:is|\d+[a-z]?))[\s,;]+([cpr]N(?:[0-3][a-z]?|x))[\s,;]+([cpr]M(?:0|1|x))",
+    re.IGNORECASE,
+    first_chars="cpr"
+)
+# ECOG values in various formats: (ECOG 2-3), ECOG: 1, (ECOG2), (ECOG4), etc.
+FIELD_SCANNER.register(
+    "ecog",
+    r"""
+    # Match various ECOG patterns (with or without parentheses)
+    (?:
+        \(?                  # Optional opening parenthesis
+        ECOG[\s:-]*         # ECOG followed by optional space, colon, or hyphen
+        (?:                 # Value group
+            (\d)            # First digit
+            (?:             # Optional range group
+                \s*-\s*     # Hyphen with optional spaces
+                (\d)        # Second digit
+            )?              # Range is optional
         )
-        """,
-        text,
-        re.VERBOSE | re.IGNORECASE  # Allow for verbose regex and case insensitivity
+        \)?                 # Optional closing parenthesis
     )
+    """,
+    re.VERBOSE | re.IGNORECASE,  # Allow for verbose regex and case insensitivity
+    first_chars="(e"
+)
+# Birthdate pattern like "geb. am 15.06.1955" (case-insensitive)
+FIELD_SCANNER.register("birth_date", r"geb\.\s*am\s*(\d{2}\.\d{2}\.\d{4})", re.IGNORECASE,
+                       first_chars="g")
+
+# "Herrn|Frau <Lastname>, <Firstname>, geb. am <date>" anywhere in the text.
+# The strict form (comma before "geb.") stands in for the intro sentence; the
+# last match of the loose form is the final name fallback. Both start at the
+# same position, so they share one scanner entry.
+NAME_WITH_BIRTH_DATE_STRICT = re.compile(
+    r"(Herrn|Frau)\s+[A-ZÄÖÜ][a-zäöüß]+,\s*[A-ZÄÖÜ][a-zäöüß]+,\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}",
+    re.IGNORECASE
+)
+
+def _keep_name_with_birth_date(found, name, match):
+    keep_last(found, name, match)
+    if "intro_fallback" not in found and NAME_WITH_BIRTH_DATE_STRICT.fullmatch(match.group(0)):
+        found["intro_fallback"] = match
+
+FIELD_SCANNER.register(
+    "name_with_birth_date",
+    r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+),\s*([A-ZÄÖÜ][a-zäöüß]+)\s*,?\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}",
+    re.IGNORECASE,
+    handler=_keep_name_with_birth_date,
+    first_chars="hf"
+)
+
+# Patterns applied to the intro sentence only
+# Pattern 1: expecting "Herrn|Frau <Firstname> <Lastname>,"
+NAME_FIRST_LAST = re.compile(r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+)\s+([A-ZÄÖÜ][a-zäöüß]+),")
+# Fallback pattern: "Herrn|Frau <Lastname>, <Firstname>"
+NAME_LAST_FIRST = re.compile(r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+),\s*([A-ZÄÖÜ][a-zäöüß]+)")
+FEMALE_TITLE = re.compile(r"\bFrau\b", re.IGNORECASE)
+MALE_TITLE = re.compile(r"\bHerrn?\b", re.IGNORECASE)
+
+def extract_tumor_status(info, found):
+    if "tumor_status" in found:
+        info["tumor_status"] = found["tumor_status"].group(1).strip()
+    elif "tnm" in found:
+        info["tumor_status"] = found["tnm"].group(0).strip()
+
+def extract_ecog(info, found):
+    ecog_match = found.get("ecog")
     if ecog_match:
         # Extract both numbers if it's a range
         first_value = ecog_match.group(1)
@@ -66,35 +383,32 @@ def extract_patient_info(text):
         else:
             info["ecog"] = first_value
 
-    # --- Extract Birth Date ---
-    # Search for a birthdate pattern like "geb. am 15.06.1955" (case-insensitive)
-    birth_date_match = re.search(r"geb\.\s*am\s*(\d{2}\.\d{2}\.\d{4})", text, re.IGNORECASE)
-    if birth_date_match:
-        info["birth_date"] = birth_date_match.group(1).strip()
+def extract_birth_date(info, found):
+    if "birth_date" in found:
+        info["birth_date"] = found["birth_date"].group(1).strip()
+
+# Run in order; each gets the info dict and the scanner matches
+FIELD_EXTRACTORS = [extract_tumor_status, extract_ecog, extract_birth_date]
+
+def _extract_fields(text, target_sentence, nlp):
+    info = {}
+    found = FIELD_SCANNER.scan(text)
+    for extractor in FIELD_EXTRACTORS:
+        extractor(info, found)
 
     # --- Extract Patient Name & Gender using NER ---
-    # We attempt to find the sentence that contains the patient details.
+    # target_sentence is the sentence that contains the patient details
+    # (see PatientExtractor._intro_sentence).
     patient_name = None
-    target_sentence = None
-    for sent in doc.sents:
-        if "wir berichten über" in sent.text:
-            target_sentence = sent.text
-            break
 
     # Fallback: if no sentence with "wir berichten über" is found,
     # search the entire text for a pattern that includes a name and a birth date.
-    if not target_sentence:
-        fallback_pattern = r"(Herrn|Frau)\s+[A-ZÄÖÜ][a-zäöüß]+,\s*[A-ZÄÖÜ][a-zäöüß]+,\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}"
-        fallback_match = re.search(fallback_pattern, text, re.IGNORECASE)
-        if fallback_match:
-            target_sentence = fallback_match.group(0)
+    if not target_sentence and "intro_fallback" in found:
+        target_sentence = found["intro_fallback"].group(0)
 
     if target_sentence:
         # Try pattern 1: expecting "Herrn|Frau <Firstname> <Lastname>,"
-        name_match = re.search(
-            r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+)\s+([A-ZÄÖÜ][a-zäöüß]+),",
-            target_sentence
-        )
+        name_match = NAME_FIRST_LAST.search(target_sentence)
         if name_match:
             title = name_match.group(1)
             first_name = name_match.group(2)
@@ -102,10 +416,7 @@ def extract_patient_info(text):
             patient_name = f"{first_name} {last_name}"
         else:
             # Fallback pattern: "Herrn|Frau <Lastname>, <Firstname>"
-            name_match = re.search(
-                r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+),\s*([A-ZÄÖÜ][a-zäöüß]+)",
-                target_sentence
-            )
+            name_match = NAME_LAST_FIRST.search(target_sentence)
             if name_match:
                 title = name_match.group(1)
                 last_name = name_match.group(2)
@@ -123,16 +434,11 @@ def extract_patient_info(text):
     else:
         # Fallback: Suche im gesamten Text nach einem Muster, 
         # das einen Namen und ein Geburtsdatum enthält.
-        fallback_names = re.findall(
-            r"(Herrn|Frau)\s+([A-ZÄÖÜ][a-zäöüß]+),\s*([A-ZÄÖÜ][a-zäöüß]+)\s*,?\s*geb\.\s*am\s*\d{1,2}\.\d{1,2}\.\d{4}",
-            text,
-            re.IGNORECASE
-        )
-        if fallback_names:
-            fallback_match = fallback_names[-1]
-            fallback_title = fallback_match[0]  # Wird für die Geschlechtsbestimmung verwendet
-            last_name = fallback_match[1]
-            first_name = fallback_match[2]
+        fallback_match = found.get("name_with_birth_date")
+        if fallback_match:
+            fallback_title = fallback_match.group(1)  # Wird für die Geschlechtsbestimmung verwendet
+            last_name = fallback_match.group(2)
+            first_name = fallback_match.group(3)
             patient_name = f"{first_name} {last_name}"
             info["name"] = patient_name
         else:
@@ -141,16 +447,16 @@ def extract_patient_info(text):
     # Bestimme das Geschlecht anhand des extrahierten Titels (wenn vorhanden),
     # ansonsten anhand der target_sentence.
     if 'fallback_title' in locals() and fallback_title:
-        if re.search(r"\bFrau\b", fallback_title, re.IGNORECASE):
+        if FEMALE_TITLE.search(fallback_title):
             info["gender"] = "female"
-        elif re.search(r"\bHerrn?\b", fallback_title, re.IGNORECASE):
+        elif MALE_TITLE.search(fallback_title):
             info["gender"] = "male"
         else:
             info["gender"] = "unknown"
     elif target_sentence:
-        if re.search(r"\bFrau\b", target_sentence, re.IGNORECASE):
+        if FEMALE_TITLE.search(target_sentence):
             info["gender"] = "female"
-        elif re.search(r"\bHerrn?\b", target_sentence, re.IGNORECASE):
+        elif MALE_TITLE.search(target_sentence):
             info["gender"] = "male"
         else:
             info["gender"] = "unknown"
@@ -159,23 +465,261 @@ def extract_patient_info(text):
 
     return info
 
-def main():
+# --- Extraction cache versions ---
+# Every field of a cached record carries a hash of what it was computed from
+# (see extraction_cache.py). Regex fields depend on their extractor and its
+# scanner patterns only, so changing one pattern only invalidates its field.
+# Name and gender come out of _extract_fields with spaCy; they also depend on
+# the model and the intro sentence settings.
+REGEX_FIELDS = {
+    "tumor_status": (extract_tumor_status, ("tumor_status", "tnm")),
+    "ecog": (extract_ecog, ("ecog",)),
+    "birth_date": (extract_birth_date, ("birth_date",)),
+}
+NLP_FIELDS = ("name", "gender")
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        return obj.__qualname__
+
+def _pattern_key(name):
+    pattern, handler = FIELD_SCANNER.fields[name]
+    return f"{pattern.pattern}\0{pattern.flags}\0{_source(handler)}"
+
+def _version(*parts):
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:16]
+
+def model_version(model_name):
+    """Name and version of a spaCy model, read without loading it."""
+    meta_path = os.path.join(model_name, "meta.json")
+    if os.path.isfile(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+    try:
+        return f"{model_name}-{importlib.metadata.version(model_name)}"
+    except importlib.metadata.PackageNotFoundError:
+        return model_name
+
+def field_versions(model_name=MODEL_NAME, windowed=False, keep_repeated_blocks=False):
+    """``{field: version}`` for records extracted with these settings."""
+    # Anything that changes the text all fields are read from, or the set of extractors
+    base = (_source(page_blocks) if not keep_repeated_blocks else "keep repeated blocks",
+            [extractor.__qualname__ for extractor in FIELD_EXTRACTORS])
+    versions = {field: _version(*base, _source(extractor), *map(_pattern_key, patterns))
+                for field, (extractor, patterns) in REGEX_FIELDS.items()}
+    nlp_version = _version(*base, _source(_extract_fields), _source(PatientExtractor),
+                           _pattern_key("name_with_birth_date"), NAME_FIRST_LAST.pattern,
+                           NAME_LAST_FIRST.pattern, FEMALE_TITLE.pattern, MALE_TITLE.pattern, INTRO_PHRASE,
+                           _source(find_intro_windows) if windowed else None, WINDOW_BEFORE, WINDOW_AFTER,
+                           model_version(model_name), spacy.__version__)
+    versions.update((field, nlp_version) for field in NLP_FIELDS)
+    return versions
+
+def _read_texts(file_paths):
+    for file_path in file_paths:
+        with open(file_path, "r", encoding="utf-8") as file:
+            yield file.read()
+
+# PatientExtractor statistics, reported per batch
+EXTRACTOR_COUNTERS = ("tokens_processed", "chars_in", "chars_out", "cache_hits", "cache_updates")
+
+def extract_files(file_paths, extractor):
+    """Extract a batch of text files; one bad file does not abort the others.
+
+    Returns a list of ``(file name, patient info, error)`` in input order, where
+    exactly one of patient info and error is None.
+    """
+    before = [getattr(extractor, counter) for counter in EXTRACTOR_COUNTERS]
+    try:
+        # Texts are read lazily and streamed through nlp.pipe in batches
+        infos = list(extractor.extract_many(_read_texts(file_paths), names=[p.name for p in file_paths]))
+        return [(file_path.name, info, None) for file_path, info in zip(file_paths, infos)]
+    except Exception:
+        # Redo this batch one file at a time to isolate the failing file(s),
+        # without counting the letters of the failed attempt twice
+        for counter, value in zip(EXTRACTOR_COUNTERS, before):
+            setattr(extractor, counter, value)
+
+    results = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                results.append((file_path.name, extractor.extract(file.read(), file_path.name), None))
+        except Exception as e:
+            results.append((file_path.name, None, str(e)))
+    return results
+
+# Per-process extractor of the --workers pool, created once by _init_worker
+_worker_extractor = None
+
+def _init_worker(batch_size, windowed, keep_repeated_blocks=False, cache_file=None):
+    global _worker_extractor
+    # Each worker has its own connection to the shared cache file
+    cache = ExtractionCache(cache_file) if cache_file else None
+    _worker_extractor = PatientExtractor(batch_size=batch_size, windowed=windowed,
+                                         keep_repeated_blocks=keep_repeated_blocks, cache=cache)
+    # Load the model once per worker, before the first batch arrives
+    _worker_extractor.nlp
+
+def _extract_chunk(file_paths, extractor=None):
+    extractor = extractor or _worker_extractor
+    before = [getattr(extractor, counter) for counter in EXTRACTOR_COUNTERS]
+    results = extract_files(file_paths, extractor)
+    if extractor.cache is not None:
+        extractor.cache.commit()
+    return results, tuple(getattr(extractor, counter) - value for counter, value in zip(EXTRACTOR_COUNTERS, before))
+
+def main(batch_size=32, n_process=1, windowed=False, workers=1, output_format="json", resume=True,
+         parquet=True, keep_repeated_blocks=False, cache_file=CACHE_FILE, cache_size=DEFAULT_MAX_ENTRIES,
+         clear_cache=False, registry_file=REGISTRY_FILE):
     processed_dir = Path("processed_output")
     all_patients = []
+    written_patients = 0
+    failed_files = 0
+    tokens_processed = 0
+    chars_in = chars_out = 0
+    cache_hits = cache_updates = 0
+    # Letters whose records are in this run's output
+    extracted = set()
 
-    for file_path in processed_dir.glob("*.txt"):
-        with open(file_path, "r", encoding="utf-8") as file:
-            text = file.read()
-            patient_info = extract_patient_info(text)
-            if patient_info:
-                patient_info["source_file"] = file_path.name
-                all_patients.append(patient_info)
+    # Records of letters whose text was extracted before come from the cache
+    cache = ExtractionCache(cache_file, cache_size) if cache_file else None
+    if cache is not None and clear_cache:
+        cache.clear()
+        print(f"Cleared the extraction cache {cache_file}")
+    # Every record is also upserted into the indexed registry, by source_file
+    registry = PatientRegistry(registry_file) if registry_file else None
+
+    # Sorted input and in-order merging keep the output independent of --workers
+    file_paths = sorted(processed_dir.glob("*.txt"))
+    current_letters = {file_path.name for file_path in file_paths}
+
+    writer = None
+    if output_format == "jsonl":
+        # Every record is appended and flushed as soon as it is extracted
+        output_file = JSONL_FILE
+        writer = JsonlWriter(output_file, resume=resume)
+        if writer.done:
+            file_paths = [file_path for file_path in file_paths if file_path.name not in writer.done]
+            print(f"Resuming: {len(writer.done)} letters already in {output_file}")
+    else:
+        output_file = JSON_FILE
+
+    chunks = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+
+    if workers <= 1:
+        extractor = PatientExtractor(batch_size=batch_size, n_process=n_process, windowed=windowed,
+                                     keep_repeated_blocks=keep_repeated_blocks, cache=cache)
+        chunk_results = (_extract_chunk(chunk, extractor) for chunk in chunks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(batch_size, windowed, keep_repeated_blocks, cache_file))
+        chunk_results = pool.map(_extract_chunk, chunks)
+
+    try:
+        for results, (chunk_tokens, chunk_chars_in, chunk_chars_out, chunk_hits, chunk_updates) in chunk_results:
+            tokens_processed += chunk_tokens
+            chars_in += chunk_chars_in
+            chars_out += chunk_chars_out
+            cache_hits += chunk_hits
+            cache_updates += chunk_updates
+            for source_file, patient_info, error in results:
+                if error is not None:
+                    print(f"Error processing {source_file}: {error}")
+                    failed_files += 1
+                elif patient_info:
+                    patient_info["source_file"] = source_file
+                    extracted.add(source_file)
+                    if registry is not None:
+                        registry.add(patient_info)
+                    if writer is not None:
+                        writer.write(patient_info)
+                        written_patients += 1
+                    else:
+                        all_patients.append(patient_info)
+        if registry is not None:
+            # Drop letters that were removed or now fail, so the registry matches the output
+            if writer is not None:
+                extracted |= writer.done & current_letters
+            removed = registry.retain(extracted)
+            if removed:
+                print(f"Removed {removed} records from {registry_file} that are no longer in the output")
+    finally:
+        if workers > 1:
+            pool.shutdown()
+        if writer is not None:
+            writer.close()
+        if cache is not None:
+            # Also trims the cache to its size limit
+            cache.close()
+        if registry is not None:
+            registry.close()
+
+    if writer is None:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(all_patients, f, ensure_ascii=False, indent=2)
+        written_patients = len(all_patients)
 
-    output_file = "processed_patients.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_patients, f, ensure_ascii=False, indent=2)
+    print(f"Processed {written_patients} patients. Results saved to {output_file}")
+    if failed_files:
+        print(f"{failed_files} files could not be processed")
+    if written_patients:
+        print(f"spaCy processed {tokens_processed} tokens "
+              f"({tokens_processed // written_patients} per letter)")
+    if cache is not None:
+        print(f"Extraction cache: {cache_hits} letters reused, {cache_updates} with regex fields redone, "
+              f"{len(file_paths) - cache_hits - cache_updates} extracted")
+    if registry is not None:
+        print(f"Registry {registry_file} updated")
+    if chars_in and not keep_repeated_blocks:
+        print(f"Repeated headers/footers removed: {chars_in - chars_out} of {chars_in} characters "
+              f"({(chars_in - chars_out) / chars_in:.1%})")
 
-    print(f"Processed {len(all_patients)} patients. Results saved to {output_file}")
+    # Typed columnar copy for the analysis scripts
+    if parquet:
+        exported = export_parquet(output_file, PARQUET_FILE)
+        if exported is not None:
+            print(f"Wrote {exported} records to {PARQUET_FILE}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract patient data from processed letters")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Number of letters passed to spaCy per batch")
+    parser.add_argument("--n-process", type=int, default=1,
+                        help="Number of processes spaCy uses for nlp.pipe")
+    parser.add_argument("--windowed", action="store_true",
+                        help="Only run spaCy on the region around \"wir berichten über\"")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of extraction processes, each with its own copy of the model")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json",
+                        help=f"json: write {JSON_FILE} at the end; "
+                             f"jsonl: append each record to {JSONL_FILE} as soon as it is extracted")
+    parser.add_argument("--no-resume", action="store_true",
+                        help=f"Start {JSONL_FILE} from scratch instead of skipping letters already in it")
+    parser.add_argument("--no-parquet", action="store_true",
+                        help=f"Don't write the typed columnar copy {PARQUET_FILE}")
+    parser.add_argument("--keep-repeated-blocks", action="store_true",
+                        help="Pass headers/footers repeated on every page to spaCy each time "
+                             "instead of only once per letter")
+    parser.add_argument("--cache", default=CACHE_FILE,
+                        help="SQLite file caching the records of letters already extracted")
+    parser.add_argument("--no-cache", action="store_true", help="Extract every letter again, without the cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the cache before extracting")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="Most records kept in the cache; the least recently used are dropped first")
+    parser.add_argument("--registry", default=REGISTRY_FILE,
+                        help="Indexed SQLite registry the records are upserted into (see patient_registry.py)")
+    parser.add_argument("--no-registry", action="store_true", help="Don't update the registry")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.workers > 1 and args.n_process > 1:
+        parser.error("--workers and --n-process cannot be combined")
+    with instrumentation.instrumented(args):
+        main(batch_size=args.batch_size, n_process=args.n_process, windowed=args.windowed,
+             workers=args.workers, output_format=args.format, resume=not args.no_resume,
+             parquet=not args.no_parquet, keep_repeated_blocks=args.keep_repeated_blocks,
+             cache_file=None if args.no_cache else args.cache, cache_size=args.cache_size,
+             clear_cache=args.clear_cache, registry_file=None if args.no_registry else args.registry)
@@ -0,0 +1,135 @@
+"""Persistent cache of extracted patient records, in a local SQLite file.
+
+Records are stored under the SHA-256 of the letter text, together with the
+version of every field they contain. A field's version is a hash of what it
+is computed from: its scanner patterns and extractor code, and for name and
+gender also the spaCy model (see ``extract_patient_data.field_versions``).
+When the record of an unchanged letter is looked up again:
+
+- all field versions match: the record is reused as it is, without regex or spaCy
+- only regex fields changed: just those are recomputed from the text, spaCy is skipped
+- name/gender changed: the letter is extracted again
+
+So editing one pattern only invalidates the fields built from it. The cache
+holds at most ``max_entries`` records; the least recently used ones are
+evicted first. ``clear`` empties it.
+
+Several processes can share the file (``--workers``). New records and
+``last_used`` updates are kept in memory and written in one short
+transaction by ``commit`` (or after 256 of them), so no process holds the
+write lock while it extracts letters.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+CACHE_FILE = ".extraction_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 100_000
+SCHEMA_VERSION = 1
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, path=CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Used by one thread at a time, but not necessarily the one that opened
+        # it (the pipeline extracts in a stage thread)
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Older layout: start over, it is only a cache
+            self._db.execute("DROP TABLE IF EXISTS records")
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS records (
+                                text_sha TEXT PRIMARY KEY,
+                                record TEXT NOT NULL,
+                                versions TEXT NOT NULL,
+                                last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_last_used ON records (last_used)")
+        self._db.commit()
+        # Writes not yet in the file: text_sha -> (record, versions, last_used), and last_used of hits
+        self._puts = {}
+        self._touched = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        self.commit()
+        return self._db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def get(self, text_sha):
+        """``(record, field versions)`` stored for the text, or None."""
+        if text_sha in self._puts:
+            record, versions, _ = self._puts[text_sha]
+            self._puts[text_sha] = (record, versions, time.time())
+            return json.loads(record), json.loads(versions)
+        row = self._db.execute("SELECT record, versions FROM records WHERE text_sha = ?",
+                               (text_sha,)).fetchone()
+        if row is None:
+            return None
+        self._touched[text_sha] = time.time()
+        self._written()
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, text_sha, record, versions):
+        self._puts[text_sha] = (json.dumps(record, ensure_ascii=False),
+                                json.dumps(versions, sort_keys=True), time.time())
+        self._touched.pop(text_sha, None)
+        self._written()
+
+    def _written(self, every=256):
+        # Write in batches; close() writes the rest
+        if len(self._puts) + len(self._touched) >= every:
+            self.commit()
+
+    def commit(self):
+        """Write the buffered records and last_used updates in one transaction."""
+        if self._puts or self._touched:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO records (text_sha, record, versions, last_used) "
+                                     "VALUES (?, ?, ?, ?)",
+                                     [(sha, *entry) for sha, entry in self._puts.items()])
+                self._db.executemany("UPDATE records SET last_used = ? WHERE text_sha = ?",
+                                     [(used, sha) for sha, used in self._touched.items()])
+            self._puts = {}
+            self._touched = {}
+        self._db.commit()
+
+    def evict(self):
+        """Drop the least recently used records beyond ``max_entries``; returns how many."""
+        self.commit()
+        cursor = self._db.execute(
+            "DELETE FROM records WHERE text_sha IN "
+            "(SELECT text_sha FROM records ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+        self.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        """Invalidate everything."""
+        self._puts = {}
+        self._touched = {}
+        self._db.execute("DELETE FROM records")
+        self.commit()
+        self._db.execute("VACUUM")
+
+    def close(self):
+        if self._db is None:
+            return
+        self.evict()
+        self._db.close()
+        self._db = None
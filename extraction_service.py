@@ -0,0 +1,381 @@
+"""Local HTTP service for field extraction, with the model loaded once.
+
+Calling the scripts from other programs pays for Python, spaCy and possibly
+LibreOffice startup on every call. This service loads the spaCy model and
+starts LibreOffice (when the backend may need it) at startup, so a request
+only costs the conversion and extraction of its own letters.
+
+Endpoints (JSON responses; every response has ``timing`` in milliseconds):
+
+- ``GET /health``: model and LibreOffice status, uptime, request counts.
+  503 while LibreOffice is configured but not responding.
+- ``POST /extract/text``: ``{"text": "...", "name": "optional"}`` or a
+  plain-text body. Returns ``{"record": {...}, "timing": {...}}``.
+- ``POST /extract/docx``: a multipart upload in field ``file``. Returns the
+  record as above plus ``source_file``.
+- ``POST /extract/batch``: multipart uploads in field ``files`` and/or JSON
+  ``{"documents": [{"name": ..., "text": ...}, ...]}``. All letters go through
+  spaCy together; each result has ``record`` or ``error``.
+
+spaCy and LibreOffice each serve one request at a time; DOCX parsing of
+different requests runs in parallel. At most ``--max-pending`` requests
+wait for the model; beyond that the service answers 503 with ``Retry-After``
+instead of queueing without bound. ``timing.queue`` is the time a request
+waited for the model.
+
+    python extraction_service.py --port 5000
+    curl -F file=@patient_data/letter.docx http://127.0.0.1:5000/extract/docx
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import instrumentation
+from docx_text import extract_text_from_docx
+from extract_patient_data import MODEL_NAME, PatientExtractor
+from extraction_cache import CACHE_FILE, ExtractionCache
+from libreoffice_server import LibreOfficeServer
+from pdf_text import DEFAULT_BACKEND, PDF_BACKENDS
+from scratch import process_scratch_dir
+
+if sys.platform == "win32":
+    import convert_patient_data_to_txt_windows as converter
+else:
+    import convert_patient_data_to_txt_mac as converter
+
+DEFAULT_PORT = 5000
+DEFAULT_MAX_PENDING = 8
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_UPLOAD_MB = 50
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Timing(dict):
+    """Milliseconds per step of one request."""
+
+    def __init__(self):
+        super().__init__()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self[name] = round(self.get(name, 0.0) + (time.perf_counter() - start) * 1000, 3)
+
+    def done(self):
+        self["total"] = round((time.perf_counter() - self._start) * 1000, 3)
+        return self
+
+
+class ExtractionService:
+    """The preloaded model and LibreOffice, shared by all requests."""
+
+    def __init__(self, extractor, server=None, backend="auto", pdf_backend=DEFAULT_BACKEND,
+                 max_pending=DEFAULT_MAX_PENDING, max_batch=DEFAULT_MAX_BATCH):
+        self.extractor = extractor
+        self.server = server
+        self.backend = backend
+        self.pdf_backend = pdf_backend
+        self.max_batch = max_batch
+        self.started = time.time()
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        # Neither the spaCy pipeline nor the LibreOffice instance is shared between threads
+        self._model_lock = threading.Lock()
+        self._office_lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._counter_lock = threading.Lock()
+
+    def start(self):
+        """Load the model and start LibreOffice; returns the seconds it took."""
+        start = time.perf_counter()
+        self.extractor.nlp
+        if self.server is not None:
+            self.server.start()
+        return time.perf_counter() - start
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+        if self.extractor.cache is not None:
+            self.extractor.cache.close()
+
+    def count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @contextmanager
+    def admitted(self):
+        """Hold a pending slot for the request; False if all are taken."""
+        if not self._pending.acquire(blocking=False):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._pending.release()
+
+    def docx_text(self, path, timing):
+        """Text of an uploaded letter, as convert_patient_data_to_txt_*.py produces it."""
+        with timing.step("convert"):
+            if self.backend in ("auto", "docx"):
+                try:
+                    return extract_text_from_docx(path)
+                except Exception as e:
+                    if self.backend == "docx" or self.server is None:
+                        raise
+                    print(f"Native extraction failed for {os.path.basename(path)}, "
+                          f"falling back to LibreOffice: {str(e)}")
+            if self.server is None:
+                raise RuntimeError("LibreOffice is not available")
+            with self._office_lock:
+                return converter.extract_text_via_pdf(path, server=self.server, pdf_backend=self.pdf_backend)
+
+    def extract(self, texts, names, timing):
+        """Records of the texts, in order, through spaCy in one batch."""
+        queued = time.perf_counter()
+        with self._model_lock:
+            timing["queue"] = round(timing.get("queue", 0.0) + (time.perf_counter() - queued) * 1000, 3)
+            with timing.step("extract"):
+                records = list(self.extractor.extract_many(texts, names=names))
+                if self.extractor.cache is not None:
+                    self.extractor.cache.commit()
+        return records
+
+    def health(self):
+        libreoffice = "not used"
+        healthy = True
+        if self.server is not None:
+            if not self.server.persistent:
+                libreoffice = "one process per conversion"
+            elif self.server.is_alive():
+                libreoffice = "running"
+            else:
+                libreoffice = "not responding"
+                healthy = False
+        return healthy, {
+            "status": "ok" if healthy else "degraded",
+            "model": self.extractor.model_name,
+            "libreoffice": libreoffice,
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+def _upload_name(upload):
+    # A multipart part may come without a filename
+    return os.path.basename(upload.filename or "") or "upload.docx"
+
+
+def _save_upload(upload):
+    # The letter only lives in this process's scratch directory while it is read
+    name = _upload_name(upload)
+    if not name.endswith(".docx"):
+        raise BadRequest(f"{name}: only .docx files are accepted")
+    path = os.path.join(process_scratch_dir(), f"{uuid.uuid4().hex}_{name}")
+    upload.save(path)
+    return name, path
+
+
+def _docx_texts(service, uploads, timing):
+    """(name, text, error) per uploaded letter."""
+    results = []
+    for upload in uploads:
+        name, path = _upload_name(upload), None
+        try:
+            name, path = _save_upload(upload)
+            results.append((name, service.docx_text(path, timing), None))
+        except Exception as e:
+            # Report the upload's name, not the scratch path
+            message = str(e).replace(path, name) if path else str(e)
+            results.append((name, None, message))
+        finally:
+            if path and os.path.exists(path):
+                os.remove(path)
+    return results
+
+
+def _text_name(name):
+    # Same source_file as the letter's converted text would have
+    return f"{os.path.splitext(name)[0]}.txt"
+
+
+def create_app(service, max_upload_mb=DEFAULT_MAX_UPLOAD_MB):
+    app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = max_upload_mb * 2**20
+
+    def handle(work):
+        # Common request handling: admission, timing, error responses
+        timing = Timing()
+        service.count("requests")
+        with service.admitted() as admitted:
+            if not admitted:
+                service.count("rejected")
+                response = jsonify(error="Too many requests waiting for the model; retry later",
+                                   timing=timing.done())
+                response.headers["Retry-After"] = "1"
+                return response, 503
+            try:
+                body = work(timing)
+                status = 200
+            except BadRequest as e:
+                body, status = {"error": str(e)}, 400
+            except HTTPException:
+                # e.g. 413 for an oversized upload, answered by its error handler
+                raise
+            except Exception as e:
+                service.count("errors")
+                body, status = {"error": str(e)}, 500
+        body["timing"] = timing.done()
+        return jsonify(body), status
+
+    @app.get("/health")
+    def health():
+        healthy, status = service.health()
+        return jsonify(status), 200 if healthy else 503
+
+    @app.post("/extract/text")
+    def extract_text():
+        def work(timing):
+            if request.is_json:
+                data = request.get_json(silent=True) or {}
+                text, name = data.get("text"), data.get("name")
+            else:
+                text, name = request.get_data(as_text=True), request.args.get("name")
+            if not isinstance(text, str) or not text.strip():
+                raise BadRequest("No text given")
+            record = service.extract([text], [name or "request"], timing)[0]
+            return {"record": record}
+        return handle(work)
+
+    @app.post("/extract/docx")
+    def extract_docx():
+        def work(timing):
+            upload = request.files.get("file")
+            if upload is None:
+                raise BadRequest("Upload the letter in the form field 'file'")
+            [(name, text, error)] = _docx_texts(service, [upload], timing)
+            if error is not None:
+                raise BadRequest(error)
+            source_file = _text_name(name)
+            record = service.extract([text], [source_file], timing)[0]
+            record["source_file"] = source_file
+            return {"source_file": source_file, "record": record}
+        return handle(work)
+
+    @app.post("/extract/batch")
+    def extract_batch():
+        def work(timing):
+            uploads = request.files.getlist("files")
+            documents = (request.get_json(silent=True) or {}).get("documents", []) if request.is_json else []
+            if not uploads and not documents:
+                raise BadRequest("Send files in the form field 'files' or JSON {\"documents\": [...]}")
+            if len(uploads) + len(documents) > service.max_batch:
+                raise BadRequest(f"At most {service.max_batch} documents per batch")
+            items = _docx_texts(service, uploads, timing)
+            for i, document in enumerate(documents):
+                text = document.get("text") if isinstance(document, dict) else None
+                name = (document.get("name") if isinstance(document, dict) else None) or f"document_{i}"
+                items.append((name, text, None if isinstance(text, str) and text.strip() else "No text given"))
+
+            ready = [(i, _text_name(name), text) for i, (name, text, error) in enumerate(items) if error is None]
+            results = [{"name": name, "error": error} for name, _, error in items]
+            try:
+                records = service.extract([text for _, _, text in ready], [name for _, name, _ in ready], timing)
+            except Exception:
+                # Redo the batch one letter at a time to isolate the failing letter(s)
+                records = []
+                for i, source_file, text in ready:
+                    try:
+                        records.append(service.extract([text], [source_file], timing)[0])
+                    except Exception as e:
+                        records.append(None)
+                        results[i]["error"] = str(e)
+            for (i, source_file, _), record in zip(ready, records):
+                if record is not None:
+                    record["source_file"] = source_file
+                    results[i] = {"name": items[i][0], "record": record}
+            return {"results": results}
+        return handle(work)
+
+    @app.errorhandler(413)
+    def too_large(e):
+        return jsonify(error=f"Request larger than {max_upload_mb} MB"), 413
+
+    return app
+
+
+def build_service(model_name=MODEL_NAME, backend="auto", pdf_backend=DEFAULT_BACKEND, windowed=False,
+                  keep_repeated_blocks=False, cache_file=CACHE_FILE, max_pending=DEFAULT_MAX_PENDING,
+                  max_batch=DEFAULT_MAX_BATCH):
+    # LibreOffice is only located when the chosen backend may need it
+    soffice_path = None
+    if backend != "docx":
+        try:
+            soffice_path = converter.find_soffice()
+        except FileNotFoundError as e:
+            if backend == "libreoffice":
+                raise
+            print(f"Warning: {str(e)} Using native DOCX extraction only.")
+    cache = ExtractionCache(cache_file) if cache_file else None
+    extractor = PatientExtractor(model_name=model_name, windowed=windowed,
+                                 keep_repeated_blocks=keep_repeated_blocks, cache=cache)
+    server = LibreOfficeServer(soffice_path) if soffice_path else None
+    return ExtractionService(extractor, server, backend, pdf_backend, max_pending, max_batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve field extraction over HTTP with the model preloaded")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: local only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--model", default=MODEL_NAME, help="spaCy model")
+    parser.add_argument("--backend", choices=["auto", "docx", "libreoffice"], default="auto",
+                        help="docx: read the DOCX directly; libreoffice: convert via PDF; "
+                             "auto: read directly and only fall back to LibreOffice on failure")
+    parser.add_argument("--pdf-backend", choices=list(PDF_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Engine that reads the text of the LibreOffice PDFs (see pdf_text.py)")
+    parser.add_argument("--windowed", action="store_true",
+                        help="Only run spaCy on the region around \"wir berichten über\"")
+    parser.add_argument("--keep-repeated-blocks", action="store_true",
+                        help="Pass headers/footers repeated on every page to spaCy each time "
+                             "instead of only once per letter")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Don't reuse or store records in the extraction cache {CACHE_FILE}")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="Requests that may wait for the model at once; more are answered with 503")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help="Most documents in one /extract/batch request")
+    parser.add_argument("--max-upload-mb", type=int, default=DEFAULT_MAX_UPLOAD_MB,
+                        help="Largest request body accepted")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumentation.instrumented(args):
+        service = build_service(args.model, args.backend, args.pdf_backend, args.windowed,
+                                args.keep_repeated_blocks, None if args.no_cache else CACHE_FILE,
+                                args.max_pending, args.max_batch)
+        try:
+            print(f"Model{' and LibreOffice' if service.server is not None else ''} ready in "
+                  f"{service.start():.1f}s")
+            app = create_app(service, args.max_upload_mb)
+            app.run(host=args.host, port=args.port, threaded=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
@@ -0,0 +1,95 @@
+"""Single-pass scanner for the regex-based fields of a letter.
+
+Every field is registered with its own pattern. All patterns are joined into one
+alternation of named groups, so the text is walked once instead of once per
+field. Each hit is dispatched to the field's handler. The scan resumes one
+character after the start of each hit, so fields whose matches overlap (e.g.
+a birth date inside a "Herrn X, Y, geb. am ..." match) are all still found.
+
+Field patterns must not define named groups of their own, and no two fields
+may be able to match at the same start position: only the first registered
+alternative is reported there.
+
+A plain alternation is no faster than separate searches, because ``re`` tries
+every alternative at every position. When each field declares the characters
+its matches can start with (``first_chars``), the combined pattern is guarded
+by a single character-class lookahead. Positions that can't start any field
+then cost one check. Fields registered without the hint still work; they only
+disable the guard.
+"""
+import re
+
+# Inline flags that can be scoped to one alternative of the combined pattern
+_SCOPED_FLAGS = (
+    (re.IGNORECASE, 'i'),
+    (re.MULTILINE, 'm'),
+    (re.DOTALL, 's'),
+    (re.VERBOSE, 'x'),
+)
+
+
+def keep_first(found, name, match):
+    """Keep the first match, like ``re.search``."""
+    found.setdefault(name, match)
+
+
+def keep_last(found, name, match):
+    """Keep the last match, like ``re.findall(...)[-1]``."""
+    found[name] = match
+
+
+class FieldScanner:
+    def __init__(self):
+        # name -> (compiled pattern, handler)
+        self.fields = {}
+        self._first_chars = {}
+        self._combined = None
+
+    def register(self, name, pattern, flags=0, handler=keep_first, first_chars=None):
+        """Add a field. ``handler(found, name, match)`` records the hit in ``found``.
+
+        ``first_chars`` lists every character a match can start with; for
+        case-insensitive patterns either case is enough.
+        """
+        compiled = re.compile(pattern, flags)
+        if first_chars is not None and flags & re.IGNORECASE:
+            first_chars = first_chars.lower() + first_chars.upper()
+        self.fields[name] = (compiled, handler)
+        self._first_chars[name] = first_chars
+        self._combined = None
+
+    def unregister(self, name):
+        del self.fields[name]
+        del self._first_chars[name]
+        self._combined = None
+
+    @property
+    def combined(self):
+        if self._combined is None:
+            parts = []
+            for name, (pattern, _) in self.fields.items():
+                scoped = ''.join(letter for flag, letter in _SCOPED_FLAGS if pattern.flags & flag)
+                body = pattern.pattern
+                if scoped:
+                    # The newline ends any trailing comment in a verbose pattern
+                    body = f"(?{scoped}:{body}\n)" if 'x' in scoped else f"(?{scoped}:{body})"
+                parts.append(f"(?P<{name}>{body})")
+            combined = '|'.join(parts)
+            if self.fields and None not in self._first_chars.values():
+                first_chars = ''.join(sorted(set(''.join(self._first_chars.values()))))
+                combined = f"(?=[{re.escape(first_chars)}])(?:{combined})"
+            self._combined = re.compile(combined)
+        return self._combined
+
+    def scan(self, text):
+        """Return ``{field name: match}`` as recorded by the field handlers."""
+        found = {}
+        combined = self.combined
+        hit = combined.search(text)
+        while hit:
+            name = hit.lastgroup
+            pattern, handler = self.fields[name]
+            # Re-match the field's own pattern so its groups are numbered as usual
+            handler(found, name, pattern.match(text, hit.start()))
+            hit = combined.search(text, hit.start() + 1)
+        return found
@@ -0,0 +1,216 @@
+"""Per-document and per-stage timing, written to a JSON Lines metrics file.
+
+Every script takes ``--metrics FILE``. With it, each stage a document passes
+through appends one line to FILE:
+
+    {"run": "...", "stage": "extract_text_from_pdf", "document": "a.docx",
+     "wall": 0.41, "cpu": 0.39, "pages": 3, "text_length": 5120}
+
+``wall`` is elapsed time and ``cpu`` the CPU time of the recording thread,
+both in seconds. Time spent inside LibreOffice (a separate process) only
+shows up as wall time of ``convert_to_pdf``. Depending on the stage, a line
+also has ``pages``, ``text_length`` (characters) and ``tokens`` (spaCy
+tokens). Whole-run stages such as the analysis scripts use the input file as
+``document``.
+
+The file location and run id are passed to pool workers through environment
+variables, so workers append to the same file. Each line is a single write,
+and the file is never truncated; ``run`` tells the runs apart. At the end of
+a run the stages are totalled and the slowest documents printed
+(``--metrics-top``). ``python instrumentation.py FILE`` prints the same
+summary for the last run in an existing file.
+
+``--profile cprofile`` or ``--profile tracemalloc`` additionally profiles the
+main process for one run: the functions with the most cumulative time (the
+full stats go to ``--profile-output`` for snakeviz/pstats), or the lines that
+allocated the most memory and the peak.
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+
+METRICS_ENV = "MEDPARSE_METRICS_FILE"
+RUN_ENV = "MEDPARSE_METRICS_RUN"
+PROFILES = ("cprofile", "tracemalloc")
+DEFAULT_PROFILE_OUTPUT = "profile.prof"
+# Stages that contain other stages: letter conversion as a whole, and the
+# letter-to-record latency of the pipeline and the watch daemon
+ENVELOPE_STAGES = {"process_docx", "pipeline_latency", "watch_latency"}
+
+
+def metrics_file():
+    """The metrics file of this run, or None if metrics are off."""
+    return os.environ.get(METRICS_ENV)
+
+
+def enable(path):
+    """Turn metrics on for this process and the workers it starts; returns the run id."""
+    run = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    os.environ[METRICS_ENV] = os.path.abspath(path)
+    os.environ[RUN_ENV] = run
+    return run
+
+
+def record(stage, document, wall, cpu=None, **fields):
+    """Append one metrics line (no-op while metrics are off)."""
+    path = metrics_file()
+    if not path:
+        return
+    entry = {"run": os.environ.get(RUN_ENV), "stage": stage, "document": document, "wall": round(wall, 6)}
+    if cpu is not None:
+        entry["cpu"] = round(cpu, 6)
+    entry.update((key, value) for key, value in fields.items() if value is not None)
+    # One write per line, so lines from several processes don't interleave
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+@contextlib.contextmanager
+def measure(stage, document):
+    """Time the block; yields a dict for pages/text_length/tokens.
+
+    Nothing is recorded while metrics are off, or if the block raises.
+    """
+    fields = {}
+    wall, cpu = time.perf_counter(), time.thread_time()
+    yield fields
+    if metrics_file():
+        record(stage, document, time.perf_counter() - wall, time.thread_time() - cpu, **fields)
+
+
+class Stopwatch:
+    """Wall/CPU time since the last ``lap``, for per-item times of batched generators."""
+
+    def __init__(self):
+        self._last = time.perf_counter(), time.thread_time()
+
+    def lap(self):
+        """(wall, cpu) seconds since the previous lap."""
+        now = time.perf_counter(), time.thread_time()
+        elapsed = now[0] - self._last[0], now[1] - self._last[1]
+        self._last = now
+        return elapsed
+
+
+def load_metrics(path, run=None):
+    """The lines of ``path`` from ``run`` (default: the last run in the file)."""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    if run is None and entries:
+        run = entries[-1].get("run")
+    return [entry for entry in entries if entry.get("run") == run]
+
+
+def summarize(entries, top=10):
+    """Per-stage totals, and the ``top`` slowest documents with their stage times.
+
+    Documents are matched across stages by name without extension (the
+    letter's .docx and its .txt are one document). Stages in
+    ENVELOPE_STAGES contain other stages and don't count towards a
+    document's time.
+    """
+    stages = defaultdict(lambda: {"documents": 0, "wall": 0.0, "cpu": 0.0, "pages": 0,
+                                  "text_length": 0, "tokens": 0})
+    documents = defaultdict(dict)
+    for entry in entries:
+        totals = stages[entry["stage"]]
+        totals["documents"] += 1
+        for key in ("wall", "cpu", "pages", "text_length", "tokens"):
+            totals[key] += entry.get(key, 0)
+        if entry["stage"] not in ENVELOPE_STAGES:
+            stage_times = documents[os.path.splitext(entry["document"])[0]]
+            stage_times[entry["stage"]] = stage_times.get(entry["stage"], 0.0) + entry["wall"]
+    slowest = sorted(documents.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top]
+    return dict(stages), slowest
+
+
+def print_summary(path, run=None, top=10):
+    entries = load_metrics(path, run)
+    if not entries:
+        print(f"No metrics recorded in {path}")
+        return
+    stages, slowest = summarize(entries, top)
+    print(f"\nStage timings (run {entries[0]['run']}, {path}):")
+    print(f"  {'stage':26s} {'docs':>6s} {'wall s':>9s} {'cpu s':>9s} {'ms/doc':>9s} {'pages':>7s} "
+          f"{'chars':>10s} {'tokens':>9s}")
+    for stage, totals in sorted(stages.items(), key=lambda item: item[1]["wall"], reverse=True):
+        print(f"  {stage:26s} {totals['documents']:6d} {totals['wall']:9.2f} {totals['cpu']:9.2f} "
+              f"{totals['wall'] / totals['documents'] * 1000:9.1f} {totals['pages']:7d} "
+              f"{totals['text_length']:10d} {totals['tokens']:9d}")
+    print(f"\nSlowest {len(slowest)} documents:")
+    for document, stage_times in slowest:
+        breakdown = ", ".join(f"{stage} {seconds:.3f}s"
+                              for stage, seconds in sorted(stage_times.items(), key=lambda item: -item[1]))
+        print(f"  {sum(stage_times.values()):8.3f}s  {document}: {breakdown}")
+
+
+@contextlib.contextmanager
+def profiled(kind, output=DEFAULT_PROFILE_OUTPUT, top=25):
+    """Profile the block with cProfile or tracemalloc and print the hot spots."""
+    if kind == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output)
+            print(f"\ncProfile: top {top} by cumulative time (full stats in {output})")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+    elif kind == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\ntracemalloc: peak {peak / 2**20:.1f} MiB; top {top} allocation sites still held:")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"  {stat}")
+    else:
+        yield
+
+
+def add_arguments(parser):
+    """The --metrics/--profile options every script shares."""
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Append per-document, per-stage timings to FILE (JSON Lines) "
+                             "and print the slowest documents at the end")
+    parser.add_argument("--metrics-top", type=int, default=10, metavar="N",
+                        help="Slowest documents listed in the metrics summary")
+    parser.add_argument("--profile", choices=PROFILES,
+                        help="Profile this run's main process: cProfile hot spots or tracemalloc allocations")
+    parser.add_argument("--profile-output", default=DEFAULT_PROFILE_OUTPUT,
+                        help="Where the cProfile stats are saved")
+
+
+@contextlib.contextmanager
+def instrumented(args):
+    """Run the block with the --metrics/--profile options in ``args``."""
+    run = enable(args.metrics) if args.metrics else None
+    try:
+        with profiled(args.profile, args.profile_output):
+            yield
+    finally:
+        if run is not None and os.path.exists(args.metrics):
+            print_summary(args.metrics, run, args.metrics_top)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a metrics file written with --metrics")
+    parser.add_argument("metrics", help="Metrics file (JSON Lines)")
+    parser.add_argument("--run", help="Run id to summarize (default: the last run in the file)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest documents to list")
+    args = parser.parse_args()
+    print_summary(args.metrics, args.run, args.top)
@@ -0,0 +1,229 @@
+"""Long-lived headless LibreOffice instance for DOCX -> PDF conversion.
+
+Starting ``soffice`` takes seconds, so instead of launching it once per letter
+we start one headless instance listening on a private UNO pipe and send every
+conversion to it. ``storeToURL`` only returns once the PDF is written, which
+replaces the old fixed ``time.sleep(2)``. A document that takes longer
+than ``convert_timeout`` counts as failed: the instance is killed and a new
+one started for the next document.
+
+The UNO bindings (``import uno``) ship with LibreOffice but are not always
+importable from a virtualenv. Without them every conversion falls back to a
+single ``soffice --convert-to`` call that we wait on.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+class LibreOfficeServer:
+    def __init__(self, soffice_path, profile_dir=None, startup_timeout=60, convert_timeout=300):
+        self.soffice_path = soffice_path
+        self.startup_timeout = startup_timeout
+        self.convert_timeout = convert_timeout
+        # A private user profile keeps us from fighting over the profile lock
+        # with a desktop LibreOffice (or another server) that is already running.
+        self._owns_profile = profile_dir is None
+        self.profile_dir = profile_dir or tempfile.mkdtemp(prefix="medparse_lo_")
+        self.pipe_name = f"medparse_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.process = None
+        self._desktop = None
+        self.restarts = 0
+
+    @property
+    def profile_url(self):
+        return Path(self.profile_dir).resolve().as_uri()
+
+    @property
+    def persistent(self):
+        """True when conversions go through a running instance (UNO available)."""
+        return uno is not None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        if not self.persistent or self.process is not None:
+            return
+        cmd = [
+            self.soffice_path,
+            f"-env:UserInstallation={self.profile_url}",
+            '--headless',
+            '--invisible',
+            '--nologo',
+            '--nodefault',
+            '--norestore',
+            '--nolockcheck',
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+        ]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._desktop = self._connect()
+
+    def _connect(self):
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"LibreOffice exited during startup (code {self.process.returncode})")
+            try:
+                context = resolver.resolve(
+                    f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                # The pipe only appears once soffice has finished starting up
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"LibreOffice did not accept connections within {self.startup_timeout}s"
+                    )
+                time.sleep(0.1)
+        return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+    def is_alive(self):
+        """Health check: the process is running and still answers over UNO."""
+        if not self.persistent:
+            return True
+        if self.process is None or self.process.poll() is not None or self._desktop is None:
+            return False
+        try:
+            self._desktop.getFrames()
+            return True
+        except Exception:
+            return False
+
+    def restart(self):
+        self.stop(keep_profile=True)
+        self.restarts += 1
+        self.start()
+
+    def stop(self, keep_profile=False):
+        if self._desktop is not None:
+            try:
+                self._desktop.terminate()
+            except Exception:
+                # Already gone, or the bridge dropped while shutting down
+                pass
+            self._desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self._owns_profile and not keep_profile:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def convert(self, input_path, pdf_path):
+        """Convert ``input_path`` to ``pdf_path``. Returns True on success."""
+        abs_input_path = os.path.abspath(input_path)
+        abs_pdf_path = os.path.abspath(pdf_path)
+        os.makedirs(os.path.dirname(abs_pdf_path), exist_ok=True)
+
+        if not self.persistent:
+            return self._convert_once(abs_input_path, abs_pdf_path)
+
+        for attempt in (1, 2):
+            if self.process is None:
+                self.start()
+            elif not self.is_alive():
+                self.restart()
+            # A document that hangs LibreOffice must not stall every later one:
+            # after convert_timeout the instance is killed (and restarted for the next document)
+            timed_out = threading.Event()
+            watchdog = threading.Timer(self.convert_timeout, self._kill, args=(timed_out,))
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                self._export(abs_input_path, abs_pdf_path)
+                if timed_out.is_set():
+                    raise TimeoutError()
+                return os.path.exists(abs_pdf_path)
+            except Exception as e:
+                if timed_out.is_set():
+                    print(f"LibreOffice conversion error: {os.path.basename(abs_input_path)} did not finish "
+                          f"within {self.convert_timeout}s")
+                    return False
+                # A document that fails while LibreOffice keeps running is broken
+                # on its own; only a crashed instance is worth restarting for.
+                if attempt == 2 or self.is_alive():
+                    print(f"LibreOffice conversion error: {str(e)}")
+                    return False
+            finally:
+                watchdog.cancel()
+        return False
+
+    def _kill(self, timed_out):
+        # Runs in the watchdog thread; the blocked UNO call then fails
+        timed_out.set()
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def _export(self, abs_input_path, abs_pdf_path):
+        doc = self._desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(abs_input_path),
+            "_blank",
+            0,
+            (_property("Hidden", True), _property("ReadOnly", True)),
+        )
+        if doc is None:
+            raise IOError(f"LibreOffice could not open {os.path.basename(abs_input_path)}")
+        try:
+            # storeToURL is synchronous: the PDF is complete when it returns
+            doc.storeToURL(
+                uno.systemPathToFileUrl(abs_pdf_path),
+                (_property("FilterName", "writer_pdf_Export"),),
+            )
+        finally:
+            doc.close(True)
+
+    def _convert_once(self, abs_input_path, abs_pdf_path):
+        abs_output_dir = os.path.dirname(abs_pdf_path)
+        cmd = [
+            self.soffice_path,
+            f"-env:UserInstallation={self.profile_url}",
+            '--headless',
+            '--convert-to', 'pdf',
+            '--outdir', abs_output_dir,
+            abs_input_path
+        ]
+        # soffice only exits after the export is done, so waiting on it is enough
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.convert_timeout)
+        if result.returncode != 0:
+            print(f"LibreOffice conversion error: {result.stderr}")
+            return False
+
+        expected_name = os.path.splitext(os.path.basename(abs_input_path))[0] + '.pdf'
+        expected_path = os.path.join(abs_output_dir, expected_name)
+        if not os.path.exists(expected_path):
+            print(f"Expected PDF not found at: {expected_path}")
+            return False
+        if os.path.normcase(expected_path) != os.path.normcase(abs_pdf_path):
+            os.replace(expected_path, abs_pdf_path)
+        return True
@@ -0,0 +1,106 @@
+"""Drop header/footer lines that repeat on every page of a letter.
+
+The converted letters mark each page's header and footer (see pdf_text.py and
+docx_text.py):
+
+    === Page i ===
+    --- Header ---
+    --- Content ---
+    --- Footer ---
+
+The letterhead, address block and page footer are the same on every page, so
+without this step they are tokenized by spaCy once per page. Every header and
+footer line gets a fingerprint (a hash of the line with whitespace collapsed;
+page numbers like "Seite 2 von 5" all count as one line). A line whose
+fingerprint occurs on ``min_pages`` or more pages is kept on the first of
+those pages only. Content lines are never touched, and neither are lines that
+appear on fewer pages, so nothing that occurs once in a letter is lost.
+"""
+import hashlib
+import re
+
+PAGE_MARKER = re.compile(r'^=== Page \d+ ===$')
+HEADER_MARKER = "--- Header ---"
+CONTENT_MARKER = "--- Content ---"
+FOOTER_MARKER = "--- Footer ---"
+
+# "Seite 2 von 5", "Page 2 of 5", "- 2 -", "2/5" and the like
+PAGE_NUMBER = re.compile(r'^(?:(?:seite|page)\s*)?[-–]?\s*\d+\s*(?:(?:von|of|/)\s*\d+)?\s*[-–]?$', re.I)
+
+
+def fingerprint(line):
+    """Hash of a header/footer line, insensitive to spacing and page numbers."""
+    normalized = ' '.join(line.split())
+    if PAGE_NUMBER.match(normalized):
+        normalized = "<page number>"
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+
+def _split_pages(lines):
+    """Group the lines into pages: lists of (section, line).
+
+    section is "header", "footer" or None (content, markers and pages
+    without a header/footer split).
+    """
+    pages = [[]]
+    section = None
+    for line in lines:
+        if PAGE_MARKER.match(line):
+            pages.append([])
+            section = None
+        elif line == HEADER_MARKER:
+            section = "header"
+        elif line == CONTENT_MARKER:
+            section = None
+        elif line == FOOTER_MARKER:
+            section = "footer"
+        elif section is not None:
+            pages[-1].append((section, line))
+            continue
+        pages[-1].append((None, line))
+    return pages
+
+
+def remove_repeated_blocks(text, min_pages=2):
+    """``text`` with repeated header/footer lines kept on their first page only."""
+    lines = text.split('\n')
+    pages = _split_pages(lines)
+    if len(pages) <= 2:
+        # Single-page letters (or text without page markers) have nothing to repeat
+        return text
+
+    # Number of pages each header/footer fingerprint occurs on
+    page_counts = {}
+    for page in pages:
+        for key in {fingerprint(line) for section, line in page if section and line.strip()}:
+            page_counts[key] = page_counts.get(key, 0) + 1
+    repeated = {key for key, count in page_counts.items() if count >= min_pages}
+    if not repeated:
+        return text
+
+    emitted = set()
+    kept = []
+    for page in pages:
+        page_lines = []
+        for section, line in page:
+            if section and line.strip():
+                key = fingerprint(line)
+                if key in repeated:
+                    if key in emitted:
+                        continue
+                    emitted.add(key)
+            page_lines.append((section, line))
+        kept.extend(_drop_empty_sections(page_lines))
+    return '\n'.join(kept)
+
+
+def _drop_empty_sections(page_lines):
+    # A header or footer marker with no lines left under it is dropped as well
+    result = []
+    for i, (section, line) in enumerate(page_lines):
+        if line in (HEADER_MARKER, FOOTER_MARKER):
+            following = page_lines[i + 1][0] if i + 1 < len(page_lines) else None
+            if following is None:
+                continue
+        result.append(line)
+    return result
@@ -0,0 +1,210 @@
+"""Reading and writing the extracted patient records.
+
+Records are stored either as one JSON array (``processed_patients.json``) or
+as JSON Lines (``processed_patients.jsonl``, one record per line). The JSON
+Lines file is appended to and flushed record by record, so an interrupted run
+keeps everything written so far and can resume where it stopped.
+
+The readers handle both formats. JSON Lines files are streamed, and a last
+line that was cut off by a crash is ignored.
+
+Next to either file, extraction writes a typed columnar copy,
+``processed_patients.parquet``. In it, birth dates are dates, gender/ECOG and
+the T/N/M stages are dictionary-encoded (categoricals in pandas), and readers
+can load just the columns they need. This needs ``pyarrow``; without it the
+Parquet export is skipped and everything keeps using JSON.
+"""
+import json
+import os
+import pandas as pd
+from tnm import add_tnm_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+JSON_FILE = "processed_patients.json"
+JSONL_FILE = "processed_patients.jsonl"
+PARQUET_FILE = "processed_patients.parquet"
+
+# Columns of the typed store, in order
+STRING_COLUMNS = ['name', 'tumor_status', 'source_file']
+CATEGORY_COLUMNS = ['gender', 'ecog', 'T_stage', 'N_stage', 'M_stage']
+DATE_COLUMNS = ['birth_date']
+TYPED_COLUMNS = ['name', 'birth_date', 'gender', 'tumor_status', 'ecog',
+                 'T_stage', 'N_stage', 'M_stage', 'source_file']
+
+
+def find_patients_file(directory=".", raw=False):
+    """The most recently written patient file in ``directory``.
+
+    With ``raw=True`` the Parquet copy is skipped, for checks that need the
+    values exactly as extracted.
+    """
+    names = (JSONL_FILE, JSON_FILE) if raw or pq is None else (PARQUET_FILE, JSONL_FILE, JSON_FILE)
+    candidates = [os.path.join(directory, name) for name in names]
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        return candidates[-1]
+    return max(existing, key=os.path.getmtime)
+
+
+def iter_patient_records(path):
+    """Yield patient records one by one."""
+    if not str(path).endswith(".jsonl"):
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                # Partial record from an interrupted run
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def _is_parquet(path):
+    return str(path).endswith(".parquet")
+
+
+def to_typed_frame(df):
+    """Convert raw records to the column types of the Parquet store (in place)."""
+    if 'tumor_status' in df.columns and 'T_stage' not in df.columns:
+        add_tnm_columns(df)
+        df.drop(columns=['tumor_status_clean'], inplace=True)
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            # Dates that don't parse become NaT; the JSON keeps the original text
+            df[column] = pd.to_datetime(df[column], format='%d.%m.%Y', errors='coerce')
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def _sort_categories(df):
+    # Dictionaries of different row groups are merged in order of appearance
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].cat.set_categories(sorted(df[column].cat.categories))
+    return df
+
+
+def iter_patient_chunks(path, chunksize=10000, columns=None):
+    """Yield DataFrames of at most ``chunksize`` records.
+
+    With ``columns``, every chunk has exactly those columns (missing values are
+    NaN) and all other fields are dropped right away. Parquet files are read
+    row group by row group, with their stored types.
+    """
+    if _is_parquet(path):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas(date_as_object=False)
+        return
+
+    chunk = []
+    for record in iter_patient_records(path):
+        if columns is not None:
+            record = {column: record.get(column) for column in columns}
+        chunk.append(record)
+        if len(chunk) >= chunksize:
+            yield pd.DataFrame(chunk, columns=columns)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def load_patients(path=None, columns=None, chunksize=10000):
+    """Load the patient records into one DataFrame.
+
+    Parquet files are read directly (only ``columns``) with their stored
+    types; JSON files are read in chunks.
+    """
+    path = path or find_patients_file()
+    if _is_parquet(path):
+        table = pq.read_table(path, columns=columns)
+        return _sort_categories(table.to_pandas(date_as_object=False))
+    chunks = list(iter_patient_chunks(path, chunksize, columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _parquet_schema():
+    category = pa.dictionary(pa.int32(), pa.string())
+    types = {column: pa.string() for column in STRING_COLUMNS}
+    types.update({column: category for column in CATEGORY_COLUMNS})
+    types.update({column: pa.date32() for column in DATE_COLUMNS})
+    return pa.schema([(column, types[column]) for column in TYPED_COLUMNS])
+
+
+def export_parquet(source_path, parquet_path=PARQUET_FILE, chunksize=10000):
+    """Write the typed columnar copy of ``source_path``, one row group per chunk.
+
+    Returns the number of records written, or None if pyarrow is missing.
+    """
+    if pq is None:
+        print("Note: pyarrow is not installed, skipping the Parquet export")
+        return None
+    schema = _parquet_schema()
+    records = 0
+    tmp_path = parquet_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for df in iter_patient_chunks(source_path, chunksize, columns=['name', 'birth_date', 'gender',
+                                                                        'tumor_status', 'ecog', 'source_file']):
+            df = to_typed_frame(df)[TYPED_COLUMNS]
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            records += len(df)
+    os.replace(tmp_path, parquet_path)
+    return records
+
+
+class JsonlWriter:
+    """Append-only JSON Lines writer that flushes every record.
+
+    With ``resume=True`` an existing file is kept; a partial last line left by a
+    crash is cut off, and ``done`` holds the ``source_file`` of every record
+    already written. Otherwise the file is started from scratch.
+    """
+
+    def __init__(self, path=JSONL_FILE, resume=True):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            self._drop_partial_line()
+            self.done = {record.get("source_file") for record in iter_patient_records(path)}
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def _drop_partial_line(self, block_size=1 << 16):
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            # Walk back from the end to the last newline
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                block = f.read(position - start)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                f.truncate(position)
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,263 @@
+"""Indexed SQLite registry of the extracted patient records.
+
+Extraction upserts every record into ``patients.sqlite``, keyed by
+``source_file``: re-extracting a letter replaces its row. Next to the record
+as extracted, each row has the columns queries filter on, with indexes on
+the T/N/M stages, ECOG, gender and birth year:
+
+- ``T_stage``/``N_stage``/``M_stage`` and their prefixes, as from ``tnm.parse_tnm``
+  ("CM1", "PT2A"; prefix "c"/"p"/"r")
+- ``ecog_score``: the ECOG value as a number; for a range such as "1-2" the
+  higher value, so "ECOG >= 2" includes it
+- ``gender`` in lower case and ``birth_year`` from the birth date
+
+Queries return records one by one and counts are computed by SQLite, so
+nothing loads the whole dataset:
+
+    with PatientRegistry() as registry:
+        for record in registry.query(M="cM1", min_ecog=2):
+            ...
+        registry.count("T_stage", gender="female")
+
+A stage filter with a prefix ("cM1") matches exactly that stage, one without
+("M1") matches it with any prefix.
+
+    python patient_registry.py query --M cM1 --min-ecog 2
+    python patient_registry.py count T_stage M_stage --gender female
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import pandas as pd
+from tnm import TNM_COLUMNS, parse_tnm
+
+REGISTRY_FILE = "patients.sqlite"
+SCHEMA_VERSION = 1
+# Records written per transaction
+BATCH_SIZE = 500
+
+COLUMNS = ['source_file', 'name', 'birth_date', 'birth_year', 'gender', 'tumor_status', 'ecog',
+           'ecog_score'] + TNM_COLUMNS
+INDEXED_COLUMNS = ['T_stage', 'N_stage', 'M_stage', 'ecog_score', 'gender', 'birth_year']
+# Columns count() can group by
+GROUP_COLUMNS = ['gender', 'birth_year', 'ecog', 'ecog_score', 'tumor_status'] + TNM_COLUMNS
+STAGE_PREFIXES = ['', 'C', 'P', 'R']
+
+
+def _birth_year(birth_date):
+    match = re.search(r'(\d{4})\s*$', birth_date) if isinstance(birth_date, str) else None
+    return int(match.group(1)) if match else None
+
+
+def _ecog_score(ecog):
+    scores = re.findall(r'[0-5]', ecog) if isinstance(ecog, str) else []
+    return max(map(int, scores)) if scores else None
+
+
+def _gender(gender):
+    return gender.lower() if isinstance(gender, str) and gender else None
+
+
+def _stage_values(component, stage):
+    """The stored stages a filter value matches: one with a prefix, all four without."""
+    stage = str(stage).strip().upper()
+    if not stage.startswith(component):
+        if stage[:1] in 'CPR' and stage[1:2] == component:
+            return [stage]
+        stage = component + stage
+    return [prefix + stage for prefix in STAGE_PREFIXES]
+
+
+class PatientRegistry:
+    def __init__(self, path=REGISTRY_FILE):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Written from the pipeline's extraction thread, read by the analysis scripts
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # "value REGEXP pattern" in queries, anchored at the start like re.match
+        self._db.create_function("regexp", 2, lambda pattern, value: value is not None
+                                 and re.match(pattern, str(value)) is not None, deterministic=True)
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Older layout: rebuilt by the next extraction run
+            self._db.execute("DROP TABLE IF EXISTS patients")
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS patients (
+                                source_file TEXT PRIMARY KEY,
+                                name TEXT, birth_date TEXT, birth_year INTEGER, gender TEXT,
+                                tumor_status TEXT, ecog TEXT, ecog_score INTEGER,
+                                T_stage TEXT, N_stage TEXT, M_stage TEXT,
+                                T_prefix TEXT, N_prefix TEXT, M_prefix TEXT, residual TEXT,
+                                record TEXT NOT NULL)""")
+        for column in INDEXED_COLUMNS:
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS patients_{column} ON patients ({column})")
+        self._db.commit()
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+
+    def __contains__(self, source_file):
+        return self._db.execute("SELECT 1 FROM patients WHERE source_file = ?",
+                                (source_file,)).fetchone() is not None
+
+    # --- Writing ---
+
+    def add(self, record):
+        """Queue one record (with ``source_file``); written in batches of BATCH_SIZE."""
+        self._pending.append(record)
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def upsert(self, records):
+        """Insert or replace the given records right away."""
+        self._pending.extend(records)
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        # The TNM pattern runs once per distinct status string of the batch
+        tnm = parse_tnm(pd.Series([record.get('tumor_status') for record in records], dtype=object))
+        tnm = tnm.astype(object).where(tnm.notna(), None)
+        rows = []
+        for record, stages in zip(records, tnm.itertuples(index=False)):
+            rows.append((record['source_file'], record.get('name'), record.get('birth_date'),
+                         _birth_year(record.get('birth_date')), _gender(record.get('gender')),
+                         record.get('tumor_status'), record.get('ecog'), _ecog_score(record.get('ecog')),
+                         *stages, json.dumps(record, ensure_ascii=False)))
+        placeholders = ", ".join("?" * (len(COLUMNS) + 1))
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:] + ['record'])
+        self._db.executemany(f"INSERT INTO patients ({', '.join(COLUMNS)}, record) VALUES ({placeholders}) "
+                             f"ON CONFLICT(source_file) DO UPDATE SET {updates}", rows)
+        self._db.commit()
+
+    def remove(self, source_files):
+        """Delete the records of these letters; returns how many existed."""
+        self.flush()
+        cursor = self._db.executemany("DELETE FROM patients WHERE source_file = ?",
+                                      [(source_file,) for source_file in source_files])
+        self._db.commit()
+        return cursor.rowcount
+
+    def retain(self, source_files):
+        """Delete the records of all letters not in ``source_files``; returns how many."""
+        self.flush()
+        keep = set(source_files)
+        stale = [source_file for (source_file,) in self._db.execute("SELECT source_file FROM patients")
+                 if source_file not in keep]
+        return self.remove(stale) if stale else 0
+
+    def close(self):
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
+
+    # --- Reading ---
+
+    def _where(self, T=None, N=None, M=None, min_ecog=None, max_ecog=None, gender=None,
+               born_from=None, born_to=None):
+        conditions, params = [], []
+        for component, stage in (('T', T), ('N', N), ('M', M)):
+            if stage is not None:
+                values = _stage_values(component, stage)
+                conditions.append(f"{component}_stage IN ({', '.join('?' * len(values))})")
+                params += values
+        for condition, value in (("ecog_score >= ?", min_ecog), ("ecog_score <= ?", max_ecog),
+                                 ("gender = ?", _gender(gender)),
+                                 ("birth_year >= ?", born_from), ("birth_year <= ?", born_to)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def query(self, limit=None, **filters):
+        """Yield the matching records (as extracted), ordered by source file."""
+        where, params = self._where(**filters)
+        sql = f"SELECT record FROM patients{where} ORDER BY source_file"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for (record,) in self._db.execute(sql, params):
+            yield json.loads(record)
+
+    def count(self, *group_by, **filters):
+        """Number of matching records, or ``{values: count}`` grouped by the given columns."""
+        where, params = self._where(**filters)
+        if not group_by:
+            return self._db.execute(f"SELECT COUNT(*) FROM patients{where}", params).fetchone()[0]
+        for column in group_by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError(f"Cannot group by {column!r}; choose from {', '.join(GROUP_COLUMNS)}")
+        columns = ", ".join(group_by)
+        rows = self._db.execute(f"SELECT {columns}, COUNT(*) FROM patients{where} "
+                                f"GROUP BY {columns} ORDER BY COUNT(*) DESC, {columns}", params)
+        return {row[:-1] if len(group_by) > 1 else row[0]: row[-1] for row in rows}
+
+    def execute(self, sql, params=()):
+        """Run a read query against the ``patients`` table; returns the cursor."""
+        return self._db.execute(sql, params)
+
+    def read_frame(self, sql, params=()):
+        """The result of a read query as a DataFrame."""
+        return pd.read_sql_query(sql, self._db, params=params)
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--T", help="T stage, e.g. T2 (any prefix) or pT2a")
+    parser.add_argument("--N", help="N stage, e.g. N0 or cN1")
+    parser.add_argument("--M", help="M stage, e.g. M1 or cM1")
+    parser.add_argument("--min-ecog", type=int, help="Lowest ECOG (of a range, the higher value counts)")
+    parser.add_argument("--max-ecog", type=int, help="Highest ECOG")
+    parser.add_argument("--gender", choices=["male", "female"])
+    parser.add_argument("--born-from", type=int, metavar="YEAR", help="Born in or after YEAR")
+    parser.add_argument("--born-to", type=int, metavar="YEAR", help="Born in or before YEAR")
+
+
+def filters_from_args(args):
+    return {"T": args.T, "N": args.N, "M": args.M, "min_ecog": args.min_ecog, "max_ecog": args.max_ecog,
+            "gender": args.gender, "born_from": args.born_from, "born_to": args.born_to}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the patient registry written by the extraction")
+    parser.add_argument("--registry", default=REGISTRY_FILE, help="Registry file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query_parser = commands.add_parser("query", help="Print the matching records as JSON Lines")
+    add_filter_arguments(query_parser)
+    query_parser.add_argument("--limit", type=int, help="Print at most this many records")
+    count_parser = commands.add_parser("count", help="Count the matching records, optionally grouped")
+    count_parser.add_argument("group_by", nargs="*", metavar="COLUMN",
+                              help=f"Columns to group by: {', '.join(GROUP_COLUMNS)}")
+    add_filter_arguments(count_parser)
+    args = parser.parse_args()
+    if args.command == "count" and set(args.group_by) - set(GROUP_COLUMNS):
+        parser.error(f"cannot group by {', '.join(sorted(set(args.group_by) - set(GROUP_COLUMNS)))}")
+
+    if not os.path.exists(args.registry):
+        print(f"Error: {args.registry} not found. Run extract_patient_data.py first.")
+        raise SystemExit(1)
+    with PatientRegistry(args.registry) as registry:
+        if args.command == "query":
+            for record in registry.query(limit=args.limit, **filters_from_args(args)):
+                print(json.dumps(record, ensure_ascii=False))
+        elif args.group_by:
+            for values, count in registry.count(*args.group_by, **filters_from_args(args)).items():
+                values = values if isinstance(values, tuple) else (values,)
+                print(f"{count:8d}  " + "  ".join("-" if value is None else str(value) for value in values))
+        else:
+            print(registry.count(**filters_from_args(args)))
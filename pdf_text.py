@@ -0,0 +1,212 @@
+"""Text extraction from the PDFs produced by the LibreOffice route.
+
+Several engines can read the page texts; all of them feed the same page
+layout, so the output format does not depend on the engine:
+
+    === Page i ===
+    --- Header ---   (first three lines)
+    --- Content ---
+    --- Footer ---   (last three lines)
+
+Pages with six lines or fewer are written as they are.
+
+- ``pdfplumber`` (default): pdfplumber's ``page.extract_text()``.
+- ``pdfminer``: pdfminer.six directly, with LAParams tuned for single-column
+  letters (no advanced box ordering, no vertical text detection).
+- ``pypdfium2``: PDFium's text layer, much faster. It is installed with
+  pdfplumber, which uses it for rendering.
+- ``pymupdf``: MuPDF, if the optional ``pymupdf`` package is installed.
+
+Sources may be a path or a binary file object (e.g. ``io.BytesIO``).
+
+Pages are extracted and formatted one at a time, and pdfplumber's parsed
+layout objects are released after each page. Memory use therefore doesn't
+grow with the length of the document, as long as the text is written out page
+by page (``out``) instead of being returned. With ``workers`` > 1, a long PDF
+is split into chunks of pages that are extracted in parallel processes, with
+a bounded number of chunks in flight.
+"""
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_BACKEND = "pdfplumber"
+# Pages per chunk with workers > 1; shorter documents are read in one process
+CHUNK_PAGES = 16
+
+# Every backend takes the source and optionally the 0-based page numbers to
+# read (ascending), and yields one text per page.
+
+
+def _pdfplumber_pages(source, pages=None):
+    import pdfplumber
+    with pdfplumber.open(source, pages=pages and [page + 1 for page in pages]) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text()
+            # Drop the page's parsed layout objects before the next page
+            page.close()
+            yield text
+
+
+# Single-column letters: plain top-to-bottom reading order is enough
+PDFMINER_LAPARAMS = dict(line_margin=0.5, char_margin=2.0, word_margin=0.1,
+                         boxes_flow=None, detect_vertical=False, all_texts=False)
+
+
+def _pdfminer_pages(source, pages=None):
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LAParams, LTTextContainer
+    laparams = LAParams(**PDFMINER_LAPARAMS)
+    for page_layout in extract_pages(source, page_numbers=pages, laparams=laparams):
+        boxes = [element.get_text() for element in page_layout if isinstance(element, LTTextContainer)]
+        yield ''.join(boxes).strip('\n')
+
+
+def _pypdfium2_pages(source, pages=None):
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(source)
+    try:
+        for index in (range(len(pdf)) if pages is None else pages):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+            yield text.replace('\r\n', '\n').replace('\r', '\n').strip('\n')
+    finally:
+        pdf.close()
+
+
+def _pymupdf_pages(source, pages=None):
+    import pymupdf
+    if isinstance(source, io.IOBase):
+        pdf = pymupdf.open(stream=source.read(), filetype="pdf")
+    else:
+        pdf = pymupdf.open(source)
+    with pdf:
+        for index in (range(len(pdf)) if pages is None else pages):
+            yield pdf[index].get_text().strip('\n')
+
+
+# name -> generator of page texts (one per page, None or "" for empty pages)
+PDF_BACKENDS = {
+    "pdfplumber": _pdfplumber_pages,
+    "pdfminer": _pdfminer_pages,
+    "pypdfium2": _pypdfium2_pages,
+    "pymupdf": _pymupdf_pages,
+}
+
+# Module each backend needs, for available_backends()
+_BACKEND_MODULES = {
+    "pdfplumber": "pdfplumber",
+    "pdfminer": "pdfminer.high_level",
+    "pypdfium2": "pypdfium2",
+    "pymupdf": "pymupdf",
+}
+
+
+def available_backends():
+    """Names of the backends whose engine is installed."""
+    import importlib
+    names = []
+    for name in PDF_BACKENDS:
+        try:
+            importlib.import_module(_BACKEND_MODULES[name])
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def format_page(i, page_text):
+    """The output lines of page ``i`` (1-based); empty pages give none."""
+    if not page_text:
+        return []
+    lines = page_text.split('\n')
+    if len(lines) > 6:
+        header = '\n'.join(lines[:3])
+        main_content = '\n'.join(lines[3:-3])
+        footer = '\n'.join(lines[-3:])
+        return [f"\n=== Page {i} ===",
+                f"--- Header ---\n{header}",
+                f"--- Content ---\n{main_content}",
+                f"--- Footer ---\n{footer}"]
+    return [f"\n=== Page {i} ===", page_text]
+
+
+def page_count(source):
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(source)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _extract_chunk(source, backend, pages):
+    # Runs in a worker process; bytes stand in for an in-memory source
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return list(PDF_BACKENDS[backend](source, pages))
+
+
+def iter_page_texts(source, backend=DEFAULT_BACKEND, workers=1, chunk_pages=CHUNK_PAGES):
+    """Yield ``(page number, text)`` for every page, in order."""
+    if workers > 1:
+        if isinstance(source, io.IOBase):
+            source = source.read()
+        count = page_count(io.BytesIO(source) if isinstance(source, bytes) else source)
+        if count > chunk_pages:
+            yield from _iter_page_texts_parallel(source, backend, count, workers, chunk_pages)
+            return
+        if isinstance(source, bytes):
+            source = io.BytesIO(source)
+    yield from enumerate(PDF_BACKENDS[backend](source), start=1)
+
+
+def _iter_page_texts_parallel(source, backend, count, workers, chunk_pages):
+    chunks = [list(range(start, min(start + chunk_pages, count))) for start in range(0, count, chunk_pages)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # At most two chunks per worker are extracted but not yet consumed
+        futures = deque()
+        for chunk in chunks:
+            futures.append((chunk, pool.submit(_extract_chunk, source, backend, chunk)))
+            if len(futures) >= 2 * workers:
+                done_chunk, future = futures.popleft()
+                yield from zip((page + 1 for page in done_chunk), future.result())
+        while futures:
+            done_chunk, future = futures.popleft()
+            yield from zip((page + 1 for page in done_chunk), future.result())
+
+
+def extract_text_from_pdf(source, backend=DEFAULT_BACKEND, out=None, workers=1, stats=None):
+    """The formatted text of a PDF.
+
+    With ``out`` (a text file object), every page is written as soon as it is
+    extracted and nothing is returned. A ``stats`` dict gets the number of
+    ``pages`` and the ``text_length`` in characters.
+    """
+    pages = 0
+
+    def parts():
+        nonlocal pages
+        for i, page_text in iter_page_texts(source, backend, workers):
+            pages = i
+            yield from format_page(i, page_text)
+
+    if out is None:
+        text = '\n'.join(parts())
+        length = len(text)
+    else:
+        text = None
+        length = 0
+        for n, part in enumerate(parts()):
+            if n:
+                out.write('\n')
+            out.write(part)
+            length += len(part) + bool(n)
+    if stats is not None:
+        stats.update(pages=pages, text_length=length)
+    return text
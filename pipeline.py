@@ -0,0 +1,375 @@
+"""End-to-end pipeline: patient letters (.docx) in, patient records out.
+
+Conversion, field extraction and aggregation run as generator stages. Each
+stage runs in its own thread and hands its items to the next one through a
+bounded queue, so the stages overlap: while one letter's fields are being
+extracted, the next letters are already being converted. Each record is
+written (and optionally printed) as soon as its letter has passed all stages,
+instead of after the whole batch.
+
+Nothing has to be written to disk in between. ``--save-text`` keeps the letter
+texts as ``processed_output/*.txt`` would, and the records are appended to
+``processed_patients.jsonl`` unless ``--no-output`` is given. Each record is
+also upserted into the patient registry (patient_registry.py) right away, so
+it can be queried while the run goes on.
+
+    python pipeline.py --input-dir patient_data --workers 2
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from functools import partial
+
+import pandas as pd
+import instrumentation
+from batch_conversion import iter_convert
+from extract_patient_data import PatientExtractor
+from extraction_cache import CACHE_FILE, ExtractionCache
+from pdf_text import DEFAULT_BACKEND, PDF_BACKENDS
+from scratch import SCRATCH_ENV
+from patient_records import JSONL_FILE, PARQUET_FILE, JsonlWriter, export_parquet
+from patient_registry import REGISTRY_FILE, PatientRegistry
+from tnm import parse_tnm
+
+if sys.platform == "win32":
+    import convert_patient_data_to_txt_windows as converter
+else:
+    import convert_patient_data_to_txt_mac as converter
+
+RECORD_FIELDS = ['name', 'birth_date', 'gender', 'tumor_status', 'ecog']
+
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+class Stage:
+    """Runs the generator ``items`` in a thread, buffering at most ``maxsize`` items.
+
+    Iterate over the stage to get the items one by one, or use ``batches`` to
+    get whatever is already waiting as one list.
+    """
+
+    def __init__(self, items, maxsize=8, name=None):
+        self._queue = queue.Queue(maxsize)
+        self._finished = False
+        self._thread = threading.Thread(target=self._run, args=(items,), name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self, items):
+        try:
+            for item in items:
+                self._queue.put(item)
+        except BaseException as e:
+            self._queue.put(_StageError(e))
+        else:
+            self._queue.put(_END)
+
+    def _get(self, block=True):
+        item = self._queue.get(block)
+        if item is _END:
+            self._finished = True
+        elif isinstance(item, _StageError):
+            self._finished = True
+            raise item.error
+        return item
+
+    def __iter__(self):
+        while not self._finished:
+            item = self._get()
+            if item is not _END:
+                yield item
+
+    def batches(self, max_size):
+        """Yield lists of up to ``max_size`` items.
+
+        Waits only for the first item of each list; the rest is whatever the
+        previous stage has already queued. A slow stream gives one-item lists
+        (lowest latency), a backlog gives full ones (best throughput).
+        """
+        while not self._finished:
+            item = self._get()
+            if item is _END:
+                return
+            batch = [item]
+            while len(batch) < max_size:
+                try:
+                    item = self._get(block=False)
+                except queue.Empty:
+                    break
+                if item is _END:
+                    break
+                batch.append(item)
+            yield batch
+
+
+def _convert_job(input_path, output_path, server, backend="auto", pdf_backend=DEFAULT_BACKEND, page_workers=1):
+    # Runs in the conversion worker; errors are passed on, not raised
+    try:
+        # Intermediate PDFs stay in the worker's scratch directory
+        text = converter.docx_to_text(input_path, server, backend, pdf_backend=pdf_backend,
+                                      page_workers=page_workers)
+        if output_path:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return input_path, text, None
+    except Exception as e:
+        return input_path, None, str(e)
+
+
+def find_letters(input_dir, done=()):
+    """Stage 1: the letters to process, in file-name order."""
+    # Exclude temporary files starting with ~$
+    for docx_file in sorted(os.listdir(input_dir)):
+        if not docx_file.endswith('.docx') or docx_file.startswith('~$'):
+            continue
+        if record_name(docx_file) in done:
+            continue
+        yield os.path.join(input_dir, docx_file)
+
+
+def record_name(docx_file):
+    # Same source_file as extract_patient_data.py gives the converted text
+    return f"{os.path.splitext(os.path.basename(docx_file))[0]}.txt"
+
+
+def convert_letters(letters, started, text_dir=None, backend="auto", soffice_path=None, workers=1,
+                    pdf_backend=DEFAULT_BACKEND, page_workers=1):
+    """Stage 2: ``(source_file, text, error)`` per letter."""
+    def jobs():
+        for input_path in letters:
+            started[record_name(input_path)] = time.perf_counter()
+            output_path = os.path.join(text_dir, record_name(input_path)) if text_dir else None
+            yield input_path, output_path
+
+    for input_path, text, error in iter_convert(jobs(), partial(_convert_job, backend=backend, pdf_backend=pdf_backend,
+                                                        page_workers=page_workers),
+                                                soffice_path, workers):
+        yield record_name(input_path), text, error
+
+
+def extract_records(converted, extractor, batch_size=32):
+    """Stage 3: ``(source_file, patient info, error)`` per letter."""
+    for batch in converted.batches(batch_size):
+        for source_file, _, error in batch:
+            if error is not None:
+                yield source_file, None, error
+        ready = [(source_file, text) for source_file, text, error in batch if error is None]
+        if not ready:
+            continue
+        try:
+            infos = list(extractor.extract_many((text for _, text in ready),
+                                                names=[source_file for source_file, _ in ready]))
+        except Exception:
+            # Redo this batch one letter at a time to isolate the failing letter(s)
+            infos = None
+        for i, (source_file, text) in enumerate(ready):
+            if infos is not None:
+                yield source_file, infos[i], None
+                continue
+            try:
+                yield source_file, extractor.extract(text, source_file), None
+            except Exception as e:
+                yield source_file, None, str(e)
+
+
+class RunningSummary:
+    """Stage 4: aggregates kept up to date record by record."""
+
+    def __init__(self):
+        self.records = 0
+        self.failed = 0
+        self.missing = Counter()
+        self.genders = Counter()
+        self.stages = {component: Counter() for component in 'TNM'}
+        self.latencies = []
+
+    def add(self, record, latency):
+        self.records += 1
+        self.latencies.append(latency)
+        for field in RECORD_FIELDS:
+            if record.get(field) in (None, ""):
+                self.missing[field] += 1
+        self.genders[record.get("gender") or "unknown"] += 1
+        if record.get("tumor_status"):
+            tnm = parse_tnm(pd.Series([record["tumor_status"]])).iloc[0]
+            for component in 'TNM':
+                stage = tnm[f'{component}_stage']
+                if isinstance(stage, str):
+                    self.stages[component][stage] += 1
+
+    def print(self):
+        print("\nSummary Statistics:")
+        print(f"\nTotal number of patients: {self.records} ({self.failed} letters failed)")
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            print(f"Letter to record: median {latencies[len(latencies) // 2]:.2f}s, "
+                  f"max {latencies[-1]:.2f}s")
+        if self.missing:
+            print("\nMissing fields:")
+            for field in RECORD_FIELDS:
+                if self.missing[field]:
+                    print(f"  {field}: {self.missing[field]}")
+        print("\nGender:", dict(self.genders.most_common()))
+        for component in 'TNM':
+            print(f"\nDistribution of {component} stages:")
+            for stage, count in self.stages[component].most_common():
+                print(f"  {stage}: {count}")
+
+
+def run_pipeline(input_dir="patient_data", output_file=JSONL_FILE, text_dir=None, backend="auto",
+                 workers=1, batch_size=32, windowed=False, queue_size=8, resume=True,
+                 print_records=False, parquet=True, pdf_backend=DEFAULT_BACKEND,
+                 page_workers=1, keep_repeated_blocks=False, cache_file=CACHE_FILE, clear_cache=False,
+                 registry_file=REGISTRY_FILE):
+    writer = JsonlWriter(output_file, resume=resume) if output_file else None
+    done = writer.done if writer is not None else set()
+    if done:
+        print(f"Resuming: {len(done)} letters already in {output_file}")
+    if text_dir:
+        os.makedirs(text_dir, exist_ok=True)
+
+    # LibreOffice is only located when the chosen backend may need it
+    soffice_path = None
+    if backend != "docx":
+        try:
+            soffice_path = converter.find_soffice()
+        except FileNotFoundError as e:
+            if backend == "libreoffice":
+                raise
+            print(f"Warning: {str(e)} Using native DOCX extraction only.")
+
+    started = {}
+    # Letters whose records were produced by this run
+    produced = set()
+    summary = RunningSummary()
+    # Letters extracted before (by this or extract_patient_data.py) come from the cache
+    cache = ExtractionCache(cache_file) if cache_file else None
+    if cache is not None and clear_cache:
+        cache.clear()
+    registry = PatientRegistry(registry_file) if registry_file else None
+    extractor = PatientExtractor(batch_size=batch_size, windowed=windowed,
+                                 keep_repeated_blocks=keep_repeated_blocks, cache=cache)
+    letters = Stage(find_letters(input_dir, done), queue_size, name="letters")
+    converted = Stage(convert_letters(letters, started, text_dir, backend, soffice_path, workers, pdf_backend,
+                                      page_workers),
+                      queue_size, name="conversion")
+    extracted = Stage(extract_records(converted, extractor, batch_size), queue_size, name="extraction")
+
+    try:
+        for source_file, patient_info, error in extracted:
+            if error is not None:
+                print(f"Error processing {source_file}: {error}")
+                summary.failed += 1
+                continue
+            if not patient_info:
+                continue
+            patient_info["source_file"] = source_file
+            if writer is not None:
+                writer.write(patient_info)
+            if registry is not None:
+                registry.upsert([patient_info])
+            if print_records:
+                print(json.dumps(patient_info, ensure_ascii=False), flush=True)
+            produced.add(source_file)
+            latency = time.perf_counter() - started[source_file]
+            summary.add(patient_info, latency)
+            # Letter to record, including the time spent queued between stages
+            instrumentation.record("pipeline_latency", source_file, latency)
+        if registry is not None:
+            # Drop letters that were removed or now fail; letters skipped as done keep their records
+            present = {record_name(path) for path in find_letters(input_dir)}
+            removed = registry.retain(produced | (done & present))
+            if removed:
+                print(f"Removed {removed} records from {registry_file} that are no longer in the input")
+    finally:
+        if writer is not None:
+            writer.close()
+        if cache is not None:
+            cache.close()
+        if registry is not None:
+            registry.close()
+
+    summary.print()
+    if cache is not None:
+        print(f"\nExtraction cache: {extractor.cache_hits} letters reused, "
+              f"{extractor.cache_updates} with regex fields redone")
+    if extractor.chars_in and not keep_repeated_blocks:
+        removed = extractor.chars_in - extractor.chars_out
+        print(f"\nRepeated headers/footers removed: {removed} of {extractor.chars_in} characters "
+              f"({removed / extractor.chars_in:.1%})")
+    if output_file and parquet:
+        exported = export_parquet(output_file, PARQUET_FILE)
+        if exported is not None:
+            print(f"Wrote {exported} records to {PARQUET_FILE}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert letters and extract patient data in one streaming run")
+    parser.add_argument("--input-dir", default="patient_data", help="Directory with the .docx letters")
+    parser.add_argument("--output", default=JSONL_FILE, help="JSON Lines file the records are appended to")
+    parser.add_argument("--no-output", action="store_true", help="Don't write the records to disk")
+    parser.add_argument("--save-text", metavar="DIR", nargs="?", const="processed_output",
+                        help="Also keep the letter texts in DIR (default: processed_output)")
+    parser.add_argument("--backend", choices=["auto", "docx", "libreoffice"], default="auto",
+                        help="docx: read the DOCX directly; libreoffice: convert via PDF; "
+                             "auto: read directly and only fall back to LibreOffice on failure")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of parallel conversion processes, each with its own LibreOffice")
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="Most letters passed to spaCy at once when letters queue up")
+    parser.add_argument("--windowed", action="store_true",
+                        help="Only run spaCy on the region around \"wir berichten über\"")
+    parser.add_argument("--keep-repeated-blocks", action="store_true",
+                        help="Pass headers/footers repeated on every page to spaCy each time "
+                             "instead of only once per letter")
+    parser.add_argument("--pdf-backend", choices=list(PDF_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Engine that reads the text of the LibreOffice PDFs (see pdf_text.py)")
+    parser.add_argument("--page-workers", type=int, default=1,
+                        help="Processes extracting the pages of one long PDF in parallel chunks")
+    parser.add_argument("--scratch-dir",
+                        help="Where intermediate PDFs are kept while they are read "
+                             "(default: a RAM-backed directory if available, else the system temp directory)")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Items buffered between two stages")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Start the output from scratch instead of skipping letters already in it")
+    parser.add_argument("--print-records", action="store_true",
+                        help="Print every record as a JSON line as soon as it is extracted")
+    parser.add_argument("--no-parquet", action="store_true",
+                        help=f"Don't write the typed columnar copy {PARQUET_FILE} at the end")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Extract every letter again instead of reusing the records cached in {CACHE_FILE}")
+    parser.add_argument("--clear-cache", action="store_true", help="Empty the extraction cache first")
+    parser.add_argument("--no-registry", action="store_true",
+                        help=f"Don't upsert the records into the patient registry {REGISTRY_FILE}")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    if args.scratch_dir:
+        # Set before the conversion pool starts, so the workers inherit it
+        os.environ[SCRATCH_ENV] = os.path.abspath(args.scratch_dir)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: Input directory '{args.input_dir}' does not exist!")
+        sys.exit(1)
+    with instrumentation.instrumented(args):
+        try:
+            run_pipeline(input_dir=args.input_dir, output_file=None if args.no_output else args.output,
+                         text_dir=args.save_text, backend=args.backend, workers=args.workers,
+                         batch_size=args.batch_size, windowed=args.windowed, queue_size=args.queue_size,
+                         resume=not args.no_resume, print_records=args.print_records,
+                         parquet=not args.no_parquet, pdf_backend=args.pdf_backend,
+                         page_workers=args.page_workers, keep_repeated_blocks=args.keep_repeated_blocks,
+                         cache_file=None if args.no_cache else CACHE_FILE, clear_cache=args.clear_cache,
+                         registry_file=None if args.no_registry else REGISTRY_FILE)
+        except KeyboardInterrupt:
+            print("\nProcessing interrupted by user")
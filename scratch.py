@@ -0,0 +1,45 @@
+"""Private scratch directory for short-lived intermediate files.
+
+The LibreOffice route writes each letter as a PDF before its text can be read.
+Those PDFs don't belong next to the output (often a network share), so every
+process gets its own scratch directory instead. It is RAM-backed where possible
+(``/dev/shm`` on Linux) and removed when the process exits.
+
+Set ``MEDPARSE_SCRATCH_DIR`` to put the scratch directories somewhere else;
+pool workers inherit it from the parent process.
+"""
+import os
+import shutil
+import tempfile
+from multiprocessing.util import Finalize
+
+SCRATCH_ENV = "MEDPARSE_SCRATCH_DIR"
+# RAM-backed locations, tried in order before the system temp directory
+RAM_DIRS = ("/dev/shm",)
+
+# (pid, path) of this process's scratch directory
+_scratch = None
+
+
+def scratch_root():
+    """Where scratch directories are created."""
+    configured = os.environ.get(SCRATCH_ENV)
+    if configured:
+        os.makedirs(configured, exist_ok=True)
+        return configured
+    for path in RAM_DIRS:
+        if os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK):
+            return path
+    return tempfile.gettempdir()
+
+
+def process_scratch_dir():
+    """This process's scratch directory, created on first use."""
+    global _scratch
+    # A forked worker inherits the parent's value but needs its own directory
+    if _scratch is None or _scratch[0] != os.getpid() or not os.path.isdir(_scratch[1]):
+        path = tempfile.mkdtemp(prefix="medparse_scratch_", dir=scratch_root())
+        _scratch = (os.getpid(), path)
+        # atexit does not run in pool workers; Finalize does
+        Finalize(None, shutil.rmtree, args=(path,), kwargs={"ignore_errors": True}, exitpriority=5)
+    return _scratch[1]
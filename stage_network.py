@@ -0,0 +1,125 @@
+"""Co-occurrence graph of the T, N and M stages.
+
+Nodes are stages (e.g. "PT2", "CN1", "CM0") and an edge joins two stages that
+appear in the same tumor status. Edge weights count the patients, nodes carry
+the number of patients with that stage. The graph is built from grouped pair
+counts, so its size depends on the number of distinct stages, not on the
+number of patients.
+
+The spring layout is seeded, so the same graph is always drawn the same way.
+It is cached on disk under a hash of the graph. ``export_stage_graph`` writes
+the graph, including its layout, as GraphML or JSON for use elsewhere.
+"""
+import hashlib
+import json
+import os
+
+import networkx as nx
+import pandas as pd
+
+STAGE_COLUMNS = ['T_stage', 'N_stage', 'M_stage']
+LAYOUT_SEED = 42
+LAYOUT_CACHE = '.network_layout.json'
+
+
+def stage_cooccurrence(df):
+    """Edge list with one row per stage pair: ``source``, ``target``, ``weight``."""
+    pairs = []
+    for i, first in enumerate(STAGE_COLUMNS):
+        for second in STAGE_COLUMNS[i + 1:]:
+            # groupby drops rows where either stage is missing
+            counts = df.groupby([first, second], observed=True).size()
+            pairs.append(pd.DataFrame({
+                'source': counts.index.get_level_values(0).astype(object),
+                'target': counts.index.get_level_values(1).astype(object),
+                'weight': counts.to_numpy(),
+            }))
+    edges = pd.concat(pairs, ignore_index=True)
+    edges = edges.groupby(['source', 'target'], as_index=False)['weight'].sum()
+    return edges.sort_values(['source', 'target'], ignore_index=True)
+
+
+def build_stage_graph(df):
+    """Weighted stage graph of a frame with T/N/M stage columns."""
+    G = nx.Graph()
+    for column in STAGE_COLUMNS:
+        counts = df[column].value_counts()
+        for stage, count in sorted(counts.items()):
+            G.add_node(stage, component=column[0], count=int(count))
+    edges = stage_cooccurrence(df)
+    G.add_weighted_edges_from((source, target, int(weight))
+                              for source, target, weight in edges.itertuples(index=False, name=None))
+    return G
+
+
+def graph_hash(G):
+    """Hash of the nodes, edges and weights, independent of insertion order."""
+    digest = hashlib.sha256(f"seed={LAYOUT_SEED}\n".encode('utf-8'))
+    for node in sorted(G.nodes):
+        digest.update(f"n\t{node}\n".encode('utf-8'))
+    for source, target, weight in sorted((min(u, v), max(u, v), w) for u, v, w in G.edges(data='weight')):
+        digest.update(f"e\t{source}\t{target}\t{weight}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stage_layout(G, cache_dir=None):
+    """Seeded spring layout ``{stage: (x, y)}``, read from the cache if possible."""
+    key = graph_hash(G)
+    cache_path = os.path.join(cache_dir, LAYOUT_CACHE) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('hash') == key:
+                return {node: tuple(position) for node, position in cached['positions'].items()}
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable layout cache {cache_path}: {str(e)}")
+
+    positions = nx.spring_layout(G, weight='weight', seed=LAYOUT_SEED)
+    positions = {node: (float(x), float(y)) for node, (x, y) in positions.items()}
+    if cache_path:
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'hash': key, 'positions': positions}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cache_path)
+    return positions
+
+
+def export_stage_graph(G, path, positions=None):
+    """Write the graph as GraphML (``.graphml``) or JSON (anything else).
+
+    With ``positions``, every node also gets its ``x`` and ``y`` coordinates.
+    """
+    if str(path).endswith('.graphml'):
+        H = G.copy()
+        for node, (x, y) in (positions or {}).items():
+            H.nodes[node]['x'], H.nodes[node]['y'] = x, y
+        nx.write_graphml(H, path)
+        return
+    nodes = []
+    for node, attributes in sorted(G.nodes(data=True)):
+        entry = {'id': node, **attributes}
+        if positions and node in positions:
+            entry['x'], entry['y'] = positions[node]
+        nodes.append(entry)
+    edges = sorted((min(u, v), max(u, v), weight) for u, v, weight in G.edges(data='weight'))
+    data = {
+        'nodes': nodes,
+        'edges': [{'source': source, 'target': target, 'weight': weight} for source, target, weight in edges],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_stage_graph(path):
+    """Read a graph written by ``export_stage_graph``."""
+    if str(path).endswith('.graphml'):
+        return nx.read_graphml(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    G = nx.Graph()
+    for node in data['nodes']:
+        attributes = dict(node)
+        G.add_node(attributes.pop('id'), **attributes)
+    G.add_weighted_edges_from((edge['source'], edge['target'], edge['weight']) for edge in data['edges'])
+    return G
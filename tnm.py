@@ -0,0 +1,87 @@
+"""TNM decomposition of the extracted ``tumor_status`` strings.
+
+``parse_tnm`` reads each status string once with a single ``str.extract``
+pattern. Each component has its own lookahead from the start of the string, so
+T, N and M are found in any order. Each is the first occurrence in the string,
+as with ``re.search``.
+
+Registries repeat the same few status strings over and over, so each distinct
+string is parsed only once and the result is broadcast back to all rows.
+"""
+import pandas as pd
+
+# One lookahead per component. T/N/M are case-insensitive with an optional
+# c/p/r prefix; the residual marker is case-sensitive ("R0", "R1", ...).
+TNM_PATTERN = (
+    r"(?s)^"
+    r"(?=(?:.*?(?i:(?P<T>(?P<T_prefix>[cpr])?T\d+[a-z]?)))?)"
+    r"(?=(?:.*?(?i:(?P<N>(?P<N_prefix>[cpr])?N(?:\d+|x))))?)"
+    r"(?=(?:.*?(?i:(?P<M>(?P<M_prefix>[cpr])?M(?:\d+[a-z]?|x))))?)"
+    r"(?=(?:.*?(?P<residual>R\d+))?)"
+)
+
+TNM_COLUMNS = ['T_stage', 'N_stage', 'M_stage', 'T_prefix', 'N_prefix', 'M_prefix', 'residual']
+
+
+def _strings(status):
+    if isinstance(status.dtype, pd.StringDtype):
+        return status.astype(object)
+    return status.where(status.map(lambda x: isinstance(x, str))).astype(object)
+
+
+def _per_unique(status, func):
+    """Apply the vectorized ``func`` to the distinct strings of ``status`` only."""
+    codes, uniques = pd.factorize(status)
+    result = func(pd.Series(uniques, dtype=object)).reindex(codes)
+    result.index = status.index
+    return result
+
+
+def parse_tnm(status):
+    """Split a Series of tumor status strings into TNM columns.
+
+    Returns a DataFrame with the same index and the columns ``T_stage``,
+    ``N_stage``, ``M_stage`` (upper case, e.g. "PT2A"), ``T_prefix``,
+    ``N_prefix``, ``M_prefix`` (lower case "c", "p" or "r") and ``residual``
+    (e.g. "R0"). Anything that isn't found, or isn't a string, is NaN.
+    """
+    return _per_unique(_strings(status), _parse_unique)
+
+
+def _parse_unique(status):
+    parts = status.str.extract(TNM_PATTERN)
+    tnm = pd.DataFrame(index=status.index)
+    for component in 'TNM':
+        tnm[f'{component}_stage'] = parts[component].str.upper()
+    for component in 'TNM':
+        tnm[f'{component}_prefix'] = parts[f'{component}_prefix'].str.lower()
+    tnm['residual'] = parts['residual']
+    return tnm
+
+
+def _clean_unique(status):
+    cleaned = status.str.replace(r'R\d+', '', regex=True)
+    return cleaned.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def clean_tumor_status(status):
+    """Remove residual markers ("R0", ...) and collapse whitespace."""
+    return _per_unique(_strings(status), _clean_unique)
+
+
+def add_tnm_columns(df):
+    """Add tumor_status_clean and the ``parse_tnm`` columns to ``df`` (in place)."""
+    status = _strings(df['tumor_status'])
+    df['tumor_status_clean'] = _per_unique(status, _clean_unique)
+    tnm = _per_unique(status, _parse_unique)
+    for column in TNM_COLUMNS:
+        df[column] = tnm[column]
+    return df
+
+
+def add_prefix_columns(df):
+    """Add ``T_prefix``/``N_prefix``/``M_prefix`` from already parsed stage columns (in place)."""
+    for component in 'TNM':
+        first = df[f'{component}_stage'].astype(object).str[0]
+        df[f'{component}_prefix'] = first.where(first.isin(['C', 'P', 'R'])).str.lower()
+    return df
@@ -1,168 +1,331 @@
+import argparse
+import hashlib
 import json
-import pandas as pd
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
 import matplotlib.pyplot as plt
+import pandas as pd
 import seaborn as sns
-import re
-import os
+import instrumentation
+from patient_records import load_patients, find_patients_file
+from patient_registry import REGISTRY_FILE, PatientRegistry
+from tnm import TNM_COLUMNS, add_prefix_columns, add_tnm_columns, clean_tumor_status
+
+PLOTS_DIR = 'tumor_status_plots'
+HASHES_FILE = '.plot_hashes.json'
+# Bump when the drawing code changes, so existing PNGs are redrawn
+PLOTS_VERSION = 2
 
-# Create plots directory if it doesn't exist
-plots_dir = 'tumor_status_plots'
-if not os.path.exists(plots_dir):
-    os.makedirs(plots_dir)
-
-# Load data from the JSON file
-with open('processed_patients.json', 'r', encoding='utf-8') as f:
-    data = json.load(f)
-
-# Create a DataFrame
-df = pd.DataFrame(data)
-
-def clean_tumor_status(status):
-    # Remove 'R0' and similar residual markers
-    status = re.sub(r'R\d+', '', status)
-    # Replace multiple spaces with single space
-    return ' '.join(status.split())
-
-def extract_T(tumor_status):
-    # Handle both comma-separated and space-separated formats
-    parts = [p.strip() for p in tumor_status.replace(',', ' ').split()]
-    for part in parts:
-        match = re.search(r'(?i)(?:[cp])?T\d+[a-z]?', part)
-        if match:
-            return match.group(0).upper()
-    return None
-
-def extract_N(tumor_status):
-    parts = [p.strip() for p in tumor_status.replace(',', ' ').split()]
-    for part in parts:
-        match = re.search(r'(?i)(?:[cp])?N(?:\d+|x)', part)
-        if match:
-            return match.group(0).upper()
-    return None
-
-def extract_M(tumor_status):
-    parts = [p.strip() for p in tumor_status.replace(',', ' ').split()]
-    for part in parts:
-        match = re.search(r'(?i)(?:[cp])?M(?:\d+[a-z]?|X)', part)
-        if match:
-            return match.group(0).upper()
-    return None
-
-# Clean and extract components
-if 'tumor_status' in df.columns:
-    df['tumor_status_clean'] = df['tumor_status'].apply(lambda x: clean_tumor_status(x) if isinstance(x, str) else x)
-    df['T_stage'] = df['tumor_status'].apply(lambda x: extract_T(x) if isinstance(x, str) else None)
-    df['N_stage'] = df['tumor_status'].apply(lambda x: extract_N(x) if isinstance(x, str) else None)
-    df['M_stage'] = df['tumor_status'].apply(lambda x: extract_M(x) if isinstance(x, str) else None)
 
 # 1. Raw distribution of complete tumor status
-plt.figure(figsize=(12, 6))
-sns.countplot(y='tumor_status_clean', data=df, order=df['tumor_status_clean'].value_counts().index)
-plt.title('Complete Tumor Status Distribution')
-plt.xlabel('Count')
-plt.ylabel('Tumor Status')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '1_complete_distribution.png'))
-plt.close()
+def plot_complete_distribution(df, path):
+    plt.figure(figsize=(12, 6))
+    sns.countplot(y='tumor_status_clean', data=df, order=df['tumor_status_clean'].value_counts().index)
+    plt.title('Complete Tumor Status Distribution')
+    plt.xlabel('Count')
+    plt.ylabel('Tumor Status')
+    plt.tight_layout()
+    plt.savefig(path)
+
 
 # 2. Individual stage distributions
-fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
-sns.countplot(x='T_stage', data=df, order=df['T_stage'].value_counts().index, ax=ax1)
-ax1.set_title('T Stage Distribution')
-ax1.tick_params(axis='x', rotation=45)
+def plot_individual_distributions(df, path):
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
+    sns.countplot(x='T_stage', data=df, order=df['T_stage'].value_counts().index, ax=ax1)
+    ax1.set_title('T Stage Distribution')
+    ax1.tick_params(axis='x', rotation=45)
 
-sns.countplot(x='N_stage', data=df, order=df['N_stage'].value_counts().index, ax=ax2)
-ax2.set_title('N Stage Distribution')
-ax2.tick_params(axis='x', rotation=45)
+    sns.countplot(x='N_stage', data=df, order=df['N_stage'].value_counts().index, ax=ax2)
+    ax2.set_title('N Stage Distribution')
+    ax2.tick_params(axis='x', rotation=45)
 
-sns.countplot(x='M_stage', data=df, order=df['M_stage'].value_counts().index, ax=ax3)
-ax3.set_title('M Stage Distribution')
-ax3.tick_params(axis='x', rotation=45)
+    sns.countplot(x='M_stage', data=df, order=df['M_stage'].value_counts().index, ax=ax3)
+    ax3.set_title('M Stage Distribution')
+    ax3.tick_params(axis='x', rotation=45)
+
+    plt.tight_layout()
+    plt.savefig(path)
 
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '2_individual_distributions.png'))
-plt.close()
 
 # 3. T vs N Stage Heatmap
-plt.figure(figsize=(10, 8))
-crosstab_tn = pd.crosstab(df['T_stage'], df['N_stage'])
-sns.heatmap(crosstab_tn, annot=True, fmt='d', cmap='YlOrRd')
-plt.title('T Stage vs N Stage Distribution')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '3_t_vs_n_heatmap.png'))
-plt.close()
+def plot_t_vs_n_heatmap(df, path):
+    plt.figure(figsize=(10, 8))
+    crosstab_tn = pd.crosstab(df['T_stage'], df['N_stage'])
+    sns.heatmap(crosstab_tn, annot=True, fmt='d', cmap='YlOrRd')
+    plt.title('T Stage vs N Stage Distribution')
+    plt.tight_layout()
+    plt.savefig(path)
+
 
 # 4. T vs M Stage Heatmap
-plt.figure(figsize=(10, 8))
-crosstab_tm = pd.crosstab(df['T_stage'], df['M_stage'])
-sns.heatmap(crosstab_tm, annot=True, fmt='d', cmap='YlOrRd')
-plt.title('T Stage vs M Stage Distribution')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '4_t_vs_m_heatmap.png'))
-plt.close()
-
-# 5. Stage Prefix Distribution (c/p)
-def get_prefix(stage):
-    if not isinstance(stage, str):
-        return 'Unknown'
-    match = re.match(r'^([cp])?', stage)
-    return match.group(1).upper() if match and match.group(1) else 'None'
-
-df['T_prefix'] = df['T_stage'].apply(get_prefix)
-df['N_prefix'] = df['N_stage'].apply(get_prefix)
-df['M_prefix'] = df['M_stage'].apply(get_prefix)
-
-fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
-sns.countplot(x='T_prefix', data=df, ax=ax1)
-ax1.set_title('T Stage Prefix Distribution')
-sns.countplot(x='N_prefix', data=df, ax=ax2)
-ax2.set_title('N Stage Prefix Distribution')
-sns.countplot(x='M_prefix', data=df, ax=ax3)
-ax3.set_title('M Stage Prefix Distribution')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '5_prefix_distributions.png'))
-plt.close()
+def plot_t_vs_m_heatmap(df, path):
+    plt.figure(figsize=(10, 8))
+    crosstab_tm = pd.crosstab(df['T_stage'], df['M_stage'])
+    sns.heatmap(crosstab_tm, annot=True, fmt='d', cmap='YlOrRd')
+    plt.title('T Stage vs M Stage Distribution')
+    plt.tight_layout()
+    plt.savefig(path)
+
+
+# 5. Stage Prefix Distribution (c/p/r)
+def plot_prefix_distributions(df, path):
+    df = df.copy()
+    # 'None' if the stage has no prefix, 'Unknown' if there is no stage at all
+    for component in 'TNM':
+        prefix = df[f'{component}_prefix'].str.upper().fillna('None')
+        df[f'{component}_prefix_label'] = prefix.where(df[f'{component}_stage'].notna(), 'Unknown')
+
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
+    sns.countplot(x='T_prefix_label', data=df, ax=ax1)
+    ax1.set_title('T Stage Prefix Distribution')
+    sns.countplot(x='N_prefix_label', data=df, ax=ax2)
+    ax2.set_title('N Stage Prefix Distribution')
+    sns.countplot(x='M_prefix_label', data=df, ax=ax3)
+    ax3.set_title('M Stage Prefix Distribution')
+    plt.tight_layout()
+    plt.savefig(path)
+
 
 # 6. Stage Combinations Network
-import networkx as nx
-plt.figure(figsize=(12, 8))
-G = nx.Graph()
-
-# Create edges between stages that appear together
-for _, row in df.iterrows():
-    if row['T_stage'] and row['N_stage']:
-        G.add_edge(row['T_stage'], row['N_stage'])
-    if row['T_stage'] and row['M_stage']:
-        G.add_edge(row['T_stage'], row['M_stage'])
-    if row['N_stage'] and row['M_stage']:
-        G.add_edge(row['N_stage'], row['M_stage'])
-
-pos = nx.spring_layout(G)
-nx.draw(G, pos, with_labels=True, node_color='lightblue', 
-        node_size=2000, font_size=10, font_weight='bold')
-plt.title('Stage Combinations Network')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '6_stage_network.png'))
-plt.close()
+def plot_stage_network(df, path):
+    import networkx as nx
+    from stage_network import build_stage_graph, stage_layout, export_stage_graph
+    plt.figure(figsize=(12, 8))
+
+    # Edges between stages that appear together, weighted by the number of patients
+    G = build_stage_graph(df)
+    pos = stage_layout(G, cache_dir=os.path.dirname(path))
+    weights = [weight for _, _, weight in G.edges(data='weight')]
+    widths = [1 + 4 * weight / max(weights) for weight in weights] if weights else 1.0
+    nx.draw(G, pos, with_labels=True, node_color='lightblue', width=widths,
+            node_size=2000, font_size=10, font_weight='bold')
+    nx.draw_networkx_edge_labels(G, pos, edge_labels=nx.get_edge_attributes(G, 'weight'), font_size=8)
+    plt.title('Stage Combinations Network')
+    plt.tight_layout()
+    plt.savefig(path)
+
+    # The graph itself, for reuse without recomputing it
+    base = os.path.splitext(path)[0]
+    export_stage_graph(G, base + '.graphml', pos)
+    export_stage_graph(G, base + '.json', pos)
+
 
 # 7. Stacked Bar Chart of M Stage by T Stage
-plt.figure(figsize=(12, 6))
-crosstab_normalized = pd.crosstab(df['T_stage'], df['M_stage'], normalize='index') * 100
-crosstab_normalized.plot(kind='bar', stacked=True)
-plt.title('M Stage Distribution by T Stage')
-plt.xlabel('T Stage')
-plt.ylabel('Percentage')
-plt.legend(title='M Stage')
-plt.tight_layout()
-plt.savefig(os.path.join(plots_dir, '7_m_stage_by_t_stage.png'))
-plt.close()
-
-# Print summary statistics
-print("\nSummary Statistics:")
-print("\nTotal number of patients:", len(df))
-print("\nDistribution of T stages:")
-print(df['T_stage'].value_counts())
-print("\nDistribution of N stages:")
-print(df['N_stage'].value_counts())
-print("\nDistribution of M stages:")
-print(df['M_stage'].value_counts()) 
\ No newline at end of file
+def plot_m_stage_by_t_stage(df, path):
+    plt.figure(figsize=(12, 6))
+    crosstab_normalized = pd.crosstab(df['T_stage'], df['M_stage'], normalize='index') * 100
+    crosstab_normalized.plot(kind='bar', stacked=True)
+    plt.title('M Stage Distribution by T Stage')
+    plt.xlabel('T Stage')
+    plt.ylabel('Percentage')
+    plt.legend(title='M Stage')
+    plt.tight_layout()
+    plt.savefig(path)
+
+
+# name -> (output file, columns the plot reads, drawing function)
+PLOTS = {
+    'complete': ('1_complete_distribution.png', ['tumor_status_clean'], plot_complete_distribution),
+    'stages': ('2_individual_distributions.png', ['T_stage', 'N_stage', 'M_stage'], plot_individual_distributions),
+    't_vs_n': ('3_t_vs_n_heatmap.png', ['T_stage', 'N_stage'], plot_t_vs_n_heatmap),
+    't_vs_m': ('4_t_vs_m_heatmap.png', ['T_stage', 'M_stage'], plot_t_vs_m_heatmap),
+    'prefixes': ('5_prefix_distributions.png',
+                 ['T_stage', 'N_stage', 'M_stage', 'T_prefix', 'N_prefix', 'M_prefix'], plot_prefix_distributions),
+    'network': ('6_stage_network.png', ['T_stage', 'N_stage', 'M_stage'], plot_stage_network),
+    'm_by_t': ('7_m_stage_by_t_stage.png', ['T_stage', 'M_stage'], plot_m_stage_by_t_stage),
+}
+
+
+def slice_hash(name, data):
+    """Hash of everything a plot is drawn from.
+
+    The plots only depend on how often each combination of values occurs, so
+    the counts are hashed rather than the rows: reordering records, or adding
+    records that only differ in other columns, leaves the hash unchanged.
+    """
+    counts = data.value_counts(dropna=False).sort_index()
+    digest = hashlib.sha256(f"{PLOTS_VERSION}/{name}/{list(data.columns)}\n".encode('utf-8'))
+    digest.update(counts.to_csv().encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load_hashes(plots_dir):
+    path = os.path.join(plots_dir, HASHES_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable plot hashes {path}: {str(e)}")
+        return {}
+
+
+def _save_hashes(plots_dir, hashes):
+    path = os.path.join(plots_dir, HASHES_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(hashes.items())), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def render_plot(name, data, path):
+    """Draw one plot to ``path``. Runs in a worker process with --workers."""
+    try:
+        with instrumentation.measure("plot", os.path.basename(path)) as stats:
+            PLOTS[name][2](data, path)
+            stats["records"] = len(data)
+    finally:
+        plt.close('all')
+    return name
+
+
+def _init_plot_worker():
+    # Plots are only saved to files, never shown
+    matplotlib.use('Agg')
+
+
+def generate_plots(df, plots=None, plots_dir=PLOTS_DIR, workers=1, force=False):
+    """Render the selected plots (all by default) from a frame with TNM columns.
+
+    A plot is skipped if its PNG exists and its input hash is the same as when
+    it was last drawn. Returns the names of the plots that were drawn.
+    """
+    os.makedirs(plots_dir, exist_ok=True)
+    hashes = _load_hashes(plots_dir)
+
+    pending = {}
+    for name in plots or PLOTS:
+        file_name, columns, _ = PLOTS[name]
+        data = df[columns]
+        digest = slice_hash(name, data)
+        path = os.path.join(plots_dir, file_name)
+        if not force and hashes.get(name) == digest and os.path.exists(path):
+            print(f"Skipping {file_name} (data unchanged)")
+            continue
+        pending[name] = (data, path, digest)
+
+    drawn = []
+    if workers <= 1 or len(pending) <= 1:
+        for name, (data, path, digest) in pending.items():
+            try:
+                render_plot(name, data, path)
+            except Exception as e:
+                print(f"Error drawing {name}: {str(e)}")
+                continue
+            hashes[name] = digest
+            drawn.append(name)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_plot_worker) as pool:
+            futures = {pool.submit(render_plot, name, data, path): name
+                       for name, (data, path, _) in pending.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error drawing {name}: {str(e)}")
+                    continue
+                hashes[name] = pending[name][2]
+                drawn.append(name)
+
+    _save_hashes(plots_dir, hashes)
+    return sorted(drawn, key=list(PLOTS).index)
+
+
+def print_summary(df):
+    # Print summary statistics
+    print("\nSummary Statistics:")
+    print("\nTotal number of patients:", len(df))
+    print("\nDistribution of T stages:")
+    print(df['T_stage'].value_counts())
+    print("\nDistribution of N stages:")
+    print(df['N_stage'].value_counts())
+    print("\nDistribution of M stages:")
+    print(df['M_stage'].value_counts())
+
+
+def print_registry_summary(registry):
+    # print_summary, with the counts computed by SQLite
+    print("\nSummary Statistics:")
+    print("\nTotal number of patients:", len(registry))
+    for component in 'TNM':
+        column = f'{component}_stage'
+        counts = registry.count(column)
+        counts.pop(None, None)
+        print(f"\nDistribution of {component} stages:")
+        print(pd.Series(counts, name='count', dtype='int64').rename_axis(column))
+
+
+def analyze_registry(registry_file=REGISTRY_FILE, plots=None, plots_dir=PLOTS_DIR, workers=1, force=False):
+    """analyze_tumor_status on the patient registry.
+
+    The TNM columns were parsed when the records were stored, so only they are
+    read (no JSON, no pattern matching), and the summary counts are SQL.
+    """
+    if not os.path.exists(registry_file):
+        print(f"Error: {registry_file} not found. Run extract_patient_data.py first.")
+        return None
+    with PatientRegistry(registry_file) as registry:
+        with instrumentation.measure("load_tumor_status", os.path.basename(str(registry_file))) as stats:
+            df = registry.read_frame(f"SELECT tumor_status, {', '.join(TNM_COLUMNS)} FROM patients "
+                                     f"ORDER BY source_file")
+            df['tumor_status_clean'] = clean_tumor_status(df['tumor_status'])
+            stats["records"] = len(df)
+
+        drawn = generate_plots(df, plots, plots_dir, workers, force)
+        print(f"Drew {len(drawn)} plot(s) in {plots_dir}")
+        print_registry_summary(registry)
+    return df
+
+
+def analyze_tumor_status(path=None, plots=None, plots_dir=PLOTS_DIR, workers=1, force=False):
+    path = path or find_patients_file()
+    with instrumentation.measure("load_tumor_status", os.path.basename(str(path))) as stats:
+        if str(path).endswith('.parquet'):
+            # The Parquet copy already holds the parsed stages
+            df = load_patients(path, columns=['tumor_status', 'T_stage', 'N_stage', 'M_stage'])
+            for column in ['T_stage', 'N_stage', 'M_stage']:
+                # Plain strings, as parsed from JSON, so the plots and their hashes are the same
+                df[column] = df[column].astype(object)
+            df['tumor_status_clean'] = clean_tumor_status(df['tumor_status'])
+            add_prefix_columns(df)
+        else:
+            # Load data from processed_patients.json/.jsonl, reading only the column used here
+            df = load_patients(path, columns=['tumor_status'])
+
+            # Clean and extract components
+            add_tnm_columns(df)
+        stats["records"] = len(df)
+
+    drawn = generate_plots(df, plots, plots_dir, workers, force)
+    print(f"Drew {len(drawn)} plot(s) in {plots_dir}")
+    print_summary(df)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the TNM stage distributions of the extracted patient data")
+    parser.add_argument("--plots", nargs="+", choices=list(PLOTS), metavar="PLOT",
+                        help=f"Plots to draw (default: all): {', '.join(PLOTS)}")
+    parser.add_argument("--plots-dir", default=PLOTS_DIR, help="Directory for the PNG files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes drawing plots in parallel")
+    parser.add_argument("--force", action="store_true",
+                        help="Redraw plots even if their data is unchanged")
+    parser.add_argument("--registry", nargs="?", const=REGISTRY_FILE, metavar="FILE",
+                        help=f"Read the stages from the patient registry (default file: {REGISTRY_FILE}) "
+                             "and count them with SQL instead of reading the JSON records")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    # Plots are only saved to files, never shown; importers keep their own backend
+    matplotlib.use('Agg')
+    with instrumentation.instrumented(args):
+        if args.registry:
+            analyze_registry(args.registry, plots=args.plots, plots_dir=args.plots_dir, workers=args.workers,
+                             force=args.force)
+        else:
+            analyze_tumor_status(plots=args.plots, plots_dir=args.plots_dir, workers=args.workers,
+                                 force=args.force)
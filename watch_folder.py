@@ -0,0 +1,390 @@
+"""Daemon that converts and extracts letters as soon as they land in the input folder.
+
+At startup the spaCy model is loaded and LibreOffice started (when the
+backend may need it), and letters that changed while the daemon was not
+running are caught up on. After that, each new or changed ``.docx`` is
+converted to ``processed_output/`` and its record upserted into the patient
+registry (patient_registry.py) within seconds, without touching any other
+letter. Deleted letters lose their text and registry record.
+
+Changes are noticed through inotify on Linux and by polling the folder
+(``--poll-interval``) elsewhere or with ``--polling``. A letter is only
+picked up once it has not changed for ``--debounce`` seconds and is a
+complete DOCX (zip) file, so letters still being copied or saved are not
+read half-written. Word's ``~$`` lock files are ignored.
+
+The conversion manifest and the extraction cache are shared with the batch
+scripts: ``convert_patient_data_to_txt_*.py`` skips letters the daemon
+converted, and ``extract_patient_data.py`` takes their records from the cache
+when it rebuilds ``processed_patients.json``.
+
+    python watch_folder.py --input-dir patient_data
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import time
+import zipfile
+from functools import partial
+
+import instrumentation
+from conversion_manifest import ConversionManifest
+from extract_patient_data import PatientExtractor
+from extraction_cache import CACHE_FILE, ExtractionCache
+from libreoffice_server import LibreOfficeServer
+from pdf_text import DEFAULT_BACKEND, PDF_BACKENDS
+from patient_registry import REGISTRY_FILE, PatientRegistry
+
+if sys.platform == "win32":
+    import convert_patient_data_to_txt_windows as converter
+else:
+    import convert_patient_data_to_txt_mac as converter
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+# Letters per batch when catching up at startup
+CATCH_UP_BATCH = 32
+
+# inotify(7) event bits
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_letter(name):
+    # Same rule as the conversion scripts: .docx, but not Word's ~$ lock files
+    return name.endswith('.docx') and not name.startswith('~$')
+
+
+def list_letters(input_dir):
+    return sorted(name for name in os.listdir(input_dir) if is_letter(name))
+
+
+class InotifyWatcher:
+    """Names in ``directory`` that changed, from Linux inotify."""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"Cannot watch {directory}")
+        self.directory = directory
+
+    def wait(self, timeout=None):
+        """Names changed within ``timeout`` seconds (None: wait for the first change)."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost: treat every letter as changed
+                    names.update(list_letters(self.directory))
+                elif name:
+                    names.add(os.fsdecode(name))
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Names in ``directory`` that changed, by comparing size and mtime every ``interval`` seconds."""
+
+    def __init__(self, directory, interval=DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._seen = self._snapshot()
+
+    def _snapshot(self):
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        snapshot = self._snapshot()
+        names = {name for name in snapshot.keys() | self._seen.keys()
+                 if snapshot.get(name) != self._seen.get(name)}
+        self._seen = snapshot
+        return names
+
+    def close(self):
+        pass
+
+
+def make_watcher(directory, polling=False, poll_interval=DEFAULT_POLL_INTERVAL):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except OSError as e:
+            print(f"Warning: {str(e)}. Polling {directory} instead.")
+    return PollingWatcher(directory, poll_interval)
+
+
+class LetterWatcher:
+    """Keeps processed_output/, the manifest and the registry in step with the input folder."""
+
+    def __init__(self, input_dir, output_dir, extractor, registry, server=None, backend="auto",
+                 pdf_backend=DEFAULT_BACKEND):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.extractor = extractor
+        self.registry = registry
+        self.server = server
+        self.manifest = ConversionManifest(output_dir)
+        self.converter = f"{converter.CONVERTER_VERSION}/{backend}"
+        if pdf_backend != DEFAULT_BACKEND:
+            self.converter += f"/{pdf_backend}"
+        self._process_docx = partial(converter.process_docx, backend=backend, pdf_backend=pdf_backend)
+        self.processed = 0
+        self.failed = 0
+
+    def text_path(self, name):
+        return os.path.join(self.output_dir, f"{os.path.splitext(name)[0]}.txt")
+
+    def catch_up(self):
+        """Handle the letters added, changed or deleted while the daemon was not running."""
+        letters = list_letters(self.input_dir)
+        self.remove_deleted(letters)
+        stale = [name for name in letters
+                 if not self.manifest.is_current(name, os.path.join(self.input_dir, name), self.converter)
+                 or os.path.basename(self.text_path(name)) not in self.registry]
+        if stale:
+            print(f"Catching up on {len(stale)} letters ({len(letters) - len(stale)} up to date)...")
+            for i in range(0, len(stale), CATCH_UP_BATCH):
+                self.handle(stale[i:i + CATCH_UP_BATCH])
+        else:
+            self.manifest.save()
+
+    def remove_deleted(self, letters):
+        removed = self.manifest.remove_missing(letters)
+        if removed:
+            self.registry.remove(removed)
+            print(f"Removed {len(removed)} letters that were deleted: {', '.join(removed)}")
+        return removed
+
+    def handle(self, names, detected=None):
+        """Convert and extract the given letters; deleted ones are removed."""
+        detected = detected or {}
+        texts, sources = [], []
+        for name in names:
+            input_path = os.path.join(self.input_dir, name)
+            if not os.path.exists(input_path):
+                continue
+            if not zipfile.is_zipfile(input_path):
+                # Still being written; the next change queues it again
+                print(f"Waiting for {name}: not a complete .docx yet")
+                continue
+            text_path = self.text_path(name)
+            source_file = os.path.basename(text_path)
+            current = self.manifest.is_current(name, input_path, self.converter)
+            if current and source_file in self.registry:
+                # Touched, but the content is the same
+                continue
+            if not current:
+                # The Windows converter returns a token count, so only None/False mean failure
+                result = self._process_docx(input_path, text_path, self.server)
+                if result is None or result is False:
+                    self.failed += 1
+                    # Don't keep serving the letter's previous version
+                    self.registry.remove([source_file])
+                    if os.path.exists(text_path):
+                        os.remove(text_path)
+                    continue
+                self.manifest.record(name, input_path, self.converter, text_path)
+            with open(text_path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+            sources.append(source_file)
+        self.remove_deleted(list_letters(self.input_dir))
+        self.manifest.save()
+        if not texts:
+            return
+
+        # Letters arriving together go through spaCy as one batch
+        try:
+            infos = list(self.extractor.extract_many(texts, names=sources))
+        except Exception:
+            # Redo the batch one letter at a time to isolate the failing letter(s)
+            infos = None
+        updated = []
+        for i, (source_file, text) in enumerate(zip(sources, texts)):
+            if infos is not None:
+                info = infos[i]
+            else:
+                try:
+                    info = self.extractor.extract(text, source_file)
+                except Exception as e:
+                    # Not in the registry, so its next change (or catch_up) extracts it again
+                    print(f"Error processing {source_file}: {str(e)}")
+                    self.failed += 1
+                    continue
+            info["source_file"] = source_file
+            self.registry.add(info)
+            self.processed += 1
+            updated.append(source_file)
+        self.registry.flush()
+        if self.extractor.cache is not None:
+            self.extractor.cache.commit()
+        now = time.monotonic()
+        for source_file in updated:
+            name = source_file[:-len(".txt")] + ".docx"
+            latency = now - detected[name] if name in detected else None
+            if latency is not None:
+                # Change noticed to record queryable, including the debounce wait
+                instrumentation.record("watch_latency", name, latency)
+            print(f"Updated {source_file}" + (f" ({latency:.1f}s after the change)" if latency is not None else ""),
+                  flush=True)
+
+
+def watch(letters, watcher, debounce=DEFAULT_DEBOUNCE):
+    """Run until interrupted, handing settled letters to ``letters.handle``."""
+    # Letter -> time of its last change, and of the first change since it was last handled
+    last_change, first_change = {}, {}
+    while True:
+        timeout = None
+        if last_change:
+            timeout = max(0.0, min(last_change.values()) + debounce - time.monotonic())
+        changed = watcher.wait(timeout)
+        now = time.monotonic()
+        for name in changed:
+            if is_letter(name):
+                last_change[name] = now
+                first_change.setdefault(name, now)
+
+        settled = sorted(name for name, changed_at in last_change.items() if now - changed_at >= debounce)
+        if not settled:
+            continue
+        detected = {name: first_change.pop(name) for name in settled}
+        for name in settled:
+            del last_change[name]
+        try:
+            letters.handle(settled, detected)
+        except Exception as e:
+            # One bad batch must not stop the daemon
+            print(f"Error processing {', '.join(settled)}: {str(e)}")
+            letters.failed += len(settled)
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_daemon(input_dir="patient_data", output_dir="processed_output", backend="auto",
+               pdf_backend=DEFAULT_BACKEND, debounce=DEFAULT_DEBOUNCE, polling=False,
+               poll_interval=DEFAULT_POLL_INTERVAL, windowed=False, keep_repeated_blocks=False,
+               cache_file=CACHE_FILE, registry_file=REGISTRY_FILE):
+    os.makedirs(output_dir, exist_ok=True)
+    # LibreOffice is only located when the chosen backend may need it
+    soffice_path = None
+    if backend != "docx":
+        try:
+            soffice_path = converter.find_soffice()
+        except FileNotFoundError as e:
+            if backend == "libreoffice":
+                raise
+            print(f"Warning: {str(e)} Using native DOCX extraction only.")
+
+    cache = ExtractionCache(cache_file) if cache_file else None
+    registry = PatientRegistry(registry_file)
+    server = LibreOfficeServer(soffice_path) if soffice_path else None
+    watcher = letters = None
+    try:
+        extractor = PatientExtractor(windowed=windowed, keep_repeated_blocks=keep_repeated_blocks, cache=cache)
+        # Everything slow to start is started now, not on the first letter
+        start = time.perf_counter()
+        extractor.nlp
+        if server is not None:
+            server.start()
+        print(f"Model{' and LibreOffice' if server is not None else ''} ready in "
+              f"{time.perf_counter() - start:.1f}s")
+
+        letters = LetterWatcher(input_dir, output_dir, extractor, registry, server, backend, pdf_backend)
+        # Watch before catching up, so nothing written in between is missed
+        watcher = make_watcher(input_dir, polling, poll_interval)
+        letters.catch_up()
+        print(f"Watching {input_dir} ({'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'}, "
+              f"debounce {debounce:.1f}s); Ctrl+C to stop", flush=True)
+        watch(letters, watcher, debounce)
+    except KeyboardInterrupt:
+        if letters is not None:
+            print(f"\nStopped: {letters.processed} letters processed, {letters.failed} failed")
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if server is not None:
+            server.stop()
+        registry.close()
+        if cache is not None:
+            cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert and extract letters as they are added to the input folder")
+    parser.add_argument("--input-dir", default="patient_data", help="Directory with the .docx letters")
+    parser.add_argument("--output-dir", default="processed_output", help="Directory for the letter texts")
+    parser.add_argument("--backend", choices=["auto", "docx", "libreoffice"], default="auto",
+                        help="docx: read the DOCX directly; libreoffice: convert via PDF; "
+                             "auto: read directly and only fall back to LibreOffice on failure")
+    parser.add_argument("--pdf-backend", choices=list(PDF_BACKENDS), default=DEFAULT_BACKEND,
+                        help="Engine that reads the text of the LibreOffice PDFs (see pdf_text.py)")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help="Seconds a letter must stay unchanged before it is processed")
+    parser.add_argument("--polling", action="store_true", help="Poll the folder even where inotify is available")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Seconds between two looks at the folder when polling")
+    parser.add_argument("--windowed", action="store_true",
+                        help="Only run spaCy on the region around \"wir berichten über\"")
+    parser.add_argument("--keep-repeated-blocks", action="store_true",
+                        help="Pass headers/footers repeated on every page to spaCy each time "
+                             "instead of only once per letter")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Don't store the records in the extraction cache {CACHE_FILE}")
+    parser.add_argument("--registry", default=REGISTRY_FILE, help="Registry the records are upserted into")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: Input directory '{args.input_dir}' does not exist!")
+        sys.exit(1)
+    # Stop cleanly (closing LibreOffice and the databases) when a service manager ends the daemon
+    signal.signal(signal.SIGTERM, _stop)
+    with instrumentation.instrumented(args):
+        run_daemon(input_dir=args.input_dir, output_dir=args.output_dir, backend=args.backend,
+                   pdf_backend=args.pdf_backend, debounce=args.debounce, polling=args.polling,
+                   poll_interval=args.poll_interval, windowed=args.windowed,
+                   keep_repeated_blocks=args.keep_repeated_blocks,
+                   cache_file=None if args.no_cache else CACHE_FILE, registry_file=args.registry)